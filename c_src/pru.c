@@ -1,8 +1,12 @@
 // Reads data from the analog drop sensors very fast.
 
+#include <errno.h>
+#include <pthread.h>
 #include <stdbool.h>
 #include <stdint.h>
 #include <stdio.h>
+#include <string.h>
+#include <time.h>
 #include <unistd.h>
 
 #include "pruio_c_wrapper.h"
@@ -12,11 +16,49 @@
 #define LEFT_AIN 1
 #define RIGHT_AIN 2
 
+// How many samples the ring buffer holds. At the default rate, this is about
+// four seconds worth.
+#define RING_SIZE 4096
+
+// A single reading from both drop sensors. This has to match
+// DROP_SAMPLE_DTYPE in sensors.py.
+typedef struct {
+  // Monotonic clock time it was taken at, in seconds.
+  double timestamp;
+  // Counts up from 1 for every sample.
+  uint64_t sequence;
+  uint16_t left;
+  uint16_t right;
+  uint32_t padding;
+} DropSample;
+
 static PruIo *io = NULL;
 
+// Everything below is protected by ring_lock.
+static pthread_mutex_t ring_lock = PTHREAD_MUTEX_INITIALIZER;
+// Signalled whenever the event count changes.
+static pthread_cond_t event_cond = PTHREAD_COND_INITIALIZER;
+static DropSample ring[RING_SIZE];
+// Sequence number of the newest sample.
+static uint64_t head = 0;
+// How many times both sensors went from above the threshold to at or below it.
+static uint64_t event_count = 0;
+static int threshold = 25000;
+// Whether the last sample was at or below the threshold.
+static bool below = false;
+
+static pthread_t sampler;
+static bool sampling = false;
+// Time between samples, in nanoseconds.
+static long period = 1000000;
+
+void StopDropSampling();
+
 // Destroys PRU system.
 void Cleanup() {
+  StopDropSampling();
   pruio_destroy(io);
+  io = NULL;
 }
 
 // Initializes PRU system.
@@ -51,3 +93,171 @@ int GetLeftDrop() {
 int GetRightDrop() {
   return GetDrop(RIGHT_AIN);
 }
+
+// Takes a sample and puts it in the ring.
+static void TakeSample(const struct timespec *now) {
+  uint16_t left = io->Value[LEFT_AIN + 1];
+  uint16_t right = io->Value[RIGHT_AIN + 1];
+  uint16_t highest = left > right ? left : right;
+
+  pthread_mutex_lock(&ring_lock);
+
+  ++head;
+  DropSample *sample = &ring[head % RING_SIZE];
+  sample->timestamp = now->tv_sec + now->tv_nsec * 1e-9;
+  sample->sequence = head;
+  sample->left = left;
+  sample->right = right;
+
+  // Both sensors have to see a drop, like in the safety program.
+  if (highest <= threshold && !below) {
+    ++event_count;
+    pthread_cond_broadcast(&event_cond);
+  }
+  below = highest <= threshold;
+
+  pthread_mutex_unlock(&ring_lock);
+}
+
+// Takes samples on a fixed schedule until we stop sampling.
+static void *Sample(void *arg) {
+  struct timespec next;
+  clock_gettime(CLOCK_MONOTONIC, &next);
+
+  while (true) {
+    pthread_mutex_lock(&ring_lock);
+    bool keep_going = sampling;
+    pthread_mutex_unlock(&ring_lock);
+    if (!keep_going) {
+      break;
+    }
+
+    TakeSample(&next);
+
+    next.tv_nsec += period;
+    while (next.tv_nsec >= 1000000000) {
+      next.tv_nsec -= 1000000000;
+      ++next.tv_sec;
+    }
+    while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &next, NULL) ==
+           EINTR);
+  }
+
+  return NULL;
+}
+
+// Starts sampling both drop sensors into the ring buffer every period_us
+// microseconds, counting an event every time both of them go to or below
+// drop_threshold. Returns false if it couldn't start.
+bool StartDropSampling(int period_us, int drop_threshold) {
+  if (!io || period_us <= 0) {
+    return false;
+  }
+
+  pthread_mutex_lock(&ring_lock);
+  if (sampling) {
+    pthread_mutex_unlock(&ring_lock);
+    return true;
+  }
+  period = period_us * 1000L;
+  threshold = drop_threshold;
+  below = false;
+  sampling = true;
+  pthread_mutex_unlock(&ring_lock);
+
+  if (pthread_create(&sampler, NULL, Sample, NULL)) {
+    pthread_mutex_lock(&ring_lock);
+    sampling = false;
+    pthread_mutex_unlock(&ring_lock);
+    return false;
+  }
+
+  return true;
+}
+
+// Stops the sampling thread.
+void StopDropSampling() {
+  pthread_mutex_lock(&ring_lock);
+  bool was_sampling = sampling;
+  sampling = false;
+  pthread_mutex_unlock(&ring_lock);
+
+  if (was_sampling) {
+    pthread_join(sampler, NULL);
+  }
+}
+
+// Returns the sequence number of the newest sample, or 0 if there aren't any.
+unsigned long long GetDropSampleHead() {
+  pthread_mutex_lock(&ring_lock);
+  uint64_t newest = head;
+  pthread_mutex_unlock(&ring_lock);
+
+  return newest;
+}
+
+// Copies every sample newer than cursor that is still in the ring into buffer,
+// oldest first, until it runs out of room. Returns how many samples it copied.
+// If the first one's sequence number isn't cursor + 1, we fell behind and some
+// were lost.
+int ReadDropSamples(unsigned long long cursor, char *buffer, size_t size) {
+  size_t room = size / sizeof(DropSample);
+
+  pthread_mutex_lock(&ring_lock);
+
+  uint64_t first = cursor + 1;
+  if (head >= RING_SIZE && first <= head - RING_SIZE) {
+    first = head - RING_SIZE + 1;
+  }
+  size_t count = 0;
+  if (head >= first) {
+    count = head - first + 1;
+  }
+  if (count > room) {
+    count = room;
+  }
+
+  for (size_t i = 0; i < count; ++i) {
+    memcpy(buffer + i * sizeof(DropSample), &ring[(first + i) % RING_SIZE],
+           sizeof(DropSample));
+  }
+
+  pthread_mutex_unlock(&ring_lock);
+
+  return count;
+}
+
+// Returns how many drop events there have been.
+unsigned long long GetDropEventCount() {
+  pthread_mutex_lock(&ring_lock);
+  uint64_t count = event_count;
+  pthread_mutex_unlock(&ring_lock);
+
+  return count;
+}
+
+// Waits until the event count is more than last_count, for up to timeout_ms
+// milliseconds. Returns the event count.
+unsigned long long WaitForDropEvent(unsigned long long last_count,
+                                    int timeout_ms) {
+  struct timespec deadline;
+  clock_gettime(CLOCK_REALTIME, &deadline);
+  deadline.tv_sec += timeout_ms / 1000;
+  deadline.tv_nsec += (timeout_ms % 1000) * 1000000L;
+  if (deadline.tv_nsec >= 1000000000) {
+    deadline.tv_nsec -= 1000000000;
+    ++deadline.tv_sec;
+  }
+
+  pthread_mutex_lock(&ring_lock);
+  while (event_count <= last_count) {
+    if (pthread_cond_timedwait(&event_cond, &ring_lock, &deadline) ==
+        ETIMEDOUT) {
+      break;
+    }
+  }
+  uint64_t count = event_count;
+  pthread_mutex_unlock(&ring_lock);
+
+  return count;
+}
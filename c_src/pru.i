@@ -4,9 +4,26 @@
 
 %{
 #include <stdbool.h>
+#include <stddef.h>
 %}
 
+/* Lets ReadDropSamples write right into anything with the buffer protocol,
+like a numpy array. */
+%include <pybuffer.i>
+%pybuffer_mutable_binary(char *buffer, size_t size);
+
+/* This gets built with -threads, so the GIL is released while we wait for
+events. */
+
 void Cleanup();
 bool Init();
 int GetLeftDrop();
 int GetRightDrop();
+
+bool StartDropSampling(int period_us, int drop_threshold);
+void StopDropSampling();
+unsigned long long GetDropSampleHead();
+int ReadDropSamples(unsigned long long cursor, char *buffer, size_t size);
+unsigned long long GetDropEventCount();
+unsigned long long WaitForDropEvent(unsigned long long last_count,
+                                    int timeout_ms);
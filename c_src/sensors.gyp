@@ -5,6 +5,7 @@
       'type': 'shared_library',
       'cflags': [
         '-fPIC',
+        '-std=gnu99',
         '-I"/usr/include/python2.7"',
       ],
       'ldflags': [
@@ -30,7 +31,7 @@
             'pru_wrap.c',
             'pru.py',
           ],
-          'action': ['swig', '-python', '<@(_inputs)'],
+          'action': ['swig', '-python', '-threads', '<@(_inputs)'],
         },
       ],
     },
@@ -0,0 +1,25 @@
+# A clock that only ever goes forward, for measuring how long things take.
+# Python 2 doesn't have time.monotonic(), so we ask libc.
+
+import ctypes
+import ctypes.util
+import os
+
+CLOCK_MONOTONIC = 1
+
+class Timespec(ctypes.Structure):
+  _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+__libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+__clock_gettime = __libc.clock_gettime
+__clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+
+# Returns the current time on the monotonic clock. This has nothing to do with
+# the wall clock, but it is the same in every process. (seconds)
+def monotonic():
+  spec = Timespec()
+  if __clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec)) != 0:
+    error = ctypes.get_errno()
+    raise OSError(error, os.strerror(error))
+
+  return spec.tv_sec + spec.tv_nsec * 1e-9
@@ -0,0 +1,286 @@
+# Keeps log messages in a compact binary format that can be searched by time,
+# program and level without reading everything.
+#
+# Messages are appended to segment files, which are named after the time of
+# their first message. Each segment has an index file next to it with one entry
+# for every block of about block_size bytes, giving the block's time range,
+# where it is, and masks of which levels and programs are in it. Anything
+# after the last full block isn't indexed yet, so it always gets read.
+
+import os
+import struct
+import zlib
+
+# Levels in the order of their codes.
+LEVEL_NAMES = ["DEBUG", "INFO", "WARNING", "ERROR", "FATAL"]
+LEVEL_CODES = dict((name, code) for code, name in enumerate(LEVEL_NAMES))
+
+# How much older than what's already stored a message can be when it shows up,
+# since messages are stamped when they're logged, not when they're stored.
+# (seconds)
+MAX_LATENESS = 10
+
+# Timestamp, level, program name length and message length.
+RECORD_HEADER = struct.Struct("<dBBI")
+# First and last timestamp, offset, length, level mask and program mask.
+INDEX_ENTRY = struct.Struct("<ddQIBI")
+
+# Gets the bit for a program in the program masks.
+def program_bit(name):
+  return 1 << (zlib.crc32(name) % 32)
+
+# Gets the mask for every level at least as important as this one.
+def level_mask(level):
+  mask = 0
+  for code in range(LEVEL_CODES[level], len(LEVEL_NAMES)):
+    mask |= 1 << code
+
+  return mask
+
+# Decodes all the complete records in a chunk of data. Returns a list of
+# (offset, timestamp, level, program, message).
+def decode_records(data, base_offset = 0):
+  records = []
+  position = 0
+  while position + RECORD_HEADER.size <= len(data):
+    timestamp, level, name_length, message_length = \
+        RECORD_HEADER.unpack_from(data, position)
+    start = position + RECORD_HEADER.size
+    end = start + name_length + message_length
+    if end > len(data):
+      # Still being written.
+      break
+
+    name = data[start:(start + name_length)]
+    message = data[(start + name_length):end].decode("utf-8", "replace")
+    records.append((base_offset + position, timestamp, LEVEL_NAMES[level],
+        name, message))
+    position = end
+
+  return records
+
+# Encodes a single record.
+def encode_record(timestamp, level, name, message):
+  if isinstance(message, unicode):
+    message = message.encode("utf-8")
+  else:
+    message = str(message)
+  name = name[:255]
+
+  return RECORD_HEADER.pack(timestamp, LEVEL_CODES.get(level, 0), len(name),
+      len(message)) + name + message
+
+# Writes messages into the store. Only one process should do this.
+class LogStore:
+  # We start a new segment once the current one gets this big. (bytes)
+  segment_size = 4000000
+  # How much gets written between index entries. (bytes)
+  block_size = 65536
+  # Maximum space used by all the segments. (bytes)
+  max_size = 200000000
+
+  def __init__(self, location):
+    self.location = location
+    if not os.path.exists(self.location):
+      os.makedirs(self.location)
+
+    # Paths and sizes of the finished segments, oldest first.
+    self.old_segments = []
+    for name in list_segments(self.location):
+      path = os.path.join(self.location, name)
+      size = os.path.getsize(path)
+      if os.path.exists(path[:-4] + ".idx"):
+        size += os.path.getsize(path[:-4] + ".idx")
+      self.old_segments.append((path, size))
+
+    self.segment = None
+
+  # Starts a new segment.
+  def __open(self, timestamp):
+    name = "%017.6f" % (timestamp)
+    while os.path.exists(os.path.join(self.location, name + ".rec")):
+      # We don't want to append to something that's already there.
+      timestamp += 0.000001
+      name = "%017.6f" % (timestamp)
+
+    path = os.path.join(self.location, name)
+    self.segment = open(path + ".rec", "ab")
+    self.index = open(path + ".idx", "ab")
+    self.segment_path = path + ".rec"
+    self.segment_written = 0
+    self.__start_block()
+
+  def __start_block(self):
+    self.block_offset = self.segment_written
+    self.block_first = None
+    self.block_last = None
+    self.block_levels = 0
+    self.block_programs = 0
+
+  # Writes the index entry for the current block.
+  def __finish_block(self):
+    if self.block_first == None:
+      return
+
+    self.index.write(INDEX_ENTRY.pack(self.block_first, self.block_last,
+        self.block_offset, self.segment_written - self.block_offset,
+        self.block_levels, self.block_programs))
+    self.index.flush()
+    self.__start_block()
+
+  # Finishes the current segment, and removes old ones if we're using too much
+  # space.
+  def __close(self):
+    self.__finish_block()
+    self.segment.close()
+    self.index.close()
+    self.old_segments.append((self.segment_path,
+        self.segment_written + os.path.getsize(self.segment_path[:-4] + \
+        ".idx")))
+    self.segment = None
+
+    size = sum(segment[1] for segment in self.old_segments)
+    while (size > self.max_size and self.old_segments):
+      path, segment_size = self.old_segments.pop(0)
+      size -= segment_size
+      for extension in (".rec", ".idx"):
+        try:
+          os.remove(path[:-4] + extension)
+        except OSError:
+          pass
+
+  # Appends a batch of (timestamp, level, program, message) and flushes them.
+  def append(self, messages):
+    if not messages:
+      return
+    if not self.segment:
+      self.__open(messages[0][0])
+
+    data = []
+    for timestamp, level, name, message in messages:
+      record = encode_record(timestamp, level, name, message)
+      data.append(record)
+
+      # Messages get stamped when they're logged, so they aren't always in
+      # order.
+      if self.block_first == None:
+        self.block_first = timestamp
+        self.block_last = timestamp
+      self.block_first = min(self.block_first, timestamp)
+      self.block_last = max(self.block_last, timestamp)
+      self.block_levels |= 1 << LEVEL_CODES.get(level, 0)
+      self.block_programs |= program_bit(name)
+      self.segment_written += len(record)
+
+    self.segment.write("".join(data))
+    self.segment.flush()
+
+    if self.segment_written - self.block_offset >= self.block_size:
+      self.__finish_block()
+    if self.segment_written >= self.segment_size:
+      self.__close()
+
+  def close(self):
+    if self.segment:
+      self.__close()
+
+# Returns the names of the segments in a directory, oldest first.
+def list_segments(location):
+  try:
+    names = os.listdir(location)
+  except OSError:
+    return []
+
+  return sorted([name for name in names if name.endswith(".rec")])
+
+# Reads the index for a segment. Returns a list of (first, last, offset,
+# length, level mask, program mask).
+def read_index(path):
+  try:
+    with open(path[:-4] + ".idx", "rb") as index_file:
+      data = index_file.read()
+  except IOError:
+    return []
+
+  count = len(data) // INDEX_ENTRY.size
+  return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) \
+      for i in range(count)]
+
+# Finds messages from start to end, from any of a list of programs, at least as
+# important as level. Returns up to limit of them as (timestamp, level,
+# program, message), oldest first, along with a cursor to pass back in to get
+# the next page, or None if there isn't one.
+def query(location, start = None, end = None, programs = None, level = None,
+          limit = 100, cursor = None):
+  start = start or 0
+  end = end or float("inf")
+  wanted_levels = level_mask(level) if level else (1 << len(LEVEL_NAMES)) - 1
+  wanted_programs = 0
+  if programs:
+    for name in programs:
+      wanted_programs |= program_bit(name)
+
+  segments = list_segments(location)
+  # The segment and offset to start from.
+  resume_segment, resume_offset = None, 0
+  if cursor:
+    resume_segment, resume_offset = cursor.split(":")
+    resume_offset = int(resume_offset)
+
+  results = []
+  for i, name in enumerate(segments):
+    if (resume_segment and name < resume_segment):
+      continue
+    # Everything in a segment comes before the next segment starts, give or
+    # take messages that show up late.
+    if (i + 1 < len(segments) and \
+        float(segments[i + 1][:-4]) + MAX_LATENESS < start):
+      continue
+    if float(name[:-4]) - MAX_LATENESS > end:
+      break
+
+    path = os.path.join(location, name)
+    offset = resume_offset if name == resume_segment else 0
+
+    # Work out which parts of the file we need to read.
+    chunks = []
+    indexed_end = 0
+    for first, last, block_offset, length, levels, block_programs in \
+        read_index(path):
+      indexed_end = block_offset + length
+      if block_offset + length <= offset:
+        continue
+      if (last < start or first > end):
+        continue
+      if not levels & wanted_levels:
+        continue
+      if (programs and not block_programs & wanted_programs):
+        continue
+      chunks.append((block_offset, length))
+    # The part that isn't indexed yet.
+    chunks.append((indexed_end, None))
+
+    with open(path, "rb") as segment:
+      for chunk_offset, length in chunks:
+        segment.seek(chunk_offset)
+        if length == None:
+          data = segment.read()
+        else:
+          data = segment.read(length)
+
+        for record in decode_records(data, chunk_offset):
+          record_offset, timestamp, record_level, program, message = record
+          if record_offset < offset:
+            continue
+          if not (start <= timestamp <= end):
+            continue
+          if not (1 << LEVEL_CODES[record_level]) & wanted_levels:
+            continue
+          if (programs and program not in programs):
+            continue
+
+          if len(results) == limit:
+            return (results, "%s:%d" % (name, record_offset))
+          results.append((timestamp, record_level, program, message))
+
+  return (results, None)
@@ -0,0 +1,42 @@
+# Lists which programs get run together, so that we don't have to start
+# everything every time.
+
+import os
+
+# The profile to use if none is given on the command line.
+DEFAULT_PROFILE = os.environ.get("NEATO_PROFILE", "full")
+
+# Each profile is a list of the programs in it. None means every program in the
+# programs directory. Anything that a listed program has a pipe to gets started
+# too.
+PROFILES = {
+  "full": None,
+  # Driving the robot around from the web interface.
+  "teleop": ["control", "log", "safety", "watchdog", "continuous_driving",
+      "web_interface", "silence_dhcp"],
+  # Teleop without anyone watching.
+  "headless": ["control", "log", "safety", "watchdog", "continuous_driving"],
+  # The whole navigation stack, without the test program.
+  "navigation": ["control", "log", "safety", "watchdog", "continuous_driving",
+      "web_interface", "silence_dhcp", "slam_controller", "nav_controller"],
+}
+
+# Returns the names of all the programs in a directory.
+def available_programs(directory = "programs"):
+  names = []
+  for name in sorted(os.listdir(directory)):
+    if (name[-3:] == ".py" and name != "__init__.py"):
+      names.append(name[:-3])
+
+  return names
+
+# Returns the names of the programs in a profile.
+def get_profile(name, directory = "programs"):
+  try:
+    programs = PROFILES[name]
+  except KeyError:
+    raise ValueError("No profile with name '%s' exists." % (name))
+
+  if programs == None:
+    return available_programs(directory)
+  return list(programs)
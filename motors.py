@@ -1,31 +1,62 @@
 # Handles operations concerning motors on the robot.
 
+import collections
+import os
+import threading
 import time
 
 from programs import log
-from rate import Rate
-from sensors import LDS
 
 import math
+import numpy as np
 import robot_status
+import sensors
 import serial_api as control
 import slam_controller
 
+# Gets the left and right wheel distances and speed for turning in place by a
+# certain number of degrees. Positive for counter-clockwise, negative for
+# clockwise.
+def turn_distances(angle):
+  circumference = robot_status.ROBOT_WIDTH * math.pi
+  distance = angle * circumference / 360
+
+  speed = abs(angle) * 300 / 90
+  speed = min(speed, 300)
+
+  return (-distance, distance, speed)
+
+# Gets the left and right wheel distances for driving along an arc of a certain
+# radius (mm, to the middle of the robot) for a certain number of degrees.
+# Positive angles curve to the left, negative to the right.
+def arc_distances(radius, angle):
+  theta = math.radians(angle)
+  half_width = robot_status.ROBOT_WIDTH / 2.0
+
+  return ((radius - half_width) * theta, (radius + half_width) * theta)
+
+# Sines and cosines of every LDS angle. 90 degrees is straight ahead.
+SINES = np.sin(np.radians(np.arange(360)))
+COSINES = np.cos(np.radians(np.arange(360)))
+
 class Wheels:
   enabled = False
 
+  # Fastest safe_drive will go. (mm/s)
+  max_safe_speed = 200
+  # How close something has to be in safe_drive before we watch it. (mm)
+  watch_distance = 450
+  # Half the width of the path the robot sweeps out, with some room to spare.
+  # (mm)
+  footprint_half_width = 190
+  # We stop if something in our path would get closer than stop_distance (mm)
+  # within reaction_time (seconds) at the speed it's coming towards us.
+  stop_distance = 200
+  reaction_time = 1
+
   def __init__(self):
     self.enable()
-
-  # Waits for motors to be stopped.
-  def __wait_for_stop(self):
-    while self.get_wheel_rpms(stale_time = 0)[0] != 0:
-      time.sleep(0.1)
-    while self.get_wheel_rpms(stale_time = 0)[1] != 0:
-      time.sleep(0.1)
-
-    robot_status.is_not_driving()
-    slam_controller.wheels_stopped(self.get_distance())
+    self.motion = motion_executor()
 
   # Enables both drive motors.
   def enable(self):
@@ -36,28 +67,40 @@ class Wheels:
   # Disables both drive motors.
   def disable(self):
     if self.enabled:
-      control.send_command("SetMotor LWheelDisable RWheelDisable")
+      robot_status.cancel_motions()
+      control.send_command(control.DISABLE_COMMAND,
+          priority = control.EMERGENCY)
       self.enabled = False
       robot_status.is_not_driving()
 
   # A version of drive that employs the LDS in order to not crash into things.
   def safe_drive(self, left_dist, right_dist, speed):
-    # Max speed here is 200 for safety reasons.
-    speed = min(speed, 200)
+    speed = min(speed, Wheels.max_safe_speed)
+
+    lds = sensors.shared_lds()
+    try:
+      self.__safe_drive(lds, left_dist, right_dist, speed)
+    finally:
+      # Don't keep the LDS spinning once we're done with it.
+      sensors.release_shared_lds()
 
-    lds = LDS()
+  # Does the driving for safe_drive, once we have the LDS.
+  def __safe_drive(self, lds, left_dist, right_dist, speed):
     paused = True
-    watching = {}
-    danger = []
     initial_distance = self.get_distance(stale_time = 0)
 
-    rate = Rate()
+    # Which way we're going. For turning in place, anything coming towards us
+    # is a problem.
+    direction = np.sign(left_dist + right_dist)
 
-    while True:
-      # Even at max speed, it will take at least this long for anything to
-      # change.
-      rate.rate(0.03)
+    # Distances from the last scan, and when it was taken.
+    previous = np.empty(360)
+    previous.fill(np.nan)
+    previous_time = None
+    # Angles where there is something that is getting too close.
+    danger = np.zeros(360, dtype = bool)
 
+    while True:
       # Check if we're done.
       if not paused:
         rpms = self.get_wheel_rpms(stale_time = 0)
@@ -66,49 +109,54 @@ class Wheels:
           break
 
       # Get newest data from LDS.
-      packet = lds.get_scan()
-
-      # Anything fewer than a certain distance away we want to watch.
-      watch_distance = 450
-      for key in packet.keys():
-        if (packet[key][0] < watch_distance and key not in watching.keys()):
-          watching[key] = packet[key][0]
-        if packet[key][0] > watch_distance:
-          # Check if this is something that moved away.
-          if key in danger:
-            danger.remove(key)
-          if key in watching.keys():
-            watching.pop(key, None)
-
-      # Keys that caused errors get automatically removed from the danger list.
-      for key in danger:
-        if key not in packet.keys():
-          danger.remove(key)
-
-      # Check if anything we're watching got any closer.
-      to_delete = []
-      for key in watching.keys():
-        try:
-          new = packet[key][0]
-        except KeyError:
+      scan = lds.wait_for_scan(timeout = 1, copy = False)
+      if scan:
+        sequence, timestamp, readings = scan
+        distances = sensors.to_distance_array(readings)
+        if not lds.scan_valid(sequence):
+          # It got overwritten while we were reading it.
           continue
+      else:
+        log.warning("Safe drive: No scans in the scan ring.")
+        timestamp = time.time()
+        distances = sensors.to_distance_array(
+            lds.get_scan_array(stale_time = 0))
+
+      valid = ~np.isnan(distances)
+      # Only things that we could run into matter.
+      if direction:
+        ahead = distances * SINES * direction
+        sideways = np.abs(distances * COSINES)
+        in_path = (ahead > 0) & (sideways <= Wheels.footprint_half_width)
+      else:
+        in_path = valid
+      watching = valid & in_path & (distances < Wheels.watch_distance)
 
-        dx = new - watching[key]
-        if dx < 0:
-          # It got closer. We should stop moving.
-          to_delete.append(key)
-          if key not in danger:
-            danger.append(key)
+      # See how fast everything we're watching is coming towards us, and where
+      # it will be by the time we can react.
+      if previous_time:
+        with np.errstate(invalid = "ignore"):
+          closing_speed = (previous - distances) / \
+              max(timestamp - previous_time, 0.001)
+          predicted = distances - closing_speed * Wheels.reaction_time
+          new_danger = watching & (closing_speed > 0) & \
+              (predicted < Wheels.stop_distance)
+        danger |= new_danger
 
-      for key in to_delete:
-        watching.pop(key, None)
+      # Anything that moved away or that we lost track of isn't a danger
+      # anymore.
+      danger &= valid & (distances < Wheels.watch_distance)
+
+      previous = distances
+      previous_time = timestamp
 
       # Stop the motors if we have to.
-      if (len(danger) and not paused):
-        log.warning("Stopping due to obstacle.")
+      if (danger.any() and not paused):
+        log.warning("Stopping due to obstacle at %s degrees.",
+            np.flatnonzero(danger).tolist())
         self.stop()
         paused = True
-      if (not len(danger) and paused):
+      if (not danger.any() and paused):
         new_distance = self.get_distance()
         left_distance = new_distance[0] - initial_distance[0]
         right_distance = new_distance[1] - initial_distance[1]
@@ -120,42 +168,272 @@ class Wheels:
 
         paused = False
 
-  # Instruct the drive motors to move.
+  # Instruct the drive motors to move. This replaces anything the wheels were
+  # already doing. Returns the Motion, which is finished by the time this
+  # returns if block is True.
   def drive(self, left_dist, right_dist, speed, block = True):
-    robot_status.is_driving()
-    slam_controller.wheels_started(self.get_distance())
-    control.send_command("SetMotor %d %d %d" % (left_dist, right_dist, speed))
+    self.motion.cancel()
+    motion = self.motion.submit(left_dist, right_dist, speed)
 
     if block:
-      self.__wait_for_stop()
+      motion.wait()
+    return motion
 
   # Instructs the robot to turn by a certain number of degrees. Positive for
   # counter-clockwise, negative for clockwise.
-  def turn(self, angle):
-    circumference = robot_status.ROBOT_WIDTH * math.pi
-    distance = angle * circumference / 360
-
-    speed = abs(angle) * 300 / 90
-    speed = min(speed, 300)
-
-    self.drive(-distance, distance, speed)
+  def turn(self, angle, block = True):
+    return self.drive(*turn_distances(angle), block = block)
 
   # Stops both drive motors immediately.
   def stop(self):
-    control.send_command("SetMotor -1 -1 300")
+    robot_status.cancel_motions()
+    self.motion.cancel()
+    control.send_command(control.STOP_COMMAND, priority = control.EMERGENCY)
     robot_status.is_not_driving()
     slam_controller.wheels_stopped(self.get_distance())
 
   # Get RPMs of wheel motors.
   def get_wheel_rpms(self, **kwargs):
-    info = control.get_output("GetMotors", **kwargs)
-    left = int(info["LeftWheel_RPM"])
-    right = int(info["RightWheel_RPM"])
+    info = control.get_sampled("GetMotors", **kwargs)
+    left = info["LeftWheel_RPM"]
+    right = info["RightWheel_RPM"]
     return (left, right)
 
   # Get the distance traveled by each wheel.
   def get_distance(self, **kwargs):
-    info = control.get_output("GetMotors", **kwargs)
-    left = int(info["LeftWheel_PositionInMM"])
-    right = int(info["RightWheel_PositionInMM"])
+    info = control.get_sampled("GetMotors", **kwargs)
+    left = info["LeftWheel_PositionInMM"]
+    right = info["RightWheel_PositionInMM"]
     return (left, right)
+
+# A single movement of the wheels, which finishes at some point in the future.
+class Motion:
+  def __init__(self, left_dist, right_dist, speed):
+    self.left_dist = left_dist
+    self.right_dist = right_dist
+    self.speed = speed
+
+    # Wheel positions once we stopped, if this was the last thing we did.
+    self.position = None
+    # Whether something else replaced it before it finished.
+    self.cancelled = False
+    # The motion epoch when it got queued. It gets cancelled if that changes
+    # before it runs.
+    self.epoch = None
+
+    self.__finished = threading.Event()
+    self.__callbacks = []
+    self.__lock = threading.Lock()
+
+  # How long the wheels should take to do this, not counting speeding up and
+  # slowing down. (s)
+  def duration(self):
+    return max(abs(self.left_dist), abs(self.right_dist)) / float(self.speed)
+
+  def done(self):
+    return self.__finished.is_set()
+
+  # Waits for it to finish. Returns whether it did.
+  def wait(self, timeout = None):
+    self.__finished.wait(timeout)
+    return self.done()
+
+  # Calls callback with the motion once it finishes, or right away if it
+  # already has.
+  def add_callback(self, callback):
+    with self.__lock:
+      if not self.done():
+        self.__callbacks.append(callback)
+        return
+
+    callback(self)
+
+  # Marks it as finished and runs the callbacks.
+  def finish(self, position = None, cancelled = False):
+    with self.__lock:
+      if self.done():
+        return
+      self.position = position
+      self.cancelled = cancelled
+      self.__finished.set()
+      callbacks = self.__callbacks
+      self.__callbacks = []
+
+    for callback in callbacks:
+      try:
+        callback(self)
+      except Exception as e:
+        log.error("Motion callback failed: %s", e)
+
+# Runs a queue of motions one after the other. Instead of polling the motors
+# until they stop, it works out when each one should be done from its distance
+# and speed, sends the next SetMotor right then, and only reads the encoders
+# once at the end of the queue to confirm that we stopped. There is one of these
+# per process. (See motion_executor().) An emergency stop from any process bumps
+# the motion epoch in the shared state, which cancels everything that was queued
+# before it.
+class MotionExecutor:
+  # Extra time to allow for the wheels to speed up and slow down. (s)
+  settle_time = 0.3
+  # How often the control program samples GetMotors. (s)
+  sample_period = 0.1
+  # How long to keep reading the encoders after a motion should be done before
+  # we give up on them reading zero. (s)
+  confirm_time = 2
+  # How often to check the motion epoch while a motion is running. (s)
+  epoch_check_interval = 0.05
+
+  def __init__(self):
+    self.queue = collections.deque()
+    self.current = None
+    self.moving = False
+    self.condition = threading.Condition()
+
+    thread = threading.Thread(target = self.__run)
+    thread.daemon = True
+    thread.start()
+
+  # Adds a motion to the queue. Returns the Motion.
+  def submit(self, left_dist, right_dist, speed):
+    motion = Motion(left_dist, right_dist, speed)
+    if (not left_dist and not right_dist):
+      # Nothing to do.
+      motion.finish()
+      return motion
+    if speed <= 0:
+      raise ValueError("Speed must be positive, got %s." % (speed))
+
+    motion.epoch = robot_status.motion_epoch()
+    with self.condition:
+      self.queue.append(motion)
+      self.condition.notify_all()
+    return motion
+
+  # Drives straight for a distance. Negative goes backwards.
+  def drive(self, distance, speed):
+    return self.submit(distance, distance, speed)
+
+  # Turns in place by a certain number of degrees. Positive for
+  # counter-clockwise, negative for clockwise.
+  def turn(self, angle):
+    return self.submit(*turn_distances(angle))
+
+  # Drives along an arc. See arc_distances(). Speed is for the outside wheel.
+  def arc(self, radius, angle, speed):
+    left_dist, right_dist = arc_distances(radius, angle)
+    return self.submit(left_dist, right_dist, speed)
+
+  # Drops everything in the queue, including what's running now. This doesn't
+  # stop the wheels, it's up to the caller to send something that does.
+  def cancel(self):
+    with self.condition:
+      cancelled = list(self.queue)
+      self.queue.clear()
+      if self.current:
+        cancelled.append(self.current)
+      self.moving = False
+      self.condition.notify_all()
+
+    for motion in cancelled:
+      motion.finish(cancelled = True)
+
+  # Reads the encoders once the wheels should have stopped. Returns the wheel
+  # positions.
+  def __confirm_stop(self, since):
+    give_up = time.time() + self.confirm_time
+    info = None
+    while time.time() < give_up:
+      # We want a sample from after the wheels should have stopped, which the
+      # control program will get to within a sample period.
+      sample = robot_status.read_telemetry("GetMotors",
+          max_age = time.time() - since)
+      if sample:
+        info = sample
+        if (info["LeftWheel_RPM"] == 0 and info["RightWheel_RPM"] == 0):
+          break
+        # Still slowing down.
+        since = time.time()
+      time.sleep(self.sample_period)
+    else:
+      log.warning("Wheels did not stop within %f seconds of when we expected.",
+          self.confirm_time)
+      if not info:
+        return self.__position()
+
+    return (info["LeftWheel_PositionInMM"], info["RightWheel_PositionInMM"])
+
+  # Gets the wheel positions from the last GetMotors sample, without waiting on
+  # the control program.
+  def __position(self):
+    info = robot_status.read_telemetry("GetMotors")
+    if not info:
+      return None
+    return (info["LeftWheel_PositionInMM"], info["RightWheel_PositionInMM"])
+
+  def __run(self):
+    while True:
+      with self.condition:
+        while not self.queue:
+          self.condition.wait()
+        motion = self.queue.popleft()
+        if motion.epoch != robot_status.motion_epoch():
+          # There was an emergency stop after it got queued.
+          self.moving = False
+          motion.finish(cancelled = True)
+          continue
+
+        self.current = motion
+        starting = not self.moving
+        self.moving = True
+
+        if starting:
+          robot_status.is_driving()
+          position = self.__position()
+          if position:
+            slam_controller.wheels_started(position)
+        # This happens with the lock held so that nothing can get sent after
+        # someone cancels us.
+        control.send_command("SetMotor %d %d %d" % \
+            (motion.left_dist, motion.right_dist, motion.speed))
+        end = time.time() + motion.duration() + self.settle_time
+
+        while (not motion.done() and time.time() < end):
+          self.condition.wait(min(end - time.time(),
+              self.epoch_check_interval))
+          if motion.epoch != robot_status.motion_epoch():
+            self.moving = False
+            motion.finish(cancelled = True)
+        self.current = None
+        following = bool(self.queue)
+        if not following:
+          self.moving = False
+
+      if motion.done():
+        # It got cancelled.
+        continue
+      if following:
+        # The next one takes over from here.
+        motion.finish()
+        continue
+
+      position = self.__confirm_stop(end)
+      robot_status.is_not_driving()
+      if position:
+        slam_controller.wheels_stopped(position)
+      motion.finish(position)
+
+# The motion executor for this process, and the process it was made in, since
+# its thread doesn't survive a fork.
+__executor = None
+__executor_pid = None
+__executor_lock = threading.Lock()
+
+# Gets the motion executor for this process, making it if we have to.
+def motion_executor():
+  global __executor, __executor_pid
+  with __executor_lock:
+    if (not __executor or __executor_pid != os.getpid()):
+      __executor = MotionExecutor()
+      __executor_pid = os.getpid()
+
+  return __executor
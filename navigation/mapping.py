@@ -15,8 +15,10 @@ class Room:
   def __init__(self):
     self.wheels = motors.Wheels()
 
-  # Given a scan, aligns the robot parallel to a wall of the room.
-  def align_to_wall(self, scan):
+  # Given a scan, aligns the robot parallel to a wall of the room. Returns the
+  # Motion for the turn, which is finished by the time this returns if block is
+  # True.
+  def align_to_wall(self, scan, block = True):
     # Find walls in the scan.
     all_blobs = blobs.find_blobs(scan)
     walls = filters.find_walls(all_blobs)
@@ -37,4 +39,7 @@ class Room:
     angle = math.degrees(math.atan(best_wall[0]))
     log.info("Got angle of %f degrees." % (angle))
 
-    self.wheels.turn(angle)
+    motion = self.wheels.motion.turn(angle)
+    if block:
+      motion.wait()
+    return motion
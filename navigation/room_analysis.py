@@ -2,8 +2,6 @@
 
 from __future__ import division
 
-from pyhull.convex_hull import ConvexHull
-
 import math
 import sys
 
@@ -71,6 +69,9 @@ class Line:
 
 # Calculate convex hull.
 def convex_hull(scan):
+  # Pyhull takes a long time to import, so only do it when we need it.
+  from pyhull.convex_hull import ConvexHull
+
   hull = ConvexHull(scan)
 
   # Draw it on the canvas.
@@ -72,9 +72,9 @@ class Landmark:
     z = self.__range_and_bearing(location)
 
     v = z - self.h
-    log.debug("Range and bearing difference: %s." % (v))
+    log.debug("Range and bearing difference: %s.", v)
     value = np.dot(np.dot(np.reshape(v, (1, -1)), np.linalg.inv(self.S)), v)
-    log.debug("Validation gate value for landmark %d: %s." % (self.id, value))
+    log.debug("Validation gate value for landmark %d: %s.", self.id, value)
 
     if value <= Landmark.lamda:
       return True
@@ -104,14 +104,14 @@ class LandmarkDatabase:
         best_landmark = landmark
 
     if (best_landmark and best_landmark.validation_gate(location)):
-      log.debug("Landmark at %s corresponds to landmark at %s." % \
-          (location, best_landmark.last_location))
+      log.debug("Landmark at %s corresponds to landmark at %s.", location,
+          best_landmark.last_location)
 
       best_landmark.sightings += 1
       best_landmark.last_location = location
 
     else:
-      log.debug("Found a new landmark at %s." % (str(location)))
+      log.debug("Found a new landmark at %s.", location)
 
       landmark = Landmark()
       landmark.last_location = location
@@ -166,8 +166,8 @@ class Kalman:
 
     distance = ((l_x - x) ** 2 + (l_y - y) ** 2) ** (1 / 2)
     bearing = theta - math.atan((l_y - y) / (l_x - x))
-    log.debug("Landmark %d: Range %f, Bearing %f." % \
-        (landmark.id, distance, bearing))
+    log.debug("Landmark %d: Range %f, Bearing %f.", landmark.id, distance,
+        bearing)
 
     return np.vstack((distance, bearing))
   # Find the Jacobian of the measurement model for a particular landmark.
@@ -263,15 +263,15 @@ class Kalman:
 
     # Update the state.
     self.X[:3] = prediction
-    log.debug("New state: %s." % (self.X))
+    log.debug("New state: %s.", self.X)
 
     # Update the prediction jacobian.
     self.A = self.__prediction_jacobian(dx, dy)
-    log.debug("New prediction jacobian: %s." % (self.A))
+    log.debug("New prediction jacobian: %s.", self.A)
 
     # Compute the process noise.
     Q = self.__process_noise(dx, dy, dtheta)
-    log.debug("Process noise: %s." % (Q))
+    log.debug("Process noise: %s.", Q)
 
     # Update covariance for robot position.
     self.P[0:3, 0:3] = np.dot(np.dot(self.A, self.P[0:3, 0:3]), self.A) + Q
@@ -284,7 +284,7 @@ class Kalman:
 
       column += 2
 
-    log.debug("New covariance matrix: %s." % (self.P))
+    log.debug("New covariance matrix: %s.", self.P)
 
   # Update the state from observed landmarks.
   def landmark_update(self):
@@ -301,7 +301,7 @@ class Kalman:
       landmark.h = self.__measurement_model(landmark)
       # Compute measurement noise.
       R = self.__measurement_noise(landmark.z[0])
-      log.debug("Measurement noise: %s." % (R))
+      log.debug("Measurement noise: %s.", R)
 
       # Create the H matrix.
       H = np.zeros((2, len(landmarks) * 2 + 3))
@@ -310,24 +310,24 @@ class Kalman:
       H[0:2, 0:3] = jacobian
       # Set the landmark-specific part.
       H[0:2, (i + 3):(i + 5)] = jacobian[0:2, 0:2] * -1
-      log.debug("H matrix for landmark %d: %s." % (landmark.id, H))
+      log.debug("H matrix for landmark %d: %s.", landmark.id, H)
 
       # Now we can compute the innovation covariance.
       V = np.identity(2)
       landmark.S = np.dot(np.dot(H, self.P), H.T) + np.dot(np.dot(V, R), V.T)
-      log.debug("Innovation covariance for landmark %d: %s." %
-          (landmark.id, landmark.S))
+      log.debug("Innovation covariance for landmark %d: %s.", landmark.id,
+          landmark.S)
 
       # Only actually adjust the state if the landmark is usable.
       if landmark.usable():
         K = np.dot(np.dot(self.P, H.T), np.linalg.inv(landmark.S))
-        log.debug("Kalman gain for landmark %d: %s." % (landmark.id, K))
+        log.debug("Kalman gain for landmark %d: %s.", landmark.id, K)
 
         # Compute a new state vector from the Kalman gain.
         innovation = landmark.z - landmark.h
-        log.debug("Innovation for landmark %d: %s." % (landmark.id, innovation))
+        log.debug("Innovation for landmark %d: %s.", landmark.id, innovation)
         self.X = self.X + np.dot(K, innovation)
-        log.debug("Corrected state vector: %s." % (self.X))
+        log.debug("Corrected state vector: %s.", self.X)
 
   # Incorporate new landmarks into the system state.
   def incorporate_new(self, dx, dy, dtheta):
@@ -338,12 +338,12 @@ class Kalman:
     next_index = self.X.shape[0]
     next_row = self.P.shape[0]
     next_column = self.P.shape[1]
-    log.debug("Index of next landmark in X: %d." % (next_index))
-    log.debug("Next row, column in P: %d, %d." % (next_row, next_column))
+    log.debug("Index of next landmark in X: %d.", next_index)
+    log.debug("Next row, column in P: %d, %d.", next_row, next_column)
 
     # Calculate SLAM-specific jacobians.
     J_xr, J_z = self.__slam_jacobians(self.A, dx, dy, dtheta)
-    log.debug("J_xr: %s\n, J_z: %s." % (J_xr, J_z))
+    log.debug("J_xr: %s\n, J_z: %s.", J_xr, J_z)
 
     # Extend the state vector to contain all the new landmarks.
     rows_needed = len(landmarks) * 2
@@ -369,14 +369,14 @@ class Kalman:
       # actually just supposed to be the upper left 3x3 submatrix.
       covariance = np.dot(np.dot(J_xr, self.P[0:3, 0:3]), J_xr.T) + \
           np.dot(np.dot(J_z, R), J_z.T)
-      log.debug("Covariance of landmark %d: %s." % (landmark.id, covariance))
+      log.debug("Covariance of landmark %d: %s.", landmark.id, covariance)
       self.P[next_row:(next_row + 2),
           next_column:(next_column + 2)] = covariance
 
       # Covariance between robot and landmark.
       robot_landmark_cov = np.dot(self.P[0:3, 0:3], J_xr.T)
-      log.debug("Covariance between robot and landmark %d: %s." %
-          (landmark.id, robot_landmark_cov))
+      log.debug("Covariance between robot and landmark %d: %s.", landmark.id,
+          robot_landmark_cov)
       # NOTE: Again, the MIT paper is incorrect here. In the section defining
       # the covariance matrix, the definitions for submatrices "D" and "E"
       # should be switched.
@@ -406,7 +406,7 @@ class Kalman:
       next_row += 2
       next_column += 2
 
-    log.debug("New covariance matrix: %s." % (self.P))
+    log.debug("New covariance matrix: %s.", self.P)
 
   # Run a single iteration of the Kalman filter. Returns the robot's new
   # position and bearing.
@@ -437,7 +437,7 @@ class Slam:
     # Temporary wheel positions to save so we can figure out how far we've gone
     # between iterations.
     l_pos, r_pos = self.wheels.get_distance()
-    log.debug("Starting wheel positions: L: %d, R: %d." % (l_pos, r_pos))
+    log.debug("Starting wheel positions: L: %d, R: %d.", l_pos, r_pos)
     self.last_l_wheel = l_pos
     self.last_r_wheel = r_pos
     # The time we last got a good position.
@@ -462,29 +462,30 @@ class Slam:
 
   # Gets laser data and uses kalman filter to improve odometry guesses.
   def __enhance_with_lidar(self, dx, dy, dtheta):
-    scan = self.lds.get_scan(stale_time = 0)
+    scan = self.lds.get_next_scan()
     scan = filters.remove_outliers(scan)
     points = utilities.to_rectangular(scan)
 
     landmarks = self.__find_landmarks(points)
-    log.debug("Found landmarks at: %s." % (landmarks))
+    log.debug("Found landmarks at: %s.", landmarks)
 
     # Run the kalman filter.
     self.x_pos, self.y_pos, self.bearing = \
         self.kalman.run_iteration(landmarks, dx, dy, dtheta)
 
-    log.debug("Corrected position: (%f, %f)." % (self.x_pos, self.y_pos))
-    log.debug("Corrected bearing: %f." % (self.bearing))
+    log.debug("Corrected position: (%f, %f).", self.x_pos, self.y_pos)
+    log.debug("Corrected bearing: %f.", self.bearing)
 
   # Updates odometry data and runs Kalman filter.
   def __update(self, position, timestamp):
     if timestamp < self.last_position_time:
       # It's possible to get a position from the past.
-      log.warning("Got position that was before the last one.")
+      log.warning("Got position that was before the last one.",
+          rate_limit = 10)
       return
     if position == (self.last_l_wheel, self.last_r_wheel):
       # Don't do anything if the odometry doesn't think we've moved.
-      log.warning("Got same position.")
+      log.warning("Got same position.", rate_limit = 10)
       self.last_position_time = timestamp
       return
 
@@ -496,7 +497,7 @@ class Slam:
     distance_r = position[1] - self.last_r_wheel
     self.last_l_wheel = position[0]
     self.last_r_wheel = position[1]
-    log.debug("Left distance: %d, Right distance: %d." % (distance_l, distance_r))
+    log.debug("Left distance: %d, Right distance: %d.", distance_l, distance_r)
 
     circumference = robot_status.ROBOT_WIDTH * math.pi
 
@@ -573,8 +574,8 @@ class Slam:
     if self.bearing < 0:
       self.bearing = 2 * math.pi - abs(self.bearing)
 
-    log.debug("New position: (%f, %f)." % (self.x_pos, self.y_pos))
-    log.debug("New bearing: %f." % (math.degrees(self.bearing)))
+    log.debug("New position: (%f, %f).", self.x_pos, self.y_pos)
+    log.debug("New bearing: %f.", math.degrees(self.bearing))
 
     # Now that the robot has moved, use laser data and the Kalman filter to
     # improve our odometry data.
@@ -582,19 +583,19 @@ class Slam:
 
   # Gets run every time the robot starts driving.
   def started_driving(self, position, timestamp):
-    log.debug("Wheel position at start of driving: %s." % (str(position)))
+    log.debug("Wheel position at start of driving: %s.", position)
     self.__update(position, timestamp)
 
   # Gets run every time the robot stops driving.
   def stopped_driving(self, position, timestamp):
-    log.debug("Wheel position at end of driving: %s." % (str(position)))
+    log.debug("Wheel position at end of driving: %s.", position)
     self.__update(position, timestamp)
 
   # Run every time we can get a new sensor packet, updates odometry and runs the
   # Kalman filter.
   def update_position(self):
     position = self.wheels.get_distance(stale_time = 0)
-    log.debug("Current wheel position: %s." % (str(position)))
+    log.debug("Current wheel position: %s.", position)
     self.__update(position, time.time())
 
   # Returns SLAM's best guess as to our displacement.
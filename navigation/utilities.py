@@ -2,8 +2,6 @@
 
 from __future__ import division
 
-from scipy.optimize import leastsq
-
 import math
 import numpy as np
 
@@ -47,6 +45,9 @@ def fit_line(points):
   b = points[0][1] - m * points[0][0]
   p0 = [m, b]
 
+  # Scipy takes a long time to import, so only do it when we need it.
+  from scipy.optimize import leastsq
+
   return leastsq(residuals, p0, args = (y_values, x_values))[0]
 
 # Find the point at the intersection of the line and a perpendicular line that
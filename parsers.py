@@ -0,0 +1,147 @@
+# Turns responses from the neato into typed values. Commands can register their
+# own parser, and anything without one gets parsed into a dict of numbers.
+
+import numpy as np
+
+# A single reading from the LDS. The angle is rotated so that 0 degrees is to
+# the right, not up.
+LDS_SCAN_DTYPE = np.dtype([
+  ("angle", np.int16),
+  ("distance", np.int32),
+  ("intensity", np.int32),
+  ("error", np.int32),
+])
+
+# Parsers for specific commands, indexed by the first word of the command.
+parsers = {}
+
+# Registers a parser for a command. The parser takes the raw response.
+def register(command, parser):
+  parsers[command] = parser
+
+# Parses the raw response to a command.
+def parse(command, response):
+  name = command.split(" ")[0]
+  parser = parsers.get(name, parse_record)
+  return parser(response)
+
+# Splits a response into lines of comma separated values.
+def split_lines(response):
+  rows = []
+  for line in response.split("\n"):
+    line = line.rstrip("\r")
+    if line == "":
+      continue
+
+    rows.append(line.split(","))
+
+  return rows
+
+# Converts a single value to a number if we can.
+def to_number(value):
+  try:
+    return int(value)
+  except ValueError:
+    pass
+
+  try:
+    return float(value)
+  except ValueError:
+    return value
+
+# Adds one line of a response to a record.
+def add_row(record, split):
+  if split[0] == "":
+    return
+
+  if len(split) > 2:
+    record[split[0]] = [to_number(x) for x in split[1:]]
+  elif len(split) == 2:
+    record[split[0]] = to_number(split[1])
+  else:
+    record[split[0]] = None
+
+# Most responses are lines of names and values, so we can turn them into a
+# nice little dict.
+def parse_record(response):
+  ret = {}
+  for split in split_lines(response):
+    add_row(ret, split)
+
+  return ret
+
+# Makes a parser for responses that are lines of names and values where we
+# already know what type each value is, so we don't have to guess. Types is a
+# dict of conversion functions indexed by name. Anything not in it, or that
+# doesn't convert, gets parsed the same way parse_record() does it.
+def typed_record_parser(types):
+  def parse_typed_record(response):
+    ret = {}
+    for split in split_lines(response):
+      if (len(split) == 2 and split[0] in types):
+        try:
+          ret[split[0]] = types[split[0]](split[1])
+          continue
+        except ValueError:
+          pass
+
+      add_row(ret, split)
+
+    return ret
+
+  return parse_typed_record
+
+# Types of the values in the responses to the commands that get sampled all the
+# time.
+MOTORS_TYPES = dict.fromkeys(["Brush_RPM", "Brush_mA", "Vacuum_RPM",
+    "Vacuum_mA", "LeftWheel_RPM", "LeftWheel_Load%", "LeftWheel_PositionInMM",
+    "LeftWheel_Speed", "RightWheel_RPM", "RightWheel_Load%",
+    "RightWheel_PositionInMM", "RightWheel_Speed", "Charger_mAH",
+    "SideBrush_mA", "Laser_mVolts"], int)
+ANALOG_SENSORS_TYPES = dict.fromkeys(["WallSensorInMM", "BatteryVoltageInmV",
+    "LeftDropInMM", "RightDropInMM", "ChargeVoltInmV", "BatteryTemp0InC",
+    "CurrentInmA"], int)
+DIGITAL_SENSORS_TYPES = dict.fromkeys(["SNSR_DC_JACK_CONNECT",
+    "SNSR_DUSTBIN_IS_IN", "SNSR_LEFT_WHEEL_EXTENDED",
+    "SNSR_RIGHT_WHEEL_EXTENDED", "LSIDEBIT", "LFRONTBIT", "RSIDEBIT",
+    "RFRONTBIT"], int)
+# The field types for each of those commands.
+RECORD_TYPES = {
+  "GetMotors": MOTORS_TYPES,
+  "GetAnalogSensors": ANALOG_SENSORS_TYPES,
+  "GetDigitalSensors": DIGITAL_SENSORS_TYPES,
+}
+
+# Parses a complete LDS scan into a dict with the rotation speed and a
+# structured array of readings, sorted by angle.
+def parse_lds_scan(response):
+  rotation_speed = 0
+  rows = []
+  for split in split_lines(response):
+    if split[0] == "ROTATION_SPEED":
+      rotation_speed = float(split[1])
+    elif (len(split) == 4 and split[0].isdigit()):
+      rows.append(split)
+
+  scan = np.zeros(len(rows), dtype = LDS_SCAN_DTYPE)
+  if not rows:
+    return {"ROTATION_SPEED": rotation_speed, "scan": scan}
+
+  angles, distances, intensities, errors = zip(*rows)
+  # Convert the angle so that 0 deg is to the right, not up.
+  scan["angle"] = (np.array(angles).astype(np.int16) + 90) % 360
+  scan["distance"] = np.array(distances).astype(np.int32)
+  scan["intensity"] = np.array(intensities).astype(np.int32)
+
+  # Error codes are in hex, but they're almost all zero.
+  errors = np.array(errors)
+  bad = np.flatnonzero(errors != "0")
+  scan["error"][bad] = [int(errors[i], 16) for i in bad]
+
+  scan = scan[np.argsort(scan["angle"], kind = "mergesort")]
+  return {"ROTATION_SPEED": rotation_speed, "scan": scan}
+
+register("GetLDSScan", parse_lds_scan)
+register("GetMotors", typed_record_parser(MOTORS_TYPES))
+register("GetAnalogSensors", typed_record_parser(ANALOG_SENSORS_TYPES))
+register("GetDigitalSensors", typed_record_parser(DIGITAL_SENSORS_TYPES))
@@ -3,12 +3,12 @@
 import sys
 sys.path.append("..")
 
+from programs import log
 from rate import Rate
 from starter import Program
 
 import time
 
-import log
 import motors
 
 class continuous_driving(Program):
@@ -22,7 +22,7 @@ class continuous_driving(Program):
     last_send = 0
     distance = 0
     new_command = False
-    rate = Rate()
+    rate = Rate("driving")
 
     while True:
       rate.rate(0.1)
@@ -3,13 +3,35 @@
 import sys
 sys.path.append("..")
 
+import errno
 import os
+import select
 import serial
+import threading
 import time
 
+from clock import monotonic
+from collections import deque
+from Queue import Empty
+
+from programs import log
 from starter import Program
 
-import log
+import parsers
+import robot_status
+import serial_api
+import serial_record
+
+# Where the neato is connected.
+SERIAL_PORT = os.environ.get("NEATO_SERIAL_PORT", "/dev/ttyACM0")
+# If this is set, all serial traffic gets recorded to this file.
+RECORD_PATH = os.environ.get("NEATO_RECORD")
+# If this is set, we play back serial traffic from this recording instead of
+# talking to the neato.
+REPLAY_PATH = os.environ.get("NEATO_REPLAY")
+# How much faster than real time to play back recordings. Zero means that
+# responses come back right away.
+REPLAY_SPEED = float(os.environ.get("NEATO_REPLAY_SPEED", 1))
 
 # A simple memmory cache.
 class Cache:
@@ -23,6 +45,9 @@ class Cache:
     self.timestamps = {}
     # We also save the names of programs that requests came from.
     self.sources = {}
+    # Fetches that are queued or running, indexed by command. Each entry is a
+    # deque of fetches in the order they were queued.
+    self.in_flight = {}
 
   # If there is valid item, return it, otherwise, return None.
   def get_item(self, command, source, stale_time = None):
@@ -54,148 +79,673 @@ class Cache:
     self.timestamps[command] = time.time()
     self.sources[command] = source
 
+  # Registers a new fetch for a command that is about to be queued.
+  def start_fetch(self, command, source):
+    if command not in self.in_flight.keys():
+      self.in_flight[command] = deque()
+
+    self.in_flight[command].append(Fetch(source))
+
+  # Attaches a request to a fetch of the same command that is already queued or
+  # running. Returns whether it worked.
+  def attach(self, command, source, stale_time = None):
+    if not self.in_flight.get(command):
+      return False
+
+    fetch = self.in_flight[command][-1]
+    if fetch.write_time != None:
+      # The data will be from when the command was written, so that has to be
+      # recent enough.
+      if stale_time == None:
+        stale = Cache.stale_time
+      else:
+        stale = stale_time
+
+      if time.time() - fetch.write_time >= stale:
+        return False
+
+    fetch.waiters.append(source)
+    return True
+
+  # Marks the oldest unwritten fetch for a command as written to the neato.
+  def fetch_written(self, command):
+    for fetch in self.in_flight[command]:
+      if fetch.write_time == None:
+        fetch.write_time = time.time()
+        return
+
+  # Completes the oldest fetch for a command and caches the result. Returns the
+  # names of all the programs that were waiting on it.
+  def finish_fetch(self, command, data):
+    fetch = self.in_flight[command].popleft()
+    if not self.in_flight[command]:
+      self.in_flight.pop(command, None)
+
+    self.add(command, data, fetch.waiters[0])
+    return fetch.waiters
+
+  # Gives up on the oldest fetch for a command without caching anything. Returns
+  # the names of all the programs that were waiting on it.
+  def abandon_fetch(self, command):
+    fetch = self.in_flight[command].popleft()
+    if not self.in_flight[command]:
+      self.in_flight.pop(command, None)
+
+    return fetch.waiters
+
+# A single command that is queued or running on the neato.
+class Fetch:
+  def __init__(self, source):
+    # The programs waiting for the output, in the order they asked.
+    self.waiters = [source]
+    # When the command was written, or None if it hasn't been yet.
+    self.write_time = None
+
+# Keeps track of how long commands wait in a queue.
+class QueueMetrics:
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.count = 0
+    self.total = 0
+    self.worst = 0
+
+  # Records the wait for a single command. (seconds)
+  def add(self, wait):
+    self.count += 1
+    self.total += wait
+    self.worst = max(self.worst, wait)
+
+  def mean(self):
+    if not self.count:
+      return 0
+    return self.total / self.count
+
+# A stop that came in on the emergency channel.
+class EmergencyStop:
+  def __init__(self, command, trigger, detect_time):
+    self.command = command
+    # What caused it.
+    self.trigger = trigger
+    # When the problem was detected, written to the neato, and confirmed by the
+    # neato, on the monotonic clock.
+    self.detect_time = detect_time
+    self.write_time = None
+    self.confirm_time = None
+
+# Splits the data coming from the neato into responses. Everything is read into
+# one reusable buffer with large reads, and each byte is only scanned once.
+class FrameReader:
+  # The most we try to read from the port at once.
+  chunk_size = 4096
+  # All responses end with this character.
+  terminator = "\x1a"
+
+  def __init__(self, port, timeout = 1, recorder = None):
+    self.port = port
+    self.fd = port.fileno()
+    # If we have a recorder, everything we read goes to it.
+    self.recorder = recorder
+    # Time in seconds to wait for new data before giving up.
+    self.timeout = timeout
+    # Data that we've read but haven't returned yet.
+    self.buffer = bytearray()
+
+  # Throws away anything we have buffered.
+  def clear(self):
+    del self.buffer[:]
+
+  # Throws away everything buffered and everything that comes in until the port
+  # has been quiet for quiet_time seconds, so that late responses don't get
+  # mistaken for the responses to commands we write after this. Gives up after
+  # the read timeout.
+  def resync(self, quiet_time = 0.1):
+    end = time.time() + self.timeout
+    while time.time() < end:
+      try:
+        readable, _, _ = select.select([self.fd], [], [], quiet_time)
+        if not readable:
+          break
+
+        data = os.read(self.fd, FrameReader.chunk_size)
+      except (OSError, select.error):
+        continue
+      if not data:
+        break
+
+      if self.recorder:
+        self.recorder.read(data)
+
+    self.clear()
+
+  # Waits for new data and adds it to the buffer. Returns False if we timed
+  # out.
+  def __fill(self):
+    try:
+      readable, _, _ = select.select([self.fd], [], [], self.timeout)
+      if not readable:
+        return False
+
+      data = os.read(self.fd, FrameReader.chunk_size)
+    except (OSError, select.error):
+      # No data to read.
+      log.warning("Got no serial data. Retrying...")
+      return True
+
+    if not data:
+      # The port went away.
+      return False
+
+    if self.recorder:
+      self.recorder.read(data)
+    self.buffer.extend(data)
+    return True
+
+  # Reads the response to a single command, which starts after the echoed
+  # command and ends with the terminator. Anything after the end of the
+  # response is saved for the next one. Returns None if the neato times out.
+  def read_frame(self, command):
+    start = -1
+    search_from = 0
+
+    while True:
+      if start < 0:
+        echo = self.buffer.find(command, search_from)
+        if echo >= 0:
+          start = echo + len(command)
+          search_from = start
+        else:
+          # The echo could still be split across reads.
+          search_from = max(0, len(self.buffer) - len(command) + 1)
+
+      if start >= 0:
+        end = self.buffer.find(FrameReader.terminator, search_from)
+        if end >= 0:
+          response = str(self.buffer[start:end])
+          del self.buffer[:(end + 1)]
+          return response
+
+        search_from = len(self.buffer)
+
+      if not self.__fill():
+        return None
+
 class control(Program):
+  # Everything that moves the robot goes through here, so it shouldn't have to
+  # wait behind navigation.
+  realtime_priority = 40
+
+  # Maximum number of commands that get written to the neato before we start
+  # reading back responses.
+  max_batch = 8
+  # How many commands each priority class gets in a batch before lower classes
+  # get a turn. Emergency commands are never limited. Anything left over goes
+  # to whoever is still waiting.
+  class_shares = {
+    serial_api.CONTROL: 4,
+    serial_api.TELEMETRY: 3,
+    serial_api.BULK: 1,
+  }
+  # Commands that get sampled in the background and published in shared
+  # memory, and how often to sample each one. (seconds)
+  sampled_commands = {
+    "GetMotors": 0.1,
+    "GetDigitalSensors": 0.1,
+    "GetAnalogSensors": 1,
+  }
+  # How often to sample LDS scans into the scan ring while anyone has the LDS
+  # turned on. (seconds)
+  scan_interval = 0.2
+  # How often to log queue wait statistics. (seconds)
+  metrics_interval = 60
+  # How often to check whether the programs using the LDS are still around.
+  # (seconds)
+  lds_check_interval = 1
+
   def setup(self):
     self.add_feed("control")
+    # Stops that can't wait in line. (See serial_api.emergency_stop().)
+    self.add_feed("emergency")
+    # How long every emergency stop took, from detection to confirmation.
+    self.add_topic("stop_latency", slots = 64, slot_size = 512)
 
   def run(self):
-    while not os.path.exists("/dev/ttyACM0"):
-      log.error("Serial port is not ready!")
-      time.sleep(1)
+    if REPLAY_PATH:
+      log.info("Playing back serial traffic from %s." % (REPLAY_PATH))
+      self.serial = serial_record.ReplayPort(REPLAY_PATH, speed = REPLAY_SPEED)
+    else:
+      while not os.path.exists(SERIAL_PORT):
+        log.error("Serial port is not ready!")
+        time.sleep(1)
+
+      self.serial = serial.Serial(port = SERIAL_PORT, timeout = 1)
 
-    self.serial = serial.Serial(port = "/dev/ttyACM0", timeout = 1)
+    self.recorder = None
+    if RECORD_PATH:
+      log.info("Recording serial traffic to %s." % (RECORD_PATH))
+      self.recorder = serial_record.Recorder(RECORD_PATH)
+
+    self.reader = FrameReader(self.serial, recorder = self.recorder)
     # Enable test mode on the neato.
-    self.__send_command("testmode on\n")
+    self.__send_command("testmode on")
 
     self.cache = Cache()
-    freezing_program = None
-    deffered_commands = []
+    self.freezing_program = None
+    # Commands waiting to run, one queue per priority class.
+    self.queues = [deque() for name in serial_api.PRIORITY_NAMES]
+    # Commands held back while we're frozen, one queue per priority class.
+    self.deferred = [deque() for name in serial_api.PRIORITY_NAMES]
+    self.metrics = [QueueMetrics() for name in serial_api.PRIORITY_NAMES]
+    self.last_report = time.time()
+    # When each sampled command is due to be sampled next.
+    self.next_samples = {}
+    # How many times each (program, pid) has turned the LDS on without turning
+    # it off again. (We only turn it off once nobody is left.)
+    self.lds_users = {}
+    self.next_lds_check = time.time()
+
+    # Everything written to the neato that we haven't read the response to yet,
+    # in order, as (command, data). The data is the Command, or an
+    # EmergencyStop.
+    self.in_flight = deque()
+    # Held while writing to the neato or touching in_flight, since emergency
+    # stops get written from their own thread.
+    self.write_lock = threading.Lock()
+    # Worst emergency stop time since the last report. (seconds)
+    self.worst_stop = 0
+
+    emergency_thread = threading.Thread(target = self.__serve_emergencies)
+    emergency_thread.daemon = True
+    emergency_thread.start()
 
     while True:
-      # Check for commands from all our pipes.
-      if (not freezing_program and deffered_commands):
-        data = deffered_commands.pop(0)
-        log.debug("Running deffered command.")
-      else:
-        data = self.control.get()
+      batch = self.__get_batch()
+      if (batch or self.in_flight):
+        self.__run_batch(batch)
+        if self.recorder:
+          self.recorder.flush()
+
+      self.__report_metrics()
+      self.__check_lds_users()
+
+  # Moves everything waiting on the feed into the priority queues. If block is
+  # True, waits up to timeout seconds for the first command.
+  def __drain(self, block, timeout = None):
+    while True:
+      try:
+        data = self.control.get(block, timeout)
+      except Empty:
+        return
+      block = False
+
       source = data.Source
 
+      # Just here to wake us up so that we read the response to an emergency
+      # stop.
+      if data.Command == "wake":
+        pass
+
       # Freeze or unfreeze.
-      if (data.Command == "freeze" and not freezing_program):
-        log.info("%s is freezing control program." % (source))
-        freezing_program = source
-      elif (data.Command == "unfreeze" and source == freezing_program):
-        log.info("Unfreezing control program.")
-        freezing_program = None
+      elif data.Command == "freeze":
+        if not self.freezing_program:
+          log.info("%s is freezing control program." % (source))
+          self.freezing_program = source
+      elif data.Command == "unfreeze":
+        if source == self.freezing_program:
+          log.info("Unfreezing control program.")
+          self.freezing_program = None
+
+          # Everything we held back goes back to the front of its queue.
+          for priority in range(0, len(self.queues)):
+            self.queues[priority].extendleft(reversed(self.deferred[priority]))
+            self.deferred[priority].clear()
 
       # Normal serial command.
       else:
-        if (not freezing_program or source == freezing_program):
-          output = data.Output
-          command = data.Command
-          stale = data.Stale
-          log.debug("Command: %s" % (command))
-
-          if output:
-            # We need to send the output back.
-            result = self.cache.get_item(command, source, stale_time = stale)
-            if not result:
-              result = self.__get_output(command)
-              self.cache.add(command, result, source)
-            else:
-              log.debug("Cache hit on %s." % (command))
-
-            pipe = getattr(self, source)
-            pipe.send(result)
-          else:
-            # No need to send the output.
-            self.__send_command(command)
-        else:
-          # We'll run this one later.
-          log.debug("Deferring command: %s" % (data.Command))
-          deffered_commands.append(data)
-
-  # Gets results from a command on the neato.
-  def __get_output(self, command):
-    self.serial.flush()
-    self.__write_command(command)
+        self.queues[classify(data)].append(data)
+
+  # Whether there are any commands we could run right now.
+  def __has_work(self):
+    for queue in self.queues:
+      if queue:
+        return True
+    return False
+
+  # Takes up to limit commands from the queue for a priority class and adds any
+  # that need the neato to the batch.
+  def __take(self, priority, batch, limit):
+    queue = self.queues[priority]
+    taken = 0
+
+    while (queue and taken < limit):
+      data = queue.popleft()
+      source = data.Source
 
-    response = ""
-    start = False
-    while True:
-      if self.serial.inWaiting():
-        read = self.serial.inWaiting()
-      elif not start:
-        # We want to read at least the command.
-        read = len(command)
-      else:
-        read = 1
-
-      data = ""
-      while len(data) < read:
-        try:
-          data += self.serial.read(read)
-        except (OSError, serial.SerialException):
-          # No data to read.
-          log.warning("Got no serial data. Retrying...")
+      # Emergency commands always get through a freeze.
+      if (self.freezing_program and source != self.freezing_program and \
+          priority != serial_api.EMERGENCY):
+        # We'll run this one later.
+        log.debug("Deferring command: %s", data.Command)
+        self.deferred[priority].append(data)
+        continue
+
+      self.metrics[priority].add(time.time() - data.Timestamp)
+      log.debug("Command: %s", data.Command)
+
+      if not self.__track_lds(data):
+        continue
+
+      if data.Output:
+        result = self.cache.get_item(data.Command, source,
+            stale_time = data.Stale)
+        if result:
+          log.debug("Cache hit on %s.", data.Command)
+          getattr(self, source).send(result)
           continue
 
-      if start:
-        response += data
-
-        if response == "":
-          # Timeout triggered and we still got no data.
-          log.warning("Neato doesn't seem to want to respond.")
-
-          # Resend command.
-          self.__send_command(command)
-          response = ""
-          start = False
+        # If someone is already fetching it, we can just use that.
+        if self.cache.attach(data.Command, source, stale_time = data.Stale):
+          log.debug("Coalescing %s with a fetch in flight.", data.Command)
+          continue
 
+        self.cache.start_fetch(data.Command, source)
+
+      batch.append(data)
+      taken += 1
+
+  # Keeps track of who is using the LDS. Returns False if the command should not
+  # be sent, because someone else still needs the LDS on.
+  def __track_lds(self, data):
+    user = (data.Source, data.Pid)
+    if data.Command == "SetLDSRotation on":
+      self.lds_users[user] = self.lds_users.get(user, 0) + 1
+    elif data.Command == "SetLDSRotation off":
+      if user in self.lds_users:
+        self.lds_users[user] -= 1
+        if not self.lds_users[user]:
+          del self.lds_users[user]
+
+      if self.lds_users:
+        log.debug("Leaving LDS on for %d other users.",
+            sum(self.lds_users.values()))
+        return False
+
+    return True
+
+  # Forgets about LDS users whose processes have exited, since they'll never
+  # turn it off themselves, and turns the LDS off if nobody is left.
+  def __check_lds_users(self):
+    if (not self.lds_users or time.time() < self.next_lds_check):
+      return
+    self.next_lds_check = time.time() + control.lds_check_interval
+
+    for user in self.lds_users.keys():
+      source, pid = user
+      try:
+        os.kill(pid, 0)
+      except OSError as e:
+        if e.errno != errno.ESRCH:
+          # It's there, we just can't signal it.
           continue
 
-      if command in data:
-        # Remove everything up to the command.
-        data = data.split(command)
-        data = data[1]
+        log.info("%s exited without turning the LDS off.", source)
+        del self.lds_users[user]
+        if not self.lds_users:
+          self.control.put(serial_api.Command("SetLDSRotation off"))
+
+  # Returns the commands that we are sampling right now, and how often.
+  def __active_samples(self):
+    samples = dict(control.sampled_commands)
+    if self.lds_users:
+      samples["GetLDSScan"] = control.scan_interval
+
+    return samples
+
+  # Adds any background samples that are due to the batch.
+  def __add_samples(self, batch):
+    now = time.time()
+
+    for command, interval in self.__active_samples().items():
+      if now < self.next_samples.get(command, 0):
+        continue
+      self.next_samples[command] = now + interval
+
+      # Someone might already be getting it for us.
+      if self.cache.attach(command, None, stale_time = interval):
+        continue
+
+      sample = serial_api.Command(command)
+      sample.Output = True
+      sample.Source = None
+      self.cache.start_fetch(command, None)
+      batch.append(sample)
+
+  # Gets everything that is queued up on the feed and returns a list of the
+  # serial commands that should be pipelined together next.
+  def __get_batch(self):
+    if self.__has_work():
+      self.__drain(False)
+    else:
+      # Only block if we have nothing else to do, and then only until the next
+      # sample is due.
+      next_sample = min([self.next_samples.get(command, 0) \
+          for command in self.__active_samples().keys()])
+      timeout = max(next_sample - time.time(), 0)
+      self.__drain(True, timeout)
+
+    batch = []
+    self.__take(serial_api.EMERGENCY, batch, sys.maxint)
+
+    # Everyone else gets their fair share first.
+    for priority in sorted(control.class_shares.keys()):
+      limit = min(control.class_shares[priority], control.max_batch - len(batch))
+      self.__take(priority, batch, limit)
+    # Then whatever room is left goes in priority order.
+    for priority in sorted(control.class_shares.keys()):
+      self.__take(priority, batch, control.max_batch - len(batch))
+
+    self.__add_samples(batch)
+    return batch
+
+  # Writes a batch of commands back to back and then sends each response to the
+  # program that asked for it. Emergency commands that show up in the meantime
+  # get written right away instead of waiting for the next batch.
+  def __run_batch(self, batch):
+    with self.write_lock:
+      for data in batch:
+        self.__write_tracked(data.Command, data)
+        if data.Output:
+          self.cache.fetch_written(data.Command)
+
+    # Keep going until we've heard back about everything, including emergency
+    # stops that got written in the meantime.
+    remaining = len(batch)
+    while True:
+      with self.write_lock:
+        if not self.in_flight:
+          break
+        command, data = self.in_flight[0]
+
+      response = self.reader.read_frame(command)
+      if response == None:
+        log.warning("Neato doesn't seem to want to respond.")
+        remaining -= self.__resend_unanswered()
+        continue
+
+      with self.write_lock:
+        self.in_flight.popleft()
+
+      if isinstance(data, EmergencyStop):
+        self.__confirm_stop(data)
+        continue
+
+      if data.Output:
+        # We need to send the output back to everyone who wanted it.
+        result = parsers.parse(data.Command, response)
+        if data.Command in control.sampled_commands.keys():
+          robot_status.write_telemetry(data.Command, result, time.time())
+        elif data.Command == "GetLDSScan":
+          self.scan_ring.write(result["scan"], result["ROTATION_SPEED"],
+              time.time())
+
+        for source in self.cache.finish_fetch(data.Command, result):
+          if not source:
+            # This was a background sample.
+            continue
 
-        start = True
+          pipe = getattr(self, source)
+          pipe.send(result)
 
-      # All responses end with this character.
-      if (response != "" and response[-1] == ""):
-        # Get rid of end character.
-        response = response[:-1]
+      remaining -= 1
 
-        # All responses are CSVs, so we can turn them into a nice little dict.
-        lines = response.split("\n")
+      # Stops can't wait for the rest of the batch.
+      if remaining:
+        remaining += self.__preempt()
 
-        ret = {}
-        for line in lines:
-          line = line.rstrip("\r")
-          split = line.split(",")
-          if split[0] == "":
-            continue
+  # Recovers from the neato not answering. We wait for the port to go quiet and
+  # then write again everything that hasn't been answered and is safe to run
+  # twice, since we can't tell whether the neato ever got it. Anything else gets
+  # dropped, and anyone waiting on it gets None. Returns how many commands got
+  # dropped.
+  def __resend_unanswered(self):
+    self.reader.resync()
 
-          if len(split) > 2:
-            ret[split[0]] = split[1:]
-          elif len(split) == 2:
-            ret[split[0]] = split[1]
-          else:
-            ret[split[0]] = None
+    dropped = 0
+    with self.write_lock:
+      unanswered = list(self.in_flight)
+      self.in_flight.clear()
 
-        return ret
+      for command, data in unanswered:
+        if repeatable(command, data):
+          self.__write_tracked(command, data)
+          continue
+
+        log.warning("Not resending %s, since it might have run already.",
+            command)
+        dropped += 1
+        if data.Output:
+          for source in self.cache.abandon_fetch(command):
+            if source:
+              getattr(self, source).send(None)
+
+    return dropped
+
+  # Writes any emergency commands that are waiting on the control feed. Returns
+  # how many there were.
+  def __preempt(self):
+    self.__drain(False)
+
+    emergencies = []
+    self.__take(serial_api.EMERGENCY, emergencies, sys.maxint)
+    with self.write_lock:
+      for data in emergencies:
+        log.debug("Preempting batch with %s.", data.Command)
+        self.__write_tracked(data.Command, data)
+        if data.Output:
+          self.cache.fetch_written(data.Command)
+
+    return len(emergencies)
+
+  # Writes stops from the emergency channel as soon as they come in, in between
+  # whatever else is being written.
+  def __serve_emergencies(self):
+    while True:
+      command, trigger, detect_time = self.emergency.get()
+      stop = EmergencyStop(command, trigger, detect_time)
+
+      with self.write_lock:
+        self.__write_tracked(command, stop)
+        stop.write_time = monotonic()
+
+      # The main thread reads the response.
+      self.control.put(serial_api.Command("wake"))
+
+      log.info("Wrote %s for %s %.1f ms after detection.", command, trigger,
+          (stop.write_time - detect_time) * 1000)
+
+  # Records how long an emergency stop took once the neato answers it.
+  def __confirm_stop(self, stop):
+    stop.confirm_time = monotonic()
+    latency = stop.confirm_time - stop.detect_time
+    self.worst_stop = max(self.worst_stop, latency)
+
+    log.info("%s for %s confirmed %.1f ms after detection.", stop.command,
+        stop.trigger, latency * 1000)
+    try:
+      self.publish("stop_latency", {"command": stop.command,
+          "trigger": stop.trigger, "detect_time": stop.detect_time,
+          "write_time": stop.write_time, "confirm_time": stop.confirm_time})
+    except ValueError:
+      # Nobody cares.
+      pass
+
+  # Logs how long commands in each priority class waited, every so often.
+  def __report_metrics(self):
+    if time.time() - self.last_report < control.metrics_interval:
+      return
+    self.last_report = time.time()
+
+    for priority, metrics in enumerate(self.metrics):
+      if not metrics.count:
+        continue
+
+      log.info("Queue wait for %s commands: %d, mean %.1f ms, max %.1f ms." % \
+          (serial_api.PRIORITY_NAMES[priority], metrics.count,
+          metrics.mean() * 1000, metrics.worst * 1000))
+      metrics.reset()
+
+    if self.worst_stop:
+      log.info("Worst emergency stop time: %.1f ms.",
+          self.worst_stop * 1000)
+      self.worst_stop = 0
 
   def __write_command(self, command):
-    self.serial.write(command + "\n")
+    data = command + "\n"
+    if self.recorder:
+      self.recorder.write(data)
+    self.serial.write(data)
+
+  # Writes a command and remembers that we have to read its response. The
+  # caller has to hold the write lock.
+  def __write_tracked(self, command, data):
+    self.__write_command(command)
+    self.in_flight.append((command, data))
 
-  # Sends a command to the neato.
+  # Sends a command to the neato and waits for it to finish.
   def __send_command(self, command):
     self.__write_command(command)
-    self.serial.flush()
 
-    # Wait for end character.
-    response = self.serial.read(len(command))
-    while True:
-      response += self.serial.read(1)
-      if response[-1] == "":
-        break
+    while self.reader.read_frame(command) == None:
+      log.warning("Neato doesn't seem to want to respond.")
+      self.reader.resync()
+      self.__write_command(command)
+
+# Whether a command that was written to the neato can be written again without
+# knowing if it ran the first time. Queries are, and so are the emergency stop
+# and disable commands, which do the same thing however many times they run.
+# Moves are not.
+def repeatable(command, data):
+  if isinstance(data, EmergencyStop):
+    return True
+  if command in (serial_api.STOP_COMMAND, serial_api.DISABLE_COMMAND):
+    return True
+  return (data.Output and command.startswith("Get"))
+
+# Figures out the priority class for a command.
+def classify(data):
+  if data.Priority != None:
+    return data.Priority
+
+  command = data.Command
+  if command.startswith("SetMotor"):
+    # Anything that stops or disables the wheels is an emergency.
+    if (command.startswith("SetMotor -1 -1") or "Disable" in command):
+      return serial_api.EMERGENCY
+    return serial_api.CONTROL
+  if command in serial_api.BULK_COMMANDS:
+    return serial_api.BULK
+  if data.Output:
+    return serial_api.TELEMETRY
+
+  return serial_api.CONTROL
@@ -1,67 +1,136 @@
 # Logging system on the BBB.
 
+import gzip
 import os
+import shutil
 import sys
 sys.path.append("..")
 
+import threading
 import time
 
+from Queue import Empty
+
 from starter import Program
 
+import log_store
 import robot_status
 
 LOG_LOCATION = "../tmp/robot_logs/"
+# Where the indexed copy of the logs goes. (See log_store.py.)
+STORE_LOCATION = "../tmp/robot_log_store/"
 
-# Represents a logger writing to a single file.
+# Represents a logger writing to a rotating set of files. Sizes are kept track
+# of in memory, so we only look at the directory when we start up.
 class Logger:
-  # Initial size of all the old logs.
-  start_size = 0
-  # Maximum space used by logs.
+  # Maximum space used by logs. (bytes)
   max_size = 1000000000000
+  # We start a new file when the current one gets this big (bytes) or this old
+  # (seconds). Old ones get compressed.
+  max_file_size = 10000000
+  max_file_age = 24 * 60 * 60
 
   def __init__(self, location):
     self.location = location
     self.file = None
+    # Paths and sizes of the old logs, oldest first.
+    self.old_files = []
+    # Protects old_files, since they get compressed in the background.
+    self.lock = threading.Lock()
+    # The timestamp we used last, and the second it was for.
+    self.timestamp = None
+    self.timestamp_second = None
 
     if not robot_status.is_testing():
-      self.__remove_old()
-
-      name = str(time.time()).split(".")[0]
-      name += ".log"
-      self.file_path = os.path.join(self.location, name)
-      self.file = open(self.file_path, "w")
-
-      # Set symlink.
-      current = os.path.join(self.location, "current")
-      if os.path.lexists(current):
-        os.remove(current)
-      os.symlink(name, current)
+      names = os.listdir(self.location)
+      names.sort()
+      for name in names:
+        if name == "current":
+          continue
+
+        path = os.path.join(self.location, name)
+        self.old_files.append([path, os.path.getsize(path)])
+
+      # Compress anything that got left uncompressed last time.
+      for path, _ in self.old_files:
+        if not path.endswith(".gz"):
+          self.__compress_later(path)
+
+      self.__open()
+
+  # Starts a new log file.
+  def __open(self):
+    stem = str(time.time()).split(".")[0]
+    name = stem + ".log"
+    # We might rotate more than once in a second.
+    count = 0
+    while (os.path.exists(os.path.join(self.location, name)) or \
+        os.path.exists(os.path.join(self.location, name + ".gz"))):
+      count += 1
+      name = "%s-%d.log" % (stem, count)
+
+    self.file_path = os.path.join(self.location, name)
+    self.file = open(self.file_path, "w")
+    self.file_size = 0
+    self.file_start = time.time()
+
+    # Set symlink.
+    current = os.path.join(self.location, "current")
+    if os.path.lexists(current):
+      os.remove(current)
+    os.symlink(name, current)
+
+  # Moves on to a new file, and compresses the old one in the background.
+  def __rotate(self):
+    self.file.close()
+    with self.lock:
+      self.old_files.append([self.file_path, self.file_size])
+    self.__compress_later(self.file_path)
+
+    self.__open()
+    self.__remove_old()
+
+  def __compress_later(self, path):
+    thread = threading.Thread(target = self.__compress, args = (path,))
+    thread.daemon = True
+    thread.start()
+
+  # Gzips an old log file and replaces it with the compressed one.
+  def __compress(self, path):
+    compressed_path = path + ".gz"
+    try:
+      with open(path, "rb") as source:
+        with gzip.open(compressed_path, "wb") as destination:
+          shutil.copyfileobj(source, destination)
+    except (IOError, OSError):
+      # Leave it as it is.
+      return
+
+    with self.lock:
+      for entry in self.old_files:
+        if entry[0] == path:
+          entry[0] = compressed_path
+          entry[1] = os.path.getsize(compressed_path)
+          os.remove(path)
+          return
+
+    # It got removed while we were working on it.
+    os.remove(compressed_path)
 
   # Remove old logs if things are getting too big.
   def __remove_old(self):
-    old_files = os.listdir(self.location)
-    old_files.sort()
-
-    if "current" in old_files:
-      old_files.remove("current")
-
-    for i in range(0, len(old_files)):
-      old_files[i] = os.path.join(self.location, old_files[i])
-
-    size = sum(os.path.getsize(f) for f in old_files)
-
-    while size > self.max_size:
-      to_delete = old_files.pop(0)
-
-      if (self.file != None and len(old_files) == 0):
-        self.clear()
-        Logger.start_size = 0
-        return
-
-      size -= os.path.getsize(to_delete)
-      os.remove(to_delete)
+    with self.lock:
+      size = sum(entry[1] for entry in self.old_files) + self.file_size
 
-    Logger.start_size = size
+      while (size > self.max_size and self.old_files):
+        path, file_size = self.old_files.pop(0)
+        size -= file_size
+        try:
+          os.remove(path)
+        except OSError:
+          # It's probably being compressed right now. It'll get removed next
+          # time.
+          pass
 
   def __del__(self):
     try:
@@ -69,77 +138,195 @@ class Logger:
     except AttributeError:
       pass
 
-  # Write a log message to the file.
-  def write(self, level, name, message):
-    timestamp = time.ctime()
-    self.file.write("[%s@%s] %s: %s\n" % (name, timestamp, level, message))
-
-  # Flushes all messages not yet written.
+  # Returns the timestamp to put on a message from a certain time. It only
+  # changes once a second, so we only format it that often.
+  def __get_timestamp(self, when):
+    second = int(when)
+    if second != self.timestamp_second:
+      self.timestamp = time.ctime(second)
+      self.timestamp_second = second
+
+    return self.timestamp
+
+  # Write a batch of (time, level, name, message) to the file all at once.
+  def write(self, messages):
+    data = "".join(["[%s@%s] %s: %s\n" % (name, self.__get_timestamp(when),
+        level, message) for when, level, name, message in messages])
+    self.file.write(data)
+    self.file_size += len(data)
+
+  # Flushes all messages not yet written, and starts a new file if this one is
+  # too big or too old.
   def flush(self):
     self.file.flush()
 
-    # Clear the file if it's too big.
-    if os.path.getsize(self.file_path) + self.start_size > self.max_size:
-      self.__remove_old()
+    if (self.file_size > self.max_file_size or \
+        time.time() - self.file_start > self.max_file_age):
+      self.__rotate()
 
-  # Clears the logfile.
-  def clear(self):
-    self.file.seek(0)
-    self.file.truncate()
-
-# Initialize root logging instance.
-root = Logger(LOG_LOCATION)
+# The root logging instance. This only gets made in the log program.
+root = None
 
 class log(Program):
+  # Most messages we write at once.
+  batch_size = 256
+  # How long to wait for more messages once we have one, so that we can write
+  # them together. (seconds)
+  batch_time = 0.05
+
   def setup(self):
     self.add_feed("logging")
+    self.add_topic("log_messages", slots = 256, slot_size = 2048)
 
   def run(self):
-    flush_pending = False
+    global root
+    root = Logger(LOG_LOCATION)
+    store = None
+    if not robot_status.is_testing():
+      store = log_store.LogStore(STORE_LOCATION)
 
     while True:
-      if (not flush_pending or not self.logging.empty()):
-        level, name, message = self.logging.get()
-
-        # Write it to the webserver, if it is running.
+      # Wait for something to happen, then give everything else a little time
+      # to show up.
+      batch = [self.logging.get()]
+      end = time.time() + log.batch_time
+      while len(batch) < log.batch_size:
+        remaining = end - time.time()
+        try:
+          if remaining > 0:
+            batch.append(self.logging.get(timeout = remaining))
+          else:
+            batch.append(self.logging.get_nowait())
+        except Empty:
+          break
+
+      # They come from different processes, so they might not be in order.
+      batch.sort(key = lambda entry: entry[0])
+
+      # Publish them for anyone who is interested, like the webserver.
+      for when, level, name, message in batch:
         try:
           if level != "DEBUG":
-            self.write_to_feed("web_logging", (level, name, message), False)
-        except (RuntimeError, ValueError):
-          # It's not critical that we write it.
+            self.publish("log_messages", (level, name, message))
+        except ValueError:
+          # It's not critical that we publish it.
           pass
 
-        root.write(level, name, message)
-        flush_pending = True
-
-      else:
-        root.flush()
-        flush_pending = False
+      root.write(batch)
+      root.flush()
+
+      if store:
+        store.append(batch)
+
+# Levels in order of importance.
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "FATAL": 50}
+
+# Messages less important than this don't get logged, unless the program (with
+# a log_level class attribute) or the module they come from says otherwise.
+default_level = os.environ.get("NEATO_LOG_LEVEL", "DEBUG")
+# Levels for specific modules, by module name. These override program levels.
+module_levels = {
+  # SLAM dumps whole matrices every step when debugging.
+  "navigation.slam": "INFO",
+}
+
+# The numeric level for each (program, module), so that we only work it out
+# once.
+__thresholds = {}
+# When each rate limited message was last logged, and how many times it was
+# left out since, indexed by (module, message).
+__limited = {}
+
+# Sets the level for a module, or the default level if no module is given.
+def set_level(level, module = None):
+  if level not in LEVELS:
+    raise ValueError("Unknown log level '%s'." % (level))
+
+  if module:
+    module_levels[module] = level
+  else:
+    global default_level
+    default_level = level
+
+  __thresholds.clear()
+
+# Gets the numeric level that messages from a module have to meet.
+def __get_threshold(module):
+  program = robot_status.program
+  key = (program.__class__.__name__, module)
+
+  try:
+    return __thresholds[key]
+  except KeyError:
+    pass
+
+  level = module_levels.get(module)
+  if not level:
+    level = getattr(program, "log_level", None) or default_level
+  __thresholds[key] = LEVELS[level]
+  return LEVELS[level]
+
+# Gets the name of the module that called into us.
+def __caller_module():
+  return sys._getframe(3).f_globals.get("__name__")
+
+# Returns whether a message at this level would get logged from the calling
+# module, so that callers can skip expensive work for messages that won't be.
+def enabled_for(level):
+  return LEVELS[level] >= __get_threshold(sys._getframe(1).f_globals.get(
+      "__name__"))
+
+# Logs a message if it is important enough, formatting it with args only if it
+# is. With rate_limit, the same message gets logged at most once in that many
+# seconds.
+def __log(level, message, args, rate_limit):
+  module = __caller_module()
+  if LEVELS[level] < __get_threshold(module):
+    return
+
+  now = time.time()
+  suppressed = 0
+  if rate_limit:
+    key = (module, message)
+    last, suppressed = __limited.get(key, (0, 0))
+    if now - last < rate_limit:
+      __limited[key] = (last, suppressed + 1)
+      return
+
+    __limited[key] = (now, 0)
+
+  if args:
+    message = message % args
+  if suppressed:
+    message += " (%d similar messages left out.)" % (suppressed)
+  __log_write(now, level, message)
 
 # Shortcuts for logging to the root logger at specific levels.
 if robot_status.is_testing():
-  def __log_write(level, message):
+  def __log_write(when, level, message):
     print "%s: %s" % (level, message)
 else:
-  def __log_write(level, message):
+  # Messages go to the log program as (time, level, program name, message),
+  # with the time they were logged.
+  def __log_write(when, level, message):
     program = robot_status.program
     name = program.__class__.__name__
-    Program.write_to_feed("logging", (level, name, message))
+    Program.write_to_feed("logging", (when, level, name, message))
 
-def debug(message):
-  __log_write("DEBUG", message)
+def debug(message, *args, **kwargs):
+  __log("DEBUG", message, args, kwargs.get("rate_limit"))
 
-def info(message):
-  __log_write("INFO", message)
+def info(message, *args, **kwargs):
+  __log("INFO", message, args, kwargs.get("rate_limit"))
 
-def warning(message):
-  __log_write("WARNING", message)
+def warning(message, *args, **kwargs):
+  __log("WARNING", message, args, kwargs.get("rate_limit"))
 
-def error(message):
-  __log_write("ERROR", message)
+def error(message, *args, **kwargs):
+  __log("ERROR", message, args, kwargs.get("rate_limit"))
 
-def fatal(message):
-  __log_write("FATAL", message)
+def fatal(message, *args):
+  __log("FATAL", message, args, None)
 
   # Exit with failure.
   sys.exit(1)
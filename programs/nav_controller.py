@@ -29,6 +29,7 @@ class nav_controller(Program):
   # How much "wiggle" is tolerated between points until we say there is a
   # doorway.
   doorway_threshold = 800
+  nice = 10
 
   def setup(self):
     self.add_pipe("control")
@@ -38,7 +39,7 @@ class nav_controller(Program):
     self.map_building = False
     self.lds = None
 
-    rate = Rate()
+    rate = Rate("navigation")
 
     while True:
       rate.rate(1)
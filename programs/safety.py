@@ -2,89 +2,159 @@
 # itself.
 
 import sys
+import time
 sys.path.append("..")
 
-from rate import Rate
+from clock import monotonic
+from programs import log
 from starter import Program
 
-import log
 import motors
+import numpy as np
 import robot_status
 import sensors
 import serial_api
 
 class safety(Program):
+  # This needs to keep checking the sensors no matter how busy everything else
+  # is.
+  realtime_priority = 50
+
+  # Drop sensor readings at or below this mean that there is nothing under us.
+  drop_threshold = 25000
+  # How often the drop sensors get sampled. (seconds)
+  sample_period = 0.001
+  # Longest we wait for a drop before checking on everything else. (seconds)
+  check_interval = 0.05
+  # If we don't get any drop sensor samples for this long, we can't trust them.
+  # (seconds)
+  stale_time = 0.5
+
   def setup(self):
     self.add_pipe("control")
 
   def run(self):
     self.wheels = motors.Wheels()
     self.enabled = True
-    stale_data = False
+    # Why we disabled the motors, and when, on the wall clock. We only enable
+    # them again once that clears up.
+    self.disabled_by = None
+    self.disabled_time = 0
 
-    analog = sensors.Analog()
     digital = sensors.Digital()
+    drops = sensors.DropSampler(period = safety.sample_period,
+        threshold = safety.drop_threshold)
 
-    rate = Rate()
+    last_sample = monotonic()
+    # The last wheel extension readings we looked at.
+    extended = (False, False)
+    digital_time = 0
 
     while True:
-      rate.rate(0.1)
-
-      # Check that we're not about to drive off a drop.
-      if (robot_status.get_driving() or not self.enabled):
-        try:
-          left_drop, right_drop = analog.drop(stale_time = 0)
-          if stale_data:
-            log.info("Reenabling wheels...")
-            self.__enable()
-            stale_data = False
-
-        except ValueError:
-          if not stale_data:
-            log.warning("Can't get reliable readings. Disabling motors...")
-            self.__disable()
-            stale_data = True
-            continue
-
-        if (max(left_drop, right_drop) <= 25000 and self.enabled):
-          log.debug("Drop sensor readings: %d, %d." % (left_drop, right_drop))
-
-          left, right = digital.wheels_extended(stale_time = 0.5)
-          if (not left and not right):
-            log.info("Detected drop, running drop handler.")
-            self.__drop_handler()
-          else:
-            log.info("Robot picked up, disabling.")
-
-            self.__disable()
-        elif (max(left_drop, right_drop) > 25000 and not self.enabled):
-          # We're back on the ground.
-          log.debug("Drop sensor readings: %d, %d." % (left_drop, right_drop))
-
-          log.info("Back on ground, continuing...")
+      # Wake up right away if both drop sensors see a drop.
+      drops.wait_for_drop(safety.check_interval)
+      samples = drops.read()
+      now = monotonic()
+
+      if len(samples):
+        last_sample = now
+        left_drop = int(samples["left"][-1])
+        right_drop = int(samples["right"][-1])
+        robot_status.write_state(left_drop = left_drop,
+            right_drop = right_drop, drop_time = time.time())
+
+        if self.disabled_by == "stale drop sensors":
+          log.info("Reenabling wheels...")
           self.__enable()
 
-  # Handles a detected drop.
+      elif now - last_sample > safety.stale_time:
+        if self.enabled:
+          log.warning("Can't get reliable readings. Disabling motors...")
+          self.__disable("stale drop sensors", now)
+        continue
+
+      # Check if someone picked us up while we were driving.
+      state = robot_status.read_state()
+      if state.digital_time != digital_time:
+        digital_time = state.digital_time
+        was_extended = extended
+        extended = (bool(state.left_wheel_extended),
+            bool(state.right_wheel_extended))
+
+        if (extended != was_extended and (extended[0] or extended[1]) and \
+            self.enabled and robot_status.get_driving()):
+          log.info("Wheels extended while driving, disabling.")
+          # The reading is from a while ago.
+          self.__disable("wheels extended",
+              now - (time.time() - digital_time))
+          continue
+
+      if not len(samples):
+        continue
+
+      below = np.maximum(samples["left"], samples["right"]) <= \
+          safety.drop_threshold
+
+      # Check that we're not about to drive off a drop.
+      if (self.enabled and robot_status.get_driving() and below.any()):
+        # Stop first, then figure out what happened.
+        first = below.argmax()
+        detect_time = samples["timestamp"][first]
+        log.debug("Drop sensor readings: %d, %d.", samples["left"][first],
+            samples["right"][first])
+        serial_api.emergency_stop(serial_api.STOP_COMMAND, "drop",
+            detect_time)
+
+        left, right = digital.wheels_extended(stale_time = 0.5)
+        if (not left and not right):
+          log.info("Detected drop, running drop handler.")
+          self.__drop_handler()
+          # Everything that came in while we were backing up is from when we
+          # were still at the edge.
+          drops.skip()
+          continue
+        else:
+          log.info("Robot picked up, disabling.")
+
+          self.__disable("picked up", detect_time)
+      elif (self.disabled_by in ("picked up", "wheels extended") and \
+          not below[-1] and extended == (False, False) and \
+          digital_time > self.disabled_time):
+        # We're back on the ground, and the wheels say so too.
+        log.debug("Drop sensor readings: %d, %d.", left_drop, right_drop)
+
+        log.info("Back on ground, continuing...")
+        self.__enable()
+
+  # Handles a detected drop, once the wheels have been stopped.
   def __drop_handler(self):
     # Freeze the control program.
     serial_api.freeze()
 
-    # Stop motors and navigate away from the drop.
-    self.wheels.stop()
-    self.wheels.drive(-500, -500, 100)
-    self.wheels.turn(90)
+    # Navigate away from the drop. The emergency stop already stopped the wheels
+    # and cancelled everyone's motions. Both moves get queued so that the turn
+    # goes out as soon as the backing up should be done.
+    self.wheels.motion.cancel()
+    self.wheels.motion.drive(-500, 100)
+    self.wheels.motion.turn(90).wait()
 
     # Unfreeze control program and return to normal operation.
     serial_api.unfreeze()
 
-  # Disables motors.
-  def __disable(self):
+  # Disables motors. Trigger says why, and detect_time is when we noticed, on
+  # the monotonic clock.
+  def __disable(self, trigger, detect_time):
+    serial_api.emergency_stop(serial_api.DISABLE_COMMAND, trigger,
+        detect_time)
     serial_api.freeze()
     self.wheels.disable()
     self.enabled = False
+    self.disabled_by = trigger
+    self.disabled_time = time.time()
 
   # Enables motors.
   def __enable(self):
     self.wheels.enable()
     serial_api.unfreeze()
     self.enabled = True
+    self.disabled_by = None
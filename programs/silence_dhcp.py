@@ -5,9 +5,9 @@ import sys
 import time
 sys.path.append("..")
 
+from programs import log
 from starter import Program
 
-import log
 import neato_system
 
 class silence_dhcp(Program):
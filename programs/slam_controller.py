@@ -9,19 +9,22 @@ import time
 sys.path.append("..")
 
 from navigation import slam
+from programs import log
 from rate import Rate
 from starter import Program
 
-import log
 import robot_status
 
 class slam_controller(Program):
+  # The filter can take a while, so let more important things go first.
+  nice = 10
+
   def setup(self):
     self.add_feed("slam_controller")
     self.add_pipe("control")
 
   def run(self):
-    rate = Rate()
+    rate = Rate("slam")
     nav = None
 
     # Wait for a command.
@@ -33,6 +36,7 @@ class slam_controller(Program):
           if command["run"]:
             log.info("Starting SLAM navigation...")
             nav = slam.Slam(command["x"], command["y"], command["theta"])
+            self.__publish_pose(nav)
 
             # Notify anyone waiting that we're ready.
             for pipe in self.pipes:
@@ -41,6 +45,8 @@ class slam_controller(Program):
           else:
             log.info("Stopping SLAM navigation...")
             nav = None
+            # Nobody should use the old pose anymore.
+            robot_status.write_state(pose_time = 0)
         else:
           if nav:
             if "driving" in command.keys():
@@ -53,14 +59,6 @@ class slam_controller(Program):
                 print "Stopped driving: " + str(command["position"])
                 nav.stopped_driving(command["position"], command["timestamp"])
 
-            elif "displacement" in command.keys():
-              if command["displacement"]:
-                log.debug("Displacement requested.")
-
-                # Send our displacement.
-                pipe = getattr(self, command["program"])
-                pipe.send({"displacement": nav.get_displacement()})
-
             elif "reset" in command.keys():
               if command["reset"] == "position":
                 # Reset the robot position.
@@ -71,6 +69,8 @@ class slam_controller(Program):
                 log.info("Resetting the robot's bearing.")
                 nav.reset_bearing()
 
+            self.__publish_pose(nav)
+
           else:
             log.warning("Not running command when SLAM isn't running.")
 
@@ -79,8 +79,14 @@ class slam_controller(Program):
         rate.rate(0.5)
         print "Updating position..."
         nav.update_position()
+        self.__publish_pose(nav)
         print "Done!"
 
+  # Writes the current pose into the shared robot state.
+  def __publish_pose(self, nav):
+    variances = nav.kalman.P.diagonal()[:3]
+    robot_status.write_pose(nav.x_pos, nav.y_pos, nav.bearing, variances)
+
 
 def __write_driving_status(is_driving, wheel_position):
   try:
@@ -91,6 +97,9 @@ def __write_driving_status(is_driving, wheel_position):
         block = False)
   except RuntimeError:
     log.debug("Not notifying SLAM process because queue is full.")
+  except ValueError:
+    # The SLAM controller isn't running.
+    pass
 
 
 # These functions can be run by other processes to notify the slam system of
@@ -122,14 +131,16 @@ def start(start_x = 0, start_y = 0, start_bearing = math.pi / 2):
 def stop():
   robot_status.program.write_to_feed("slam_controller", {"run": False})
 
-# Get the current displacement of the robot.
+# Get the current displacement of the robot, as (x, y, bearing in degrees).
+# Returns None if SLAM isn't running.
 def get_displacement():
-  program_name = robot_status.program.__class__.__name__
-  robot_status.program.write_to_feed("slam_controller",
-      {"displacement": True,
-      "program": program_name})
+  pose = robot_status.read_pose()
+  if not pose:
+    log.warning("No displacement because SLAM isn't running.")
+    return None
 
-  return robot_status.program.slam_controller.recv()["displacement"]
+  x, y, theta = pose
+  return (x, y, math.degrees(theta))
 
 # Resets the position of the robot.
 def reset_position():
@@ -15,9 +15,10 @@ function main() {
   setInterval(function() {
     lidar.update();
   }, 2000);
+  // This has to be well under the watchdog timeout on the robot.
   setInterval(function() {
     movement.keepAlive();
-  }, 1000);
+  }, 250);
 }
 
 // A class for handling movement control.
@@ -9,6 +9,8 @@ import sensors
 import slam_controller
 
 class test_navigation(Program):
+  nice = 10
+
   def setup(self):
     self.add_pipe("control")
     self.add_pipe("slam_controller")
@@ -1,87 +1,112 @@
 # A safety feature that can disable certain systems in the event of a lost
 # connection or such.
 
+import heapq
 import sys
-import time
 sys.path.append("..")
 
-from rate import Rate
+from clock import monotonic
+from Queue import Empty
+from programs import log
 from starter import Program
 
-import log
+
+# Returns the current time on the monotonic clock in milliseconds, the way it
+# gets stored in the heartbeat slots. This wraps around every 49 days, so only
+# differences mean anything. It's never 0, since that means "not fed yet".
+def heartbeat_time():
+  return (int(monotonic() * 1000) & 0xffffffff) or 1
+
+# A single program being watched.
+class Job:
+  def __init__(self, name, slot, timeout, callback):
+    self.name = name
+    # Where the program's heartbeats are in shared memory.
+    self.slot = slot
+    self.timeout = timeout
+    self.callback = callback
+    self.timed_out = False
 
 class watchdog(Program):
   def setup(self):
     self.add_feed("watchdog_jobs")
 
   def run(self):
-    jobs = []
-    timed_out = []
-    last_feeds = {}
-    timeouts = {}
-    callbacks = {}
-
-    rate = Rate()
+    # Jobs indexed by program name.
+    jobs = {}
+    # When to check on each job next, as (deadline, job).
+    deadlines = []
 
     while True:
-      rate.rate(1)
+      # Wait for new jobs until the next job has to be checked.
+      try:
+        if deadlines:
+          wait = max(deadlines[0][0] - monotonic(), 0)
+          new_jobs = [self.watchdog_jobs.get(timeout = wait)]
+        else:
+          new_jobs = [self.watchdog_jobs.get()]
 
-      # Check for new jobs.
-      new_jobs = []
-      if not jobs:
-        # Block until we get a job if we don't have any.
-        new_jobs = [self.watchdog_jobs.get()]
-      while not self.watchdog_jobs.empty():
-        new_jobs.append(self.watchdog_jobs.get())
+        while not self.watchdog_jobs.empty():
+          new_jobs.append(self.watchdog_jobs.get())
+      except Empty:
+        new_jobs = []
 
       for job in new_jobs:
         name = job[0]
         if job[1] == "register":
-          timeouts[name] = job[2]
-          callbacks[name] = job[3]
-          jobs.append(name)
+          jobs[name] = Job(name, job[4], job[2], job[3])
+          heapq.heappush(deadlines, (monotonic(), jobs[name]))
 
           log.info("Got new job: %s" % (name))
         else:
-          try:
-            jobs.remove(name)
-          except ValueError:
+          if name not in jobs:
             raise ValueError("No watchdog '%s' registered." % (name))
-
-          timeouts.pop(name, None)
-          callbacks.pop(name, None)
-
-          if name in last_feeds.keys():
-            last_feeds.pop(name, None)
+          jobs.pop(name)
 
           log.info("Removed job: %s" % (name))
 
-      # Get any new feed events.
-      for name in jobs:
-        pipe = getattr(self, name)
-
-        if pipe.poll():
-          timestamp = pipe.recv()
-          log.debug("Got feed from %s at %f." % (name, timestamp))
-          last_feeds[name] = timestamp
-
-          if name in timed_out:
-            timed_out.remove(name)
-
-      # Check to see if anything must be disabled.
-      for key in last_feeds.keys():
-        if time.time() - last_feeds[key] >= timeouts[key]:
-          if key not in timed_out:
-            log.error("Timeout on %s." % (key))
-            # Run callback.
-            callbacks[name](self)
-
-            timed_out.append(key)
-
-# Registers a new watchdog.
+      # Check everything that's due.
+      now = monotonic()
+      while (deadlines and deadlines[0][0] <= now):
+        _, job = heapq.heappop(deadlines)
+        if jobs.get(job.name) is not job:
+          # It got deregistered or replaced.
+          continue
+
+        heapq.heappush(deadlines, (self.__check(job), job))
+
+  # Checks whether a job has timed out, and runs its callback if it has.
+  # Returns when it should be checked again.
+  def __check(self, job):
+    now = monotonic()
+    last_feed = self.heartbeats[job.slot]
+    if not last_feed:
+      # It hasn't been fed yet, and it doesn't time out until it has.
+      return now + job.timeout
+
+    age = ((heartbeat_time() - last_feed) & 0xffffffff) / 1000.0
+    if age < job.timeout:
+      if job.timed_out:
+        log.info("%s is back." % (job.name))
+        job.timed_out = False
+
+      return now + job.timeout - age
+
+    if not job.timed_out:
+      log.error("Timeout on %s." % (job.name))
+      job.callback(self)
+      job.timed_out = True
+
+    return now + job.timeout
+
+# Registers a new watchdog. The timeout can be as short as a few tens of
+# milliseconds. (seconds)
 def register(program, timeout, callback):
   name = program.__class__.__name__
-  program.write_to_feed("watchdog_jobs", (name, "register", timeout, callback))
+  # Don't let an old heartbeat count.
+  program.heartbeats[program.heartbeat_slot] = 0
+  program.write_to_feed("watchdog_jobs", (name, "register", timeout, callback,
+      program.heartbeat_slot))
 
 # Deregisters an existing watchdog.
 def deregister(program):
@@ -90,4 +115,4 @@ def deregister(program):
 
 # Feeds the watchdog.
 def feed(program):
-  program.watchdog.send(time.time())
+  program.heartbeats[program.heartbeat_slot] = heartbeat_time()
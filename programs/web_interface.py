@@ -3,30 +3,52 @@
 # Implements a web interface for the robot.
 
 from __future__ import division
-from Queue import Empty
 
 import json
 import sys
 sys.path.append("..")
 
-from flask import Flask
-from flask import render_template
-from flask import request
+from Queue import Empty
+
+from programs import log
 from starter import Program
 
 import continuous_driving
-import log
+import log_store
 import sensors
+import topic_bus
 import watchdog
 
-app = Flask(__name__)
+# All of our routes, as a list of (rule, options, function). Flask takes a long
+# time to import, so we don't make the app until this program actually runs.
+routes = []
+
+# Decorator that works like app.route().
+def route(rule, **kwargs):
+  def decorator(function):
+    routes.append((rule, kwargs, function))
+    return function
+
+  return decorator
+
+# Makes the flask app with all our routes.
+def make_app():
+  from flask import Flask
 
-@app.route("/")
+  app = Flask(__name__)
+  for rule, options, function in routes:
+    app.add_url_rule(rule, view_func = function, **options)
+
+  return app
+
+@route("/")
 def main():
+  from flask import render_template
+
   return render_template("main.html")
 
 # Get battery percentage.
-@app.route("/battery/")
+@route("/battery/")
 def battery():
   analog = sensors.Analog()
   voltage = analog.battery_voltage(stale_time = 60)
@@ -35,7 +57,7 @@ def battery():
   return str(percentage)
 
 # Determine whether we are charging or not.
-@app.route("/charging/")
+@route("/charging/")
 def charging():
   analog = sensors.Analog()
   voltage = analog.charging(stale_time = 20)
@@ -48,21 +70,62 @@ def charging():
   return str(charging)
 
 # Get the latest logging messages. (JSON formatted.)
-@app.route("/logging/")
+@route("/logging/")
 def logging():
-  # Get all the most recent messages.
-  messages = []
-  while True:
-    try:
-      messages.append(web_interface.root.web_logging.get(False))
-    except Empty:
-      break
-
-  return json.dumps(messages)
+  # Get all the messages since the last time we checked.
+  subscription = web_interface.root.subscriptions["log_messages"]
+  return json.dumps(subscription.receive_all())
+
+# Get old logging messages. Takes start and end times, comma separated
+# programs, the least important level to include, a limit, and the cursor from
+# the last page, all optional. (JSON formatted.)
+@route("/logging/history/")
+def logging_history():
+  from flask import request
+
+  start = request.args.get("start", None, type = float)
+  end = request.args.get("end", None, type = float)
+  programs = request.args.get("programs")
+  if programs:
+    programs = programs.split(",")
+  level = request.args.get("level")
+  if (level and level not in log_store.LEVEL_CODES):
+    return json.dumps({"error": "Unknown level '%s'." % (level)}), 400
+  limit = min(request.args.get("limit", 100, type = int), 1000)
+  cursor = request.args.get("cursor")
+
+  messages, cursor = log_store.query(log.STORE_LOCATION, start = start,
+      end = end, programs = programs, level = level, limit = limit,
+      cursor = cursor)
+  return json.dumps({"messages": messages, "cursor": cursor})
+
+# Get the latest resource usage for every program. (JSON formatted.)
+@route("/resources/")
+def resource_usage():
+  subscription = web_interface.root.subscriptions["resources"]
+  try:
+    web_interface.root.resources = subscription.receive(block = False)
+  except Empty:
+    # Nothing new, so use what we had last time.
+    pass
+
+  return json.dumps(web_interface.root.resources)
+
+# Get the latest timing for every named loop, as a dictionary of summaries
+# indexed by program and then loop. (JSON formatted.)
+@route("/loop_timing/")
+def loop_timing():
+  subscription = web_interface.root.subscriptions["loop_timing"]
+  for program, loop, summary in subscription.receive_all():
+    web_interface.root.loop_timing.setdefault(program, {})[loop] = summary
+
+  return json.dumps(web_interface.root.loop_timing)
 
 # Determine whether lidar is active.
-@app.route("/lds_active/", methods = ["GET", "POST"])
+@route("/lds_active/", methods = ["GET", "POST"])
 def lds_active():
+  from flask import request
+
   if request.method == "GET":
     status = int(sensors.LDS.is_active())
 
@@ -81,7 +144,7 @@ def lds_active():
     return str(1)
 
 # Get a packet from the lidar.
-@app.route("/lds/")
+@route("/lds/")
 def lds():
   if web_interface.root.lds:
     packet = web_interface.root.lds.get_scan()
@@ -90,21 +153,21 @@ def lds():
   return json.dumps(packet)
 
 # Instruct robot to drive forward.
-@app.route("/drive_forward/", methods = ["POST"])
+@route("/drive_forward/", methods = ["POST"])
 def drive_forward():
   # Drive forward.
   continuous_driving.drive(web_interface.root, 1, 1, 300)
   web_interface.root.quickturn = False
   return str(1)
 
-@app.route("/drive_backward/", methods = ["POST"])
+@route("/drive_backward/", methods = ["POST"])
 def drive_backward():
   # Drive backward.
   continuous_driving.drive(web_interface.root, -1, -1, 300)
   web_interface.root.quickturn = False
   return str(1)
 
-@app.route("/turn_left/", methods = ["POST"])
+@route("/turn_left/", methods = ["POST"])
 def turn_left():
   if web_interface.root.quickturn:
     # Quickturn.
@@ -117,7 +180,7 @@ def turn_left():
 
   return str(1)
 
-@app.route("/turn_right/", methods = ["POST"])
+@route("/turn_right/", methods = ["POST"])
 def turn_right():
   if web_interface.root.quickturn:
     continuous_driving.drive(web_interface.root, 1, -1, 100)
@@ -127,7 +190,7 @@ def turn_right():
 
   return str(1)
 
-@app.route("/stop/", methods = ["POST"])
+@route("/stop/", methods = ["POST"])
 def stop():
   # Stop moving.
   continuous_driving.stop(web_interface.root)
@@ -139,11 +202,11 @@ def callback(program):
   continuous_driving.stop(program)
 
 # Feeds the watchdog on the wheels.
-@app.route("/feed_watchdog/", methods = ["POST"])
+@route("/feed_watchdog/", methods = ["POST"])
 def feed_watchdog():
   # Register the watchdog if we haven't already.
   if not web_interface.root.has_watchdog:
-    watchdog.register(web_interface.root, 5, callback)
+    watchdog.register(web_interface.root, 1, callback)
     web_interface.root.has_watchdog = True
     # If we're reconnecting, we probably want the quickturn to start. (It did
     # not get set if the watchdog timed out.)
@@ -154,7 +217,7 @@ def feed_watchdog():
   return str(1)
 
 # Deregisters the watchdog.
-@app.route("/stop_watchdog/", methods = ["POST"])
+@route("/stop_watchdog/", methods = ["POST"])
 def stop_watchdog():
   if web_interface.root.has_watchdog:
     watchdog.deregister(web_interface.root)
@@ -168,16 +231,20 @@ class web_interface(Program):
 
   def setup(self):
     self.add_pipe("control")
-    self.add_pipe("watchdog")
 
-    self.add_feed("web_logging")
+    self.subscribe("log_messages", size = 256)
+    self.subscribe("resources", policy = topic_bus.LATEST_ONLY)
+    self.subscribe("loop_timing")
 
   def run(self):
     web_interface.root = self
     self.lds = None
     self.quickturn = True
     self.has_watchdog = False
+    self.resources = {}
+    self.loop_timing = {}
 
+    app = make_app()
     app.debug = True
     # The flask auto-reloader doesn't work well with multiprocessing.
     app.run(host = "0.0.0.0", use_reloader = False)
@@ -1,17 +1,121 @@
+import bisect
 import time
 
+from clock import monotonic
+
+import robot_status
+
+# Upper edges of the buckets for the lateness histogram. There is one more
+# bucket for anything later than the last one. (seconds)
+LATENESS_BUCKETS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2,
+    0.5]
+
+# Keeps track of how well a loop is keeping to its schedule.
+class LoopStats:
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.count = 0
+    # Sum of the time between iterations, for the mean period. (seconds)
+    self.total_period = 0
+    # Sum and worst of how far each period was from what it should have been.
+    # (seconds)
+    self.total_jitter = 0
+    self.worst_jitter = 0
+    # How many times the loop body took longer than the interval.
+    self.overruns = 0
+    # How late we were getting back to the loop at worst. (seconds)
+    self.worst_lateness = 0
+    # How many iterations were late by up to each of LATENESS_BUCKETS.
+    self.histogram = [0] * (len(LATENESS_BUCKETS) + 1)
+
+  def add(self, period, interval, lateness):
+    self.count += 1
+    self.total_period += period
+    jitter = abs(period - interval)
+    self.total_jitter += jitter
+    self.worst_jitter = max(self.worst_jitter, jitter)
+    self.worst_lateness = max(self.worst_lateness, lateness)
+    self.histogram[bisect.bisect_left(LATENESS_BUCKETS, lateness)] += 1
+
+  # Returns everything as a dict.
+  def summary(self):
+    count = max(self.count, 1)
+    return {
+      "count": self.count,
+      "mean_period": self.total_period / count,
+      "mean_jitter": self.total_jitter / count,
+      "worst_jitter": self.worst_jitter,
+      "overruns": self.overruns,
+      "worst_lateness": self.worst_lateness,
+      "buckets": LATENESS_BUCKETS,
+      "histogram": self.histogram,
+    }
+
 # When one call is made every loop iteration, it insures that each iteration
-# takes exactly this many seconds.
+# starts exactly this many seconds after the last one. Deadlines are kept on a
+# fixed schedule, so small delays don't add up. Named loops publish their
+# timing on the "loop_timing" topic.
 class Rate():
-  def __init__(self):
-    self.last_time  = 0
+  # How often named loops publish their timing. (seconds)
+  publish_interval = 10
+
+  def __init__(self, name = None):
+    self.name = name
+    self.stats = LoopStats()
+    # When the next iteration should start, on the monotonic clock.
+    self.deadline = None
+    # When the last iteration started.
+    self.last_start = None
+    self.next_publish = monotonic() + Rate.publish_interval
+
+  # Starts the schedule over from now, such as after blocking for a while on
+  # purpose.
+  def reset(self):
+    self.deadline = None
+    self.last_start = None
+
   def rate(self, interval):
-    elapsed = time.time() - self.last_time
-    self.last_time = time.time()
+    now = monotonic()
 
-    if elapsed > interval:
+    if self.deadline == None:
+      # First time, so just start the schedule.
+      self.deadline = now + interval
+      self.last_start = now
       return
+
+    if now > self.deadline:
+      # The loop body took too long.
+      self.stats.overruns += 1
     else:
-      remaining = interval - elapsed
-      time.sleep(remaining)
+      time.sleep(self.deadline - now)
+
+    start = monotonic()
+    lateness = start - self.deadline
+    self.stats.add(start - self.last_start, interval, lateness)
+    self.last_start = start
+
+    if lateness > interval:
+      # We missed at least a whole iteration. Don't try to catch up.
+      self.deadline = start + interval
+    else:
+      self.deadline += interval
+
+    if (self.name and start >= self.next_publish):
+      self.next_publish = start + Rate.publish_interval
+      self.publish()
+
+  # Publishes the timing so far on the "loop_timing" topic, as (program, loop,
+  # summary).
+  def publish(self):
+    program = robot_status.program
+    if not program:
       return
+
+    try:
+      program.publish("loop_timing", (program.__class__.__name__, self.name,
+          self.stats.summary()))
+    except ValueError:
+      # Nobody set up the topic.
+      pass
@@ -0,0 +1,69 @@
+# Keeps track of how much of the system each process is using, from what the
+# kernel puts in /proc.
+
+import os
+import time
+
+# How many clock ticks per second the CPU times in /proc are in.
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+# Size of a memory page. (bytes)
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Reads the fields we care about from /proc/<pid>/stat and /proc/<pid>/status.
+# Returns a dict with the total CPU time used (seconds), resident set size
+# (bytes), number of threads and context switch counts, or None if the process
+# is gone.
+def read_process(pid):
+  try:
+    with open("/proc/%d/stat" % (pid)) as stat_file:
+      stat = stat_file.read()
+    with open("/proc/%d/status" % (pid)) as status_file:
+      status = status_file.read()
+  except IOError:
+    return None
+
+  # The command name can have spaces in it, so start after it.
+  fields = stat[(stat.rindex(")") + 2):].split()
+  # These are fields 14, 15, 20 and 24 in proc(5), which starts counting at the
+  # pid.
+  info = {
+    "cpu_time": (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS),
+    "threads": int(fields[17]),
+    "rss": int(fields[21]) * PAGE_SIZE,
+  }
+
+  for line in status.split("\n"):
+    if line.startswith("voluntary_ctxt_switches:"):
+      info["voluntary_switches"] = int(line.split()[1])
+    elif line.startswith("nonvoluntary_ctxt_switches:"):
+      info["involuntary_switches"] = int(line.split()[1])
+
+  return info
+
+# Samples a process over and over and works out how fast it's using the CPU.
+class ProcessSampler:
+  def __init__(self, pid):
+    self.pid = pid
+    self.last = None
+    self.last_time = None
+
+  # Takes a new sample. Returns the same dict as read_process() with the CPU
+  # use since the last sample added as a percentage, or None if the process is
+  # gone.
+  def sample(self):
+    now = time.time()
+    info = read_process(self.pid)
+    if not info:
+      return None
+
+    if self.last:
+      elapsed = now - self.last_time
+      used = info["cpu_time"] - self.last["cpu_time"]
+      info["cpu_percent"] = used / elapsed * 100 if elapsed > 0 else 0
+    else:
+      # We need two samples for this.
+      info["cpu_percent"] = None
+
+    self.last = info
+    self.last_time = now
+    return info
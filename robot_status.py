@@ -1,13 +1,87 @@
 # Keeps track of the status of various parts of the robot.
 
+import ctypes
 import platform
+import time
+
+import parsers
 
 ## CONSTANTS ##
-# The size of the underlying shared memory array.
-ARRAY_SIZE = 1
 # The distance between the wheels of the robot. (mm)
 ROBOT_WIDTH = 240
 
+# The shared state of the robot. There is one of these in shared memory for all
+# the programs. It's protected by a seqlock: writers take turns with a lock and
+# bump the sequence number before and after they write, and readers retry if it
+# changed or was odd.
+class RobotState(ctypes.Structure):
+  _fields_ = [
+    ("sequence", ctypes.c_uint32),
+
+    # Gets bumped by every emergency stop, so that motions queued in any
+    # process before it don't run. (See motors.MotionExecutor.)
+    ("motion_epoch", ctypes.c_uint32),
+
+    # Whether or not the robot is driving.
+    ("driving", ctypes.c_int32),
+
+    # SLAM's best guess of our pose, with theta in radians, along with the
+    # diagonal of its covariance matrix.
+    ("pose_x", ctypes.c_double),
+    ("pose_y", ctypes.c_double),
+    ("pose_theta", ctypes.c_double),
+    ("pose_variance_x", ctypes.c_double),
+    ("pose_variance_y", ctypes.c_double),
+    ("pose_variance_theta", ctypes.c_double),
+    ("pose_time", ctypes.c_double),
+
+    # From GetMotors.
+    ("left_wheel_rpm", ctypes.c_double),
+    ("right_wheel_rpm", ctypes.c_double),
+    ("left_wheel_position", ctypes.c_double),
+    ("right_wheel_position", ctypes.c_double),
+    ("laser_mvolts", ctypes.c_double),
+    ("motors_time", ctypes.c_double),
+
+    # From GetAnalogSensors.
+    ("battery_voltage", ctypes.c_double),
+    ("charge_voltage", ctypes.c_double),
+    ("analog_time", ctypes.c_double),
+
+    # From GetDigitalSensors.
+    ("left_wheel_extended", ctypes.c_double),
+    ("right_wheel_extended", ctypes.c_double),
+    ("digital_time", ctypes.c_double),
+
+    # From the drop sensors.
+    ("left_drop", ctypes.c_double),
+    ("right_drop", ctypes.c_double),
+    ("drop_time", ctypes.c_double),
+  ]
+
+# Fields from each sampled command that get published in the shared state, as
+# a tuple of (mapping from command fields to state fields, timestamp field).
+TELEMETRY_FIELDS = {
+  "GetMotors": ({
+    "LeftWheel_RPM": "left_wheel_rpm",
+    "RightWheel_RPM": "right_wheel_rpm",
+    "LeftWheel_PositionInMM": "left_wheel_position",
+    "RightWheel_PositionInMM": "right_wheel_position",
+    "Laser_mVolts": "laser_mvolts",
+  }, "motors_time"),
+  "GetAnalogSensors": ({
+    "BatteryVoltageInmV": "battery_voltage",
+    "ChargeVoltInmV": "charge_voltage",
+  }, "analog_time"),
+  "GetDigitalSensors": ({
+    "SNSR_LEFT_WHEEL_EXTENDED": "left_wheel_extended",
+    "SNSR_RIGHT_WHEEL_EXTENDED": "right_wheel_extended",
+  }, "digital_time"),
+}
+
+# How many times read_state() tries to read the state without the lock.
+READ_ATTEMPTS = 3
+
 # Local reference to the instance of the program for this process.
 program = None
 
@@ -20,12 +94,109 @@ def is_testing():
   else:
     return True
 
+# Writes fields to the shared state.
+def write_state(**fields):
+  state = program.state
+
+  with program.state_lock:
+    # An odd sequence number tells readers that a write is in progress.
+    state.sequence += 1
+    for name, value in fields.items():
+      setattr(state, name, value)
+    state.sequence += 1
+
+# Gets a consistent snapshot of the shared state, as a RobotState. We try a few
+# times without the lock, and then wait for writers with it. Spinning until a
+# write finishes doesn't work when we have a realtime priority, since a writer
+# that got preempted in the middle won't get to run again while we spin.
+def read_state():
+  state = program.state
+
+  for attempt in range(READ_ATTEMPTS):
+    sequence = state.sequence
+    if sequence % 2:
+      # Someone is writing.
+      break
+
+    snapshot = RobotState.from_buffer_copy(state)
+    if state.sequence == sequence:
+      return snapshot
+
+  with program.state_lock:
+    return RobotState.from_buffer_copy(state)
+
+# Gets the current motion epoch.
+def motion_epoch():
+  return program.state.motion_epoch
+
+# Cancels every motion that is queued or running in any process.
+def cancel_motions():
+  state = program.state
+
+  with program.state_lock:
+    state.sequence += 1
+    state.motion_epoch += 1
+    state.sequence += 1
+
 # Whether or not the robot is driving.
 def get_driving():
-  return program.status_array[0]
+  return program.state.driving
 
 def is_driving():
-  program.status_array[0] = 1
+  write_state(driving = 1)
 
 def is_not_driving():
-  program.status_array[0] = 0
+  write_state(driving = 0)
+
+# Publishes the response to a sampled command. Only the control program should
+# call this.
+def write_telemetry(command, response, timestamp):
+  mapping, time_field = TELEMETRY_FIELDS[command]
+
+  fields = {time_field: timestamp}
+  for field, name in mapping.items():
+    fields[name] = response[field]
+  write_state(**fields)
+
+# Gets the published fields for a command as a dict indexed by the command's
+# field names, with the same types the parser gives them. Returns None if it
+# hasn't been sampled yet or the sample is at least max_age seconds old.
+def read_telemetry(command, max_age = None):
+  mapping, time_field = TELEMETRY_FIELDS[command]
+  snapshot = read_state()
+
+  timestamp = getattr(snapshot, time_field)
+  if not timestamp:
+    # Never written.
+    return None
+  if (max_age != None and time.time() - timestamp >= max_age):
+    return None
+
+  types = parsers.RECORD_TYPES[command]
+  ret = {}
+  for field, name in mapping.items():
+    ret[field] = types[field](getattr(snapshot, name))
+  return ret
+
+# Cuts a full parsed response to a sampled command down to the fields that
+# read_telemetry() gives, so that callers get the same thing either way. Raises
+# KeyError if the response is missing any of them.
+def select_telemetry(command, response):
+  mapping = TELEMETRY_FIELDS[command][0]
+  return dict((field, response[field]) for field in mapping.keys())
+
+# Publishes SLAM's pose. Theta is in radians.
+def write_pose(x, y, theta, variances):
+  write_state(pose_x = float(x), pose_y = float(y), pose_theta = float(theta),
+      pose_variance_x = float(variances[0]),
+      pose_variance_y = float(variances[1]),
+      pose_variance_theta = float(variances[2]), pose_time = time.time())
+
+# Gets SLAM's pose as (x, y, theta), with theta in radians. Returns None if SLAM
+# isn't running.
+def read_pose():
+  snapshot = read_state()
+  if not snapshot.pose_time:
+    return None
+
+  return (snapshot.pose_x, snapshot.pose_y, snapshot.pose_theta)
@@ -0,0 +1,107 @@
+# A ring buffer in shared memory that holds the last few LDS scans, so that one
+# scan from the neato can feed every program that wants it.
+
+from multiprocessing import Condition
+from multiprocessing.sharedctypes import RawArray
+
+import time
+
+import numpy as np
+
+import parsers
+
+# How many readings there are in a full scan.
+SCAN_SIZE = 360
+
+# Layout of a single slot in the ring.
+SLOT_DTYPE = np.dtype([
+  # Sequence number of the scan in the slot, or -1 while it's being written.
+  ("sequence", np.int64),
+  ("timestamp", np.float64),
+  ("rotation_speed", np.float64),
+  # How many of the readings are valid.
+  ("count", np.int32),
+  ("readings", parsers.LDS_SCAN_DTYPE, (SCAN_SIZE,)),
+])
+
+class ScanRing:
+  # Default number of scans that we keep around.
+  default_slots = 8
+
+  def __init__(self, slots = None):
+    if not slots:
+      slots = ScanRing.default_slots
+    self.slots = slots
+
+    # The first eight bytes hold the sequence number of the newest scan.
+    self.raw = RawArray("b", 8 + SLOT_DTYPE.itemsize * slots)
+    self.head = np.frombuffer(self.raw, dtype = np.int64, count = 1)
+    self.ring = np.frombuffer(self.raw, dtype = SLOT_DTYPE, count = slots,
+        offset = 8)
+
+    # Lets readers block until a new scan is written.
+    self.condition = Condition()
+
+  # Adds a new scan to the ring. There can only be one writer.
+  def write(self, readings, rotation_speed, timestamp):
+    sequence = int(self.head[0]) + 1
+    index = sequence % self.slots
+    count = min(len(readings), SCAN_SIZE)
+
+    self.ring["sequence"][index] = -1
+    self.ring["readings"][index][:count] = readings[:count]
+    self.ring["count"][index] = count
+    self.ring["timestamp"][index] = timestamp
+    self.ring["rotation_speed"][index] = rotation_speed
+    self.ring["sequence"][index] = sequence
+    self.head[0] = sequence
+
+    with self.condition:
+      self.condition.notify_all()
+
+  # Sequence number of the newest scan, or 0 if there aren't any yet.
+  def latest_sequence(self):
+    return int(self.head[0])
+
+  # Whether a scan is still in the ring.
+  def is_valid(self, sequence):
+    return (sequence > 0 and \
+        self.ring["sequence"][sequence % self.slots] == sequence)
+
+  # Gets a scan as a tuple of (timestamp, rotation speed, readings). If copy is
+  # False, the readings are a view into shared memory, and are only good for as
+  # long as is_valid() says so. Returns None if the scan is not in the ring.
+  def get(self, sequence, copy = True):
+    if not self.is_valid(sequence):
+      return None
+
+    index = sequence % self.slots
+    timestamp = float(self.ring["timestamp"][index])
+    rotation_speed = float(self.ring["rotation_speed"][index])
+    readings = self.ring["readings"][index][:self.ring["count"][index]]
+
+    if copy:
+      readings = readings.copy()
+    # Make sure it didn't get overwritten while we were reading it.
+    if not self.is_valid(sequence):
+      return None
+
+    return (timestamp, rotation_speed, readings)
+
+  # Waits until there is a scan newer than the one with sequence number after.
+  # Returns the sequence number of the newest scan, or None if we timed out.
+  def wait(self, after, timeout = None):
+    if timeout != None:
+      end = time.time() + timeout
+
+    with self.condition:
+      while self.latest_sequence() <= after:
+        if timeout == None:
+          self.condition.wait()
+        else:
+          remaining = end - time.time()
+          if remaining <= 0:
+            return None
+          self.condition.wait(remaining)
+
+    return self.latest_sequence()
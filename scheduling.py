@@ -0,0 +1,122 @@
+# Lets processes set their own scheduling priority and CPU affinity. Python 2
+# doesn't give us the sched_* calls, so we go right to libc.
+#
+# SCHED_FIFO processes run until they block, so one stuck in a loop would keep
+# everything else from running, including the SCHED_OTHER processes it might be
+# waiting on. The kernel's realtime throttling stops that from happening by
+# leaving a bit of every period for everyone else. It is on by default (950 ms
+# of every second), and we turn it back on if someone turned it off before we
+# give anything a realtime priority.
+
+import ctypes
+import ctypes.util
+import os
+
+SCHED_OTHER = 0
+SCHED_FIFO = 1
+
+# How much of every period realtime processes can use between them, or -1 for
+# all of it. (microseconds)
+RT_RUNTIME_PATH = "/proc/sys/kernel/sched_rt_runtime_us"
+RT_PERIOD_PATH = "/proc/sys/kernel/sched_rt_period_us"
+# What we set the realtime runtime to if there is no limit. This is the
+# kernel's default. (microseconds)
+DEFAULT_RT_RUNTIME = 950000
+
+# Size of a cpu_set_t in bits.
+CPU_SETSIZE = 1024
+# How many bits we can fit in one of the words of a cpu_set_t.
+__word_bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+class SchedParam(ctypes.Structure):
+  _fields_ = [("sched_priority", ctypes.c_int)]
+
+CpuSet = ctypes.c_ulong * (CPU_SETSIZE // __word_bits)
+
+__libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+
+# Raises an OSError for the last thing libc failed at.
+def __raise_errno():
+  error = ctypes.get_errno()
+  raise OSError(error, os.strerror(error))
+
+# Sets which CPUs the calling process can run on.
+def set_affinity(cpus):
+  cpu_set = CpuSet()
+  for cpu in cpus:
+    cpu_set[cpu // __word_bits] |= 1 << (cpu % __word_bits)
+
+  if __libc.sched_setaffinity(0, ctypes.sizeof(cpu_set),
+      ctypes.byref(cpu_set)) != 0:
+    __raise_errno()
+
+# Returns a list of the CPUs the calling process can run on.
+def get_affinity():
+  cpu_set = CpuSet()
+  if __libc.sched_getaffinity(0, ctypes.sizeof(cpu_set),
+      ctypes.byref(cpu_set)) != 0:
+    __raise_errno()
+
+  return [cpu for cpu in range(CPU_SETSIZE) \
+      if cpu_set[cpu // __word_bits] & (1 << (cpu % __word_bits))]
+
+# Puts the calling process in the SCHED_FIFO class with a certain priority.
+def set_realtime(priority):
+  param = SchedParam(priority)
+  if __libc.sched_setscheduler(0, SCHED_FIFO, ctypes.byref(param)) != 0:
+    __raise_errno()
+
+# Gets the realtime runtime and period, in microseconds.
+def get_rt_limit():
+  with open(RT_RUNTIME_PATH) as runtime_file:
+    runtime = int(runtime_file.read())
+  with open(RT_PERIOD_PATH) as period_file:
+    period = int(period_file.read())
+
+  return (runtime, period)
+
+# Makes sure that realtime processes can't take up the whole CPU. Returns a
+# (level, message) describing the limit.
+def limit_realtime():
+  try:
+    runtime, period = get_rt_limit()
+    if runtime < 0:
+      with open(RT_RUNTIME_PATH, "w") as runtime_file:
+        runtime_file.write(str(DEFAULT_RT_RUNTIME))
+      runtime = DEFAULT_RT_RUNTIME
+  except (IOError, ValueError) as e:
+    return ("WARNING", "Realtime throttling is off and could not be turned " \
+        "on: %s" % (e))
+
+  return ("INFO", "Realtime processes can use %d ms of every %d ms." % \
+      (runtime // 1000, period // 1000))
+
+# Sets the nice level of the calling process.
+def set_nice(nice):
+  os.nice(nice - os.nice(0))
+
+# Applies whatever scheduling settings a program asks for. Returns a list of
+# (level, message) describing what happened, for the caller to log. Failing to
+# apply something isn't fatal, since we usually need root for it.
+def apply(program):
+  messages = []
+
+  if program.realtime_priority != None:
+    messages.append(limit_realtime())
+
+  settings = [("nice level", program.nice, set_nice),
+      ("CPU affinity", program.cpu_affinity, set_affinity),
+      ("SCHED_FIFO priority", program.realtime_priority, set_realtime)]
+  for name, value, function in settings:
+    if value == None:
+      continue
+
+    try:
+      function(value)
+    except OSError as e:
+      messages.append(("WARNING", "Could not set %s to %s: %s" % \
+          (name, value, e.strerror)))
+    else:
+      messages.append(("INFO", "Set %s to %s." % (name, value)))
+
+  return messages
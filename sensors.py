@@ -4,24 +4,76 @@ import serial_api as control
 
 from programs import log
 from rate import Rate
-from swig import pru
 
+import numpy as np
 import robot_status
+import time
+
+if robot_status.is_testing():
+  # We're not on the BeagleBone, so use the stand-in.
+  from simulation import fake_pru as pru
+else:
+  from swig import pru
 
 # Initialize pru. (It's okay if this runs more than once.)
 if not pru.Init():
   raise RuntimeError("PRU initialization failed.")
 
 
+# A single sample from the drop sensors, as it is in the PRU module's ring
+# buffer.
+DROP_SAMPLE_DTYPE = np.dtype([("timestamp", "<f8"), ("sequence", "<u8"),
+    ("left", "<u2"), ("right", "<u2"), ("padding", "<u4")])
+
+# Removes any readings with errors from an array of LDS readings.
+def remove_errors(readings):
+  good = readings[readings["error"] == 0]
+  if len(good) < len(readings):
+    log.debug("Discarding %d LDS readings with errors." % \
+        (len(readings) - len(good)))
+
+  return good
+
+# Converts an array of LDS readings to a dict of (distance, intensity, error)
+# indexed by angle.
+def to_dict(readings):
+  return dict(zip(readings["angle"].tolist(),
+      zip(readings["distance"].tolist(), readings["intensity"].tolist(),
+      readings["error"].tolist())))
+
+
+# Converts an array of LDS readings to an array of 360 distances indexed by
+# angle, with NaN wherever there is no good reading.
+def to_distance_array(readings):
+  distances = np.empty(360)
+  distances.fill(np.nan)
+
+  good = readings[readings["error"] == 0]
+  distances[good["angle"]] = good["distance"]
+  return distances
+
+
 # Represents LDS sensor, and allows user to control it.
 class LDS:
+  # Whether this instance turned the LDS on and hasn't turned it off yet.
+  running = False
+
   def __init__(self):
     self.ready = False
+    # Sequence number of the last scan we got from the shared scan ring.
+    self.last_sequence = 0
 
     control.send_command("SetLDSRotation on")
+    self.running = True
 
   def __del__(self):
-    control.send_command("SetLDSRotation off")
+    self.stop()
+
+  # Turns the LDS off, if this instance hasn't already.
+  def stop(self):
+    if self.running:
+      control.send_command("SetLDSRotation off")
+      self.running = False
 
   # Wait for sensor to spin up.
   def __spin_up(self):
@@ -33,56 +85,96 @@ class LDS:
       while True:
         rate.rate(0.01)
 
-        scan = self.__get_scan()
-        if len(scan.keys()) > 1:
+        scan = self.__get_readings()
+        if len(scan) > 1:
           break
 
       self.ready = True
 
       log.info("LDS ready.")
 
-  # Helper to get and parse a complete scan packet.
-  def __get_scan(self, *args, **kwargs):
-    packet = control.get_output("GetLDSScan", *args, **kwargs)
-
-    # Get rid of help message.
-    packet.pop("AngleInDegrees", None)
+  # Helper to get a complete scan packet. The control program has already
+  # parsed it into an array of readings, with the rotation applied. We use the
+  # newest scan in the shared scan ring if it's fresh enough.
+  def __get_packet(self, stale_time = 10):
+    ring = robot_status.program.scan_ring
+    latest = ring.get(ring.latest_sequence())
+    if (latest and time.time() - latest[0] < stale_time):
+      return {"ROTATION_SPEED": latest[1], "scan": latest[2]}
 
-    # Add rotation speed.
-    ret = {}
-    ret["ROTATION_SPEED"] = float(packet["ROTATION_SPEED"])
-    packet.pop("ROTATION_SPEED", None)
+    return control.get_output("GetLDSScan", stale_time = stale_time)
 
-    # Discard any errors.
-    for key in packet.keys():
-      if int(packet[key][2]) == 0:
-        # Convert the angle so that 0 deg is to the right, not up.
-        angle = int(key)
-        real_angle = angle + 90
-        if real_angle > 359:
-          real_angle -= 359
+  # Helper to get the readings from a scan without any errors.
+  def __get_readings(self, **kwargs):
+    return remove_errors(self.__get_packet(**kwargs)["scan"])
 
-        ret[real_angle] = [int(x) for x in packet[key]]
-      else:
-        log.debug("Error %s in LDS reading for angle %s." % \
-            (packet[key][2], key))
+  # Returns a usable scan packet to the user, as a dict of (distance,
+  # intensity, error) indexed by angle.
+  def get_scan(self, **kwargs):
+    # Make sure sensor is ready.
+    self.__spin_up()
 
-    return ret
+    return to_dict(self.__get_readings(**kwargs))
 
-  # Returns a usable scan packet to the user.
-  def get_scan(self, *args, **kwargs):
+  # Returns a usable scan to the user as a structured array of readings, sorted
+  # by angle.
+  def get_scan_array(self, **kwargs):
     # Make sure sensor is ready.
     self.__spin_up()
 
-    packet = self.__get_scan(*args, **kwargs)
-    packet.pop("ROTATION_SPEED", None);
-    return packet
+    return self.__get_readings(**kwargs)
+
+  # Waits for a scan newer than the last one this instance got from the shared
+  # scan ring. Returns a tuple of (sequence, timestamp, readings), where the
+  # readings still include errors, or None if we timed out. If copy is False,
+  # the readings are a view into shared memory that is only good for as long
+  # as scan_valid() says so.
+  def wait_for_scan(self, timeout = None, copy = True):
+    self.__spin_up()
+    ring = robot_status.program.scan_ring
+
+    while True:
+      sequence = ring.wait(self.last_sequence, timeout)
+      if sequence == None:
+        return None
+
+      scan = ring.get(sequence, copy = copy)
+      if scan:
+        self.last_sequence = sequence
+        return (sequence, scan[0], scan[2])
+
+  # Returns the newest scan in the shared scan ring without waiting, in the
+  # same form as wait_for_scan(). By default, nothing is copied.
+  def latest_scan(self, copy = False):
+    ring = robot_status.program.scan_ring
+
+    sequence = ring.latest_sequence()
+    scan = ring.get(sequence, copy = copy)
+    if not scan:
+      return None
+
+    self.last_sequence = max(self.last_sequence, sequence)
+    return (sequence, scan[0], scan[2])
+
+  @staticmethod
+  # Returns whether a scan from the shared scan ring is still there.
+  def scan_valid(sequence):
+    return robot_status.program.scan_ring.is_valid(sequence)
+
+  # Waits for the next scan and returns it in the same form as get_scan().
+  def get_next_scan(self, timeout = 1):
+    scan = self.wait_for_scan(timeout)
+    if not scan:
+      log.warning("No new scans in the scan ring, asking the neato.")
+      return self.get_scan(stale_time = 0)
+
+    return to_dict(remove_errors(scan[2]))
 
   @staticmethod
   # Returns whether lds is active and ready to transmit data.
   def is_active():
-    info = control.get_output("GetMotors")
-    mvolts = int(info["Laser_mVolts"])
+    info = control.get_sampled("GetMotors")
+    mvolts = info["Laser_mVolts"]
     return bool(mvolts)
 
   # Returns the rotation speed of the LDS sensor.
@@ -90,13 +182,39 @@ class LDS:
     if not self.is_active():
       return 0
 
-    return self.__get_scan()["ROTATION_SPEED"]
+    return self.__get_packet()["ROTATION_SPEED"]
+
+
+# The LDS instance shared by everything in this process, and how many things
+# are using it.
+__shared_lds = None
+__shared_lds_users = 0
+
+# Returns an LDS instance that everything in this process can share, so that we
+# don't keep turning it on. Everything that calls this has to call
+# release_shared_lds() when it's done.
+def shared_lds():
+  global __shared_lds, __shared_lds_users
+  if not __shared_lds:
+    __shared_lds = LDS()
+  __shared_lds_users += 1
+
+  return __shared_lds
+
+# Lets go of the LDS from shared_lds(). It gets turned off once nobody is using
+# it anymore.
+def release_shared_lds():
+  global __shared_lds, __shared_lds_users
+  __shared_lds_users = max(__shared_lds_users - 1, 0)
+  if (not __shared_lds_users and __shared_lds):
+    __shared_lds.stop()
+    __shared_lds = None
 
 
 # A class for the analog sensors.
 class Analog:
   def __get_sensors(self, **kwargs):
-    return control.get_output("GetAnalogSensors", **kwargs)
+    return control.get_sampled("GetAnalogSensors", **kwargs)
 
   # Gets readings from the drop sensors.
   def drop(self, **kwargs):
@@ -112,26 +230,80 @@ class Analog:
   # Returns the battery voltage.
   def battery_voltage(self, **kwargs):
     info = self.__get_sensors(**kwargs)
-    voltage = int(info["BatteryVoltageInmV"])
+    voltage = info["BatteryVoltageInmV"]
 
     return voltage
 
   # Return the charging voltage.
   def charging(self, **kwargs):
     info = self.__get_sensors(**kwargs)
-    voltage = int(info["ChargeVoltInmV"])
+    voltage = info["ChargeVoltInmV"]
 
     return voltage
 
 
+# Reads the drop sensors at their full rate. The PRU module samples them in the
+# background into a ring buffer, and counts every time both of them see a drop.
+class DropSampler:
+  def __init__(self, period = 0.001, threshold = 25000, size = 512):
+    if not pru.StartDropSampling(int(period * 1000000), threshold):
+      log.error("Starting drop sensor sampling failed.")
+      raise RuntimeError("Starting drop sensor sampling failed.")
+
+    # Sequence number of the last sample we read.
+    self.cursor = pru.GetDropSampleHead()
+    # How many drop events we've seen.
+    self.events = pru.GetDropEventCount()
+    # How many samples got overwritten before we read them.
+    self.lost = 0
+
+    self.buffer = np.zeros(size, dtype = DROP_SAMPLE_DTYPE)
+
+  # Returns an array of all the samples since the last time this was called,
+  # oldest first.
+  def read(self):
+    chunks = []
+    while True:
+      count = pru.ReadDropSamples(self.cursor, self.buffer)
+      if not count:
+        break
+
+      samples = self.buffer[:count].copy()
+      self.lost += int(samples["sequence"][0]) - self.cursor - 1
+      self.cursor = int(samples["sequence"][-1])
+      chunks.append(samples)
+
+      if count < len(self.buffer):
+        break
+
+    if not chunks:
+      return np.zeros(0, dtype = DROP_SAMPLE_DTYPE)
+    return np.concatenate(chunks)
+
+  # Throws away everything that hasn't been read yet, including any drops, so
+  # that the next read only gets samples from now on.
+  def skip(self):
+    self.cursor = pru.GetDropSampleHead()
+    self.events = pru.GetDropEventCount()
+
+  # Waits for up to timeout seconds for the drop sensors to see a new drop.
+  # Returns whether they did.
+  def wait_for_drop(self, timeout):
+    count = pru.WaitForDropEvent(self.events, int(timeout * 1000))
+    dropped = count > self.events
+    self.events = count
+
+    return dropped
+
+
 class Digital:
   def __get_sensors(self, **kwargs):
-    return control.get_output("GetDigitalSensors", **kwargs)
+    return control.get_sampled("GetDigitalSensors", **kwargs)
 
   # Returns whether or not the wheels are extended.
   def wheels_extended(self, **kwargs):
     info = self.__get_sensors(**kwargs)
-    left = bool(int(info["SNSR_LEFT_WHEEL_EXTENDED"]))
-    right = bool(int(info["SNSR_RIGHT_WHEEL_EXTENDED"]))
+    left = bool(info["SNSR_LEFT_WHEEL_EXTENDED"])
+    right = bool(info["SNSR_RIGHT_WHEEL_EXTENDED"])
 
     return (left, right)
@@ -3,21 +3,47 @@
 
 from starter import Program
 
+import os
+import time
+
 import robot_status
 
+# Priority classes for commands, from most to least urgent.
+EMERGENCY = 0
+CONTROL = 1
+TELEMETRY = 2
+BULK = 3
+PRIORITY_NAMES = ("emergency", "control", "telemetry", "bulk")
+
+# Commands that return a lot of data and take a long time to run.
+BULK_COMMANDS = ("GetLDSScan",)
+
+# Commands for stopping the wheels and turning them off altogether.
+STOP_COMMAND = "SetMotor -1 -1 300"
+DISABLE_COMMAND = "SetMotor LWheelDisable RWheelDisable"
+
 # Represents a command for the control program.
 class Command:
-  def __init__(self, command, stale_time = 10):
-    program = robot_status.program
-
+  def __init__(self, command, stale_time = 10, priority = None,
+               source = None):
     # What program it came from.
-    self.Source = program.__class__.__name__
+    if source == None:
+      source = robot_status.program.__class__.__name__
+    self.Source = source
+    # The process it came from, so the control program can tell when it goes
+    # away.
+    self.Pid = os.getpid()
     # Whether we want output.
     self.Output = False
     # What the actual command is.
     self.Command = command
     # Represents a custom cache stale time to use.
     self.Stale = stale_time
+    # The priority class to run it in. If this is None, the control program
+    # picks one based on the command.
+    self.Priority = priority
+    # When it was sent, so the control program can see how long it waited.
+    self.Timestamp = time.time()
 
 # Get the output of a command.
 def get_output(*args, **kwargs):
@@ -30,6 +56,21 @@ def get_output(*args, **kwargs):
   # Write to the feed but read from the pipe.
   return program.control.recv()
 
+# Get the output of a command that the control program samples in the
+# background. The published sample is used if it is fresh enough, so we only go
+# through the control program when it isn't. Either way, only the fields in
+# robot_status.TELEMETRY_FIELDS are there. Returns None if the control program
+# couldn't get it.
+def get_sampled(command, stale_time = 10):
+  info = robot_status.read_telemetry(command, max_age = stale_time)
+  if info:
+    return info
+
+  response = get_output(command, stale_time = stale_time)
+  if response == None:
+    return None
+  return robot_status.select_telemetry(command, response)
+
 # Run a command without output.
 def send_command(*args, **kwargs):
   command = Command(*args, **kwargs)
@@ -37,6 +78,15 @@ def send_command(*args, **kwargs):
 
   Program.write_to_feed("control", command)
 
+# Sends a command on the emergency channel, which the control program writes to
+# the neato as soon as it gets it, even in the middle of a batch. Trigger says
+# what caused it, and detect_time is when that was detected on the monotonic
+# clock, so that the control program can log how long the stop took. This also
+# cancels every queued motion.
+def emergency_stop(command, trigger, detect_time):
+  robot_status.cancel_motions()
+  Program.write_to_feed("emergency", (command, trigger, detect_time))
+
 # Freezes the control program until the same program the originally called
 # freeze calls unfreeze. When the control program is frozen, the freezing
 # process can still send commands to it, but nothing else can.
@@ -0,0 +1,183 @@
+# Records all the serial traffic to and from the neato, and plays it back in
+# place of the real serial port.
+
+from collections import deque
+
+import heapq
+import os
+import struct
+import threading
+import time
+
+# Each record is a header of (timestamp, direction, length) followed by the
+# data.
+RECORD_HEADER = struct.Struct("<dBI")
+# Directions for records.
+WRITE = 0
+READ = 1
+
+# All responses end with this character.
+TERMINATOR = "\x1a"
+
+# Writes a compact, timestamped log of serial traffic to a file. Files are only
+# ever appended to.
+class Recorder:
+  def __init__(self, path):
+    self.file = open(path, "ab")
+
+  def __del__(self):
+    try:
+      self.file.close()
+    except AttributeError:
+      pass
+
+  # Records data going in one direction.
+  def record(self, direction, data):
+    self.file.write(RECORD_HEADER.pack(time.time(), direction, len(data)))
+    self.file.write(data)
+
+  # Records data that was written to the neato.
+  def write(self, data):
+    self.record(WRITE, data)
+
+  # Records data that was read from the neato.
+  def read(self, data):
+    self.record(READ, data)
+
+  # Flushes all records not yet written.
+  def flush(self):
+    self.file.flush()
+
+# Reads all the records from a file. Yields tuples of (timestamp, direction,
+# data).
+def read_records(path):
+  with open(path, "rb") as recording:
+    while True:
+      header = recording.read(RECORD_HEADER.size)
+      if len(header) < RECORD_HEADER.size:
+        # A partial record at the end means we got cut off while recording.
+        return
+
+      timestamp, direction, length = RECORD_HEADER.unpack(header)
+      data = recording.read(length)
+      if len(data) < length:
+        return
+
+      yield (timestamp, direction, data)
+
+# Splits a recording into the responses for each command. Returns a dict of
+# deques of (latency, response) indexed by command, where the latency is how
+# long after the command was written the end of the response was read.
+def load_responses(path):
+  responses = {}
+  # Times that each command was written and hasn't been answered yet.
+  written = {}
+  buffer = ""
+
+  for timestamp, direction, data in read_records(path):
+    if direction == WRITE:
+      for command in data.split("\n"):
+        if command:
+          written.setdefault(command, deque()).append(timestamp)
+      continue
+
+    buffer += data
+    while TERMINATOR in buffer:
+      response, buffer = buffer.split(TERMINATOR, 1)
+      response += TERMINATOR
+
+      # Responses start with the echoed command.
+      command = response.lstrip().split("\n")[0].rstrip("\r")
+      if written.get(command):
+        latency = timestamp - written[command].popleft()
+      else:
+        latency = 0
+
+      responses.setdefault(command, deque()).append((latency, response))
+
+  return responses
+
+# A stand-in for the serial port that plays back the responses from a
+# recording. Each command gets the next recorded response for that same
+# command, so it doesn't matter if the commands get batched differently than
+# they did when we recorded. Responses come back with their recorded latency
+# divided by speed, or right away if speed is zero.
+class ReplayPort:
+  def __init__(self, path, speed = 1):
+    self.speed = speed
+    self.responses = load_responses(path)
+    # The last response for each command, so we can keep answering once we run
+    # out.
+    self.last_responses = {}
+
+    # Responses are written to a pipe, so they can be selected on just like the
+    # real port.
+    self.read_fd, self.write_fd = os.pipe()
+
+    # Responses waiting to be sent, as a heap of (due time, order, response).
+    self.pending = []
+    self.order = 0
+    # Due time of the last response we queued. The neato answers in order, so
+    # nothing can be due before the response ahead of it.
+    self.last_due = 0
+    self.condition = threading.Condition()
+
+    thread = threading.Thread(target = self.__send_responses)
+    thread.daemon = True
+    thread.start()
+
+  def fileno(self):
+    return self.read_fd
+
+  def flush(self):
+    pass
+
+  # Gets the response to play back for a command.
+  def __next_response(self, command):
+    if self.responses.get(command):
+      response = self.responses[command].popleft()
+      self.last_responses[command] = response
+      return response
+
+    if command in self.last_responses:
+      return self.last_responses[command]
+
+    # We never saw this one, so all we can do is echo it back.
+    return (0, command + "\r\n" + TERMINATOR)
+
+  # Takes commands from the control program.
+  def write(self, data):
+    with self.condition:
+      for command in data.split("\n"):
+        if not command:
+          continue
+
+        latency, response = self.__next_response(command)
+        if self.speed:
+          due = time.time() + latency / self.speed
+        else:
+          due = time.time()
+        due = max(due, self.last_due)
+        self.last_due = due
+
+        heapq.heappush(self.pending, (due, self.order, response))
+        self.order += 1
+
+      self.condition.notify()
+
+  # Writes responses to the pipe as they come due.
+  def __send_responses(self):
+    while True:
+      with self.condition:
+        while True:
+          if self.pending:
+            wait = self.pending[0][0] - time.time()
+            if wait <= 0:
+              break
+            self.condition.wait(wait)
+          else:
+            self.condition.wait()
+
+        due, order, response = heapq.heappop(self.pending)
+
+      os.write(self.write_fd, response)
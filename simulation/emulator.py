@@ -0,0 +1,336 @@
+#!/usr/bin/python
+
+# Emulates the neato serial API on a pseudo-terminal, so that the rest of the
+# code can run without a robot. Point the control program at it by setting
+# NEATO_SERIAL_PORT to the path that gets printed (or to --link).
+
+from __future__ import division
+
+import argparse
+import math
+import os
+import select
+import time
+import tty
+
+# All responses end with this character.
+TERMINATOR = "\x1a"
+
+# Diameter of the drive wheels. (mm)
+WHEEL_DIAMETER = 77
+
+# A single drive wheel.
+class Wheel:
+  def __init__(self):
+    # Distance the wheel has traveled. (mm)
+    self.position = 0.0
+    # Where the wheel is trying to get to.
+    self.target = 0.0
+    # How fast it's going there. (mm/s)
+    self.speed = 0.0
+
+  # Moves the wheel forward in time.
+  def advance(self, dt):
+    remaining = self.target - self.position
+    step = self.speed * dt
+    if abs(remaining) <= step:
+      self.position = self.target
+      self.speed = 0.0
+    else:
+      self.position += math.copysign(step, remaining)
+
+  # Signed speed of the wheel. (mm/s)
+  def velocity(self):
+    if self.position == self.target:
+      return 0.0
+    return math.copysign(self.speed, self.target - self.position)
+
+  def rpm(self):
+    return self.velocity() * 60 / (WHEEL_DIAMETER * math.pi)
+
+# A model of the robot with nothing around it. The wheels move like the real
+# ones do, and the LDS sees a circular room.
+class SimpleRobot:
+  # Radius of the room the LDS sees. (mm)
+  room_radius = 2000
+  # How long the LDS takes to spin up. (seconds)
+  lds_spinup = 1
+  # Rotation speed of the LDS once it's going. (Hz)
+  lds_speed = 5.0
+
+  def __init__(self):
+    self.left = Wheel()
+    self.right = Wheel()
+    self.enabled = True
+    self.last_update = time.time()
+    # When the LDS was turned on, or None if it's off.
+    self.lds_started = None
+
+  # Moves the robot forward to the current time.
+  def update(self):
+    now = time.time()
+    dt = now - self.last_update
+    self.last_update = now
+
+    self.move(dt)
+
+  # Moves the wheels forward in time.
+  def move(self, dt):
+    self.left.advance(dt)
+    self.right.advance(dt)
+
+  # Starts both wheels moving. The one with the farther to go moves at speed,
+  # and the other one is slowed down so they both finish together.
+  def set_motor(self, left_dist, right_dist, speed):
+    self.update()
+    if not self.enabled:
+      return
+
+    longest = max(abs(left_dist), abs(right_dist))
+    for wheel, distance in ((self.left, left_dist), (self.right, right_dist)):
+      wheel.target = wheel.position + distance
+      if longest:
+        wheel.speed = speed * abs(distance) / longest
+      else:
+        wheel.speed = 0.0
+
+  def set_enabled(self, enabled):
+    self.update()
+    self.enabled = enabled
+    if not enabled:
+      # Disabling the wheels stops them where they are.
+      self.set_motor(0, 0, 0)
+
+  def set_lds(self, on):
+    if not on:
+      self.lds_started = None
+    elif self.lds_started == None:
+      self.lds_started = time.time()
+
+  # Whether the LDS is spinning at full speed.
+  def lds_ready(self):
+    return (self.lds_started != None and \
+        time.time() - self.lds_started >= SimpleRobot.lds_spinup)
+
+  # Returns a list of (distance, intensity, error) for each raw LDS angle.
+  def lds_ranges(self):
+    return [(SimpleRobot.room_radius, 1000, 0)] * 360
+
+  # Returns whether each wheel is extended, as (left, right).
+  def wheels_extended(self):
+    return (False, False)
+
+# Speaks the neato serial protocol on a pseudo-terminal.
+class Emulator:
+  def __init__(self, robot, latency = 0.0, byte_time = 0.0):
+    self.robot = robot
+    # Fixed time to take for every response. (seconds)
+    self.latency = latency
+    # Extra time to take per byte of response, to model the link. (seconds)
+    self.byte_time = byte_time
+    self.test_mode = False
+
+    self.master, self.slave = os.openpty()
+    tty.setraw(self.slave)
+    self.path = os.ttyname(self.slave)
+
+    # Commands we've served, indexed by the first word of the command.
+    self.served = {}
+    # Everything we've read but haven't answered yet.
+    self.buffer = ""
+
+    self.handlers = {
+      "testmode": self.__test_mode,
+      "getmotors": self.__get_motors,
+      "getanalogsensors": self.__get_analog_sensors,
+      "getdigitalsensors": self.__get_digital_sensors,
+      "getldsscan": self.__get_lds_scan,
+      "setldsrotation": self.__set_lds_rotation,
+      "setmotor": self.__set_motor,
+      "setsystemmode": self.__set_system_mode,
+    }
+
+  # Formats lines of values as a response body.
+  @staticmethod
+  def __lines(rows):
+    return "".join([",".join([str(x) for x in row]) + "\r\n" for row in rows])
+
+  def __test_mode(self, args):
+    self.test_mode = (args[:1] == ["on"])
+    return ""
+
+  def __get_motors(self, args):
+    self.robot.update()
+    left = self.robot.left
+    right = self.robot.right
+    if self.robot.lds_started != None:
+      laser = 1200
+    else:
+      laser = 0
+
+    return Emulator.__lines([
+      ("Parameter", "Value"),
+      ("Brush_RPM", 0),
+      ("Brush_mA", 0),
+      ("Vacuum_RPM", 0),
+      ("Vacuum_mA", 0),
+      ("LeftWheel_RPM", int(left.rpm())),
+      ("LeftWheel_Load%", 0),
+      ("LeftWheel_PositionInMM", int(left.position)),
+      ("LeftWheel_Speed", int(left.velocity())),
+      ("RightWheel_RPM", int(right.rpm())),
+      ("RightWheel_Load%", 0),
+      ("RightWheel_PositionInMM", int(right.position)),
+      ("RightWheel_Speed", int(right.velocity())),
+      ("Charger_mAH", 0),
+      ("SideBrush_mA", 0),
+      ("Laser_mVolts", laser),
+    ])
+
+  def __get_analog_sensors(self, args):
+    return Emulator.__lines([
+      ("SensorName", "Value"),
+      ("WallSensorInMM", 0),
+      ("BatteryVoltageInmV", 15800),
+      ("LeftDropInMM", 0),
+      ("RightDropInMM", 0),
+      ("ChargeVoltInmV", 0),
+      ("BatteryTemp0InC", 25),
+      ("CurrentInmA", 500),
+    ])
+
+  def __get_digital_sensors(self, args):
+    left, right = self.robot.wheels_extended()
+    return Emulator.__lines([
+      ("Digital Sensor Name", " Value"),
+      ("SNSR_DC_JACK_CONNECT", 0),
+      ("SNSR_DUSTBIN_IS_IN", 1),
+      ("SNSR_LEFT_WHEEL_EXTENDED", int(left)),
+      ("SNSR_RIGHT_WHEEL_EXTENDED", int(right)),
+      ("LSIDEBIT", 0),
+      ("LFRONTBIT", 0),
+      ("RSIDEBIT", 0),
+      ("RFRONTBIT", 0),
+    ])
+
+  def __get_lds_scan(self, args):
+    rows = [("AngleInDegrees", "DistInMM", "Intensity", "ErrorCodeHEX")]
+    if self.robot.lds_ready():
+      for angle, reading in enumerate(self.robot.lds_ranges()):
+        distance, intensity, error = reading
+        rows.append((angle, int(distance), int(intensity), "%X" % (error)))
+      speed = SimpleRobot.lds_speed
+    else:
+      # Everything is an error until it's spinning.
+      for angle in range(0, 360):
+        rows.append((angle, 0, 0, "8035"))
+      speed = 0.0
+
+    rows.append(("ROTATION_SPEED", "%.2f" % (speed)))
+    return Emulator.__lines(rows)
+
+  def __set_lds_rotation(self, args):
+    self.robot.set_lds(args[:1] == ["on"])
+    return ""
+
+  def __set_motor(self, args):
+    if not self.test_mode:
+      return "TestMode must be on to use this command.\r\n"
+
+    if "LWheelDisable" in args:
+      self.robot.set_enabled(False)
+    elif "LWheelEnable" in args:
+      self.robot.set_enabled(True)
+    else:
+      try:
+        left, right, speed = [int(float(x)) for x in args[:3]]
+      except ValueError:
+        return "Invalid arguments.\r\n"
+      self.robot.set_motor(left, right, speed)
+
+    return ""
+
+  def __set_system_mode(self, args):
+    return ""
+
+  # Builds the response to a single line.
+  def respond(self, line):
+    words = line.split()
+    name = words[0].lower()
+    self.served[name] = self.served.get(name, 0) + 1
+
+    handler = self.handlers.get(name)
+    if handler:
+      body = handler(words[1:])
+    else:
+      body = "Unknown Cmd: '%s'\r\n" % (line)
+
+    # The neato echoes the command back first.
+    return line + "\r\n" + body + TERMINATOR
+
+  # Logs how many commands we served since the last time.
+  def __report(self, interval):
+    total = sum(self.served.values())
+    counts = ", ".join(["%s: %d" % (name, count) for name, count in \
+        sorted(self.served.items())])
+    print "Served %.1f commands/s (%s)" % (total / interval, counts)
+    self.served = {}
+
+  # Answers commands forever. Prints statistics every stats_interval seconds
+  # if it is set.
+  def serve(self, stats_interval = None):
+    last_report = time.time()
+
+    while True:
+      readable, _, _ = select.select([self.master], [], [], stats_interval)
+
+      if (stats_interval and time.time() - last_report >= stats_interval):
+        self.__report(time.time() - last_report)
+        last_report = time.time()
+
+      if not readable:
+        continue
+
+      self.buffer += os.read(self.master, 4096)
+      while "\n" in self.buffer:
+        line, self.buffer = self.buffer.split("\n", 1)
+        line = line.strip()
+        if not line:
+          continue
+
+        response = self.respond(line)
+        delay = self.latency + len(response) * self.byte_time
+        if delay:
+          time.sleep(delay)
+        os.write(self.master, response)
+
+# Parses command line arguments that are common to things that run the
+# emulator.
+def make_parser(description):
+  parser = argparse.ArgumentParser(description = description)
+  parser.add_argument("--latency", type = float, default = 0.005,
+      help = "Time to take for every response. (seconds)")
+  parser.add_argument("--byte-time", type = float, default = 0.0,
+      help = "Extra time to take per byte of response. (seconds)")
+  parser.add_argument("--link",
+      help = "Also make a symlink to the pseudo-terminal here.")
+  parser.add_argument("--stats", type = float,
+      help = "Print how many commands were served this often. (seconds)")
+  return parser
+
+# Starts serving with an emulator for a robot model, using parsed arguments.
+def run(robot, args):
+  emulator = Emulator(robot, latency = args.latency,
+      byte_time = args.byte_time)
+
+  if args.link:
+    if os.path.lexists(args.link):
+      os.remove(args.link)
+    os.symlink(emulator.path, args.link)
+  print "Emulating neato on %s." % (args.link or emulator.path)
+
+  emulator.serve(stats_interval = args.stats)
+
+if __name__ == "__main__":
+  parser = make_parser("Emulate the neato serial API on a pseudo-terminal.")
+  run(SimpleRobot(), parser.parse_args())
@@ -0,0 +1,143 @@
+# A stand-in for the PRU module, for when we're not running on the BeagleBone.
+# It has the same interface as the SWIG module built from c_src/pru.c.
+
+import os
+import struct
+import sys
+import threading
+import time
+sys.path.append("..")
+
+from clock import monotonic
+
+# Reading to give for each drop sensor. Anything above 25000 means we're on the
+# ground.
+DROP_READING = int(os.environ.get("NEATO_FAKE_DROP", 30000))
+
+# How many samples the ring buffer holds.
+RING_SIZE = 4096
+# Layout of a sample, the same as DropSample in pru.c.
+SAMPLE = struct.Struct("<dQHHI")
+
+initialized = False
+# The readings we're giving, as (left, right). Tests can change this.
+readings = (DROP_READING, DROP_READING)
+
+# Everything below is protected by this, and it gets notified when the event
+# count changes.
+__condition = threading.Condition()
+__ring = [None] * RING_SIZE
+__head = 0
+__event_count = 0
+__threshold = 25000
+__below = False
+__sampling = False
+
+# Destroys PRU system.
+def Cleanup():
+  global initialized
+  StopDropSampling()
+  initialized = False
+
+# Initializes PRU system.
+def Init():
+  global initialized
+  initialized = True
+  return True
+
+# Get readings from each of the drop sensors.
+def GetLeftDrop():
+  if not initialized:
+    return -1
+  return readings[0]
+
+def GetRightDrop():
+  if not initialized:
+    return -1
+  return readings[1]
+
+# Takes a sample and puts it in the ring.
+def __take_sample(now):
+  global __head, __event_count, __below
+
+  left, right = readings
+  with __condition:
+    __head += 1
+    __ring[__head % RING_SIZE] = (now, __head, left, right, 0)
+
+    is_below = max(left, right) <= __threshold
+    if (is_below and not __below):
+      __event_count += 1
+      __condition.notify_all()
+    __below = is_below
+
+# Takes samples on a fixed schedule until we stop sampling.
+def __sample(period):
+  deadline = monotonic()
+  while __sampling:
+    __take_sample(deadline)
+
+    deadline += period
+    time.sleep(max(deadline - monotonic(), 0))
+
+# Starts sampling both drop sensors into the ring buffer.
+def StartDropSampling(period_us, drop_threshold):
+  global __threshold, __below, __sampling
+
+  if (not initialized or period_us <= 0):
+    return False
+
+  with __condition:
+    if __sampling:
+      return True
+    __threshold = drop_threshold
+    __below = False
+    __sampling = True
+
+  thread = threading.Thread(target = __sample, args = (period_us / 1000000.0,))
+  thread.daemon = True
+  thread.start()
+  return True
+
+# Stops the sampling thread. (It finishes on its own.)
+def StopDropSampling():
+  global __sampling
+  __sampling = False
+
+# Returns the sequence number of the newest sample, or 0 if there aren't any.
+def GetDropSampleHead():
+  with __condition:
+    return __head
+
+# Copies every sample newer than cursor that is still in the ring into buffer,
+# oldest first, until it runs out of room. Returns how many samples it copied.
+def ReadDropSamples(cursor, buffer):
+  view = memoryview(buffer)
+  room = len(view) * view.itemsize // SAMPLE.size
+
+  with __condition:
+    first = max(cursor + 1, __head - RING_SIZE + 1)
+    count = min(max(__head - first + 1, 0), room)
+    for i in range(count):
+      SAMPLE.pack_into(buffer, i * SAMPLE.size,
+          *__ring[(first + i) % RING_SIZE])
+
+  return count
+
+# Returns how many drop events there have been.
+def GetDropEventCount():
+  with __condition:
+    return __event_count
+
+# Waits until the event count is more than last_count, for up to timeout_ms
+# milliseconds. Returns the event count.
+def WaitForDropEvent(last_count, timeout_ms):
+  end = time.time() + timeout_ms / 1000.0
+  with __condition:
+    while __event_count <= last_count:
+      remaining = end - time.time()
+      if remaining <= 0:
+        break
+      __condition.wait(remaining)
+
+    return __event_count
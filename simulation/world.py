@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+# Simulates the robot driving around a floor plan, so that the serial emulator
+# can give back odometry and LDS scans that agree with each other. Floor plans
+# are JSON files with a list of polygons, each a list of [x, y] points in mm.
+
+from __future__ import division
+
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from simulation import emulator
+
+import robot_status
+
+# Maximum range of the LDS. (mm)
+LDS_RANGE = 5000
+# Error code the LDS gives when it doesn't get a reading.
+NO_READING = 0x8035
+# Radius of the robot, for detecting collisions. (mm)
+ROBOT_RADIUS = 165
+
+# A floor plan made out of line segments.
+class World:
+  def __init__(self, polygons):
+    starts = []
+    ends = []
+    for polygon in polygons:
+      for i in range(0, len(polygon)):
+        starts.append(polygon[i])
+        ends.append(polygon[(i + 1) % len(polygon)])
+
+    # Start and end points of each wall segment.
+    self.starts = np.array(starts, dtype = np.float64).reshape(-1, 2)
+    self.ends = np.array(ends, dtype = np.float64).reshape(-1, 2)
+
+  # Loads a floor plan from a file.
+  @staticmethod
+  def load(path):
+    with open(path) as floor_plan:
+      return World(json.load(floor_plan)["polygons"])
+
+  # Finds how far each ray from an origin goes before it hits a wall. Angles are
+  # in radians. Rays that don't hit anything come back as infinity.
+  def ray_cast(self, origin, angles):
+    directions = np.column_stack((np.cos(angles), np.sin(angles)))[:, None, :]
+    segments = (self.ends - self.starts)[None, :, :]
+    offsets = (self.starts - origin)[None, :, :]
+
+    # Solve origin + t * direction = start + u * segment for every pair.
+    denominator = directions[:, :, 0] * segments[:, :, 1] - \
+        directions[:, :, 1] * segments[:, :, 0]
+    t_numerator = offsets[:, :, 0] * segments[:, :, 1] - \
+        offsets[:, :, 1] * segments[:, :, 0]
+    u_numerator = offsets[:, :, 0] * directions[:, :, 1] - \
+        offsets[:, :, 1] * directions[:, :, 0]
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+      t = t_numerator / denominator
+      u = u_numerator / denominator
+
+    hits = (denominator != 0) & (t > 0) & (u >= 0) & (u <= 1)
+    t = np.where(hits, t, np.inf)
+    return t.min(axis = 1)
+
+  # Finds the distance from a point to the nearest wall.
+  def clearance(self, point):
+    if not len(self.starts):
+      return np.inf
+
+    segments = self.ends - self.starts
+    lengths = (segments ** 2).sum(axis = 1)
+    lengths[lengths == 0] = 1
+    u = ((point - self.starts) * segments).sum(axis = 1) / lengths
+    u = np.clip(u, 0, 1)
+    nearest = self.starts + segments * u[:, None]
+    return np.sqrt(((nearest - point) ** 2).sum(axis = 1)).min()
+
+# A robot with a differential drive that moves around in a world.
+class SimulatedRobot(emulator.SimpleRobot):
+  # Longest time to integrate in one step. (seconds)
+  max_step = 0.01
+
+  def __init__(self, world, x = 0, y = 0, theta = math.pi / 2, noise = 0.01,
+               dropout = 0.0, truth_path = None):
+    emulator.SimpleRobot.__init__(self)
+    self.world = world
+    # Ground truth pose, with theta in radians counter-clockwise from the x
+    # axis.
+    self.x = x
+    self.y = y
+    self.theta = theta
+    # Standard deviation of LDS range noise, as a fraction of the range.
+    self.noise = noise
+    # Probability that any single LDS reading fails.
+    self.dropout = dropout
+
+    # If we have a path, the ground truth pose gets logged there.
+    self.truth = None
+    if truth_path:
+      self.truth = open(truth_path, "a")
+
+  # Moves the wheels forward in time and updates our pose to match.
+  def move(self, dt):
+    while dt > 0:
+      step = min(dt, SimulatedRobot.max_step)
+      dt -= step
+
+      left = self.left.position
+      right = self.right.position
+      emulator.SimpleRobot.move(self, step)
+      self.__drive(self.left.position - left, self.right.position - right)
+
+    if self.truth:
+      self.truth.write("%f,%f,%f,%f\n" % (time.time(), self.x, self.y,
+          self.theta))
+      self.truth.flush()
+
+  # Updates the pose from how far each wheel went.
+  def __drive(self, left, right):
+    if (not left and not right):
+      return
+
+    dtheta = (right - left) / robot_status.ROBOT_WIDTH
+    forward = (left + right) / 2
+    # Assume we went in a straight line at the average heading.
+    heading = self.theta + dtheta / 2
+    x = self.x + forward * math.cos(heading)
+    y = self.y + forward * math.sin(heading)
+
+    if self.world.clearance(np.array((x, y))) < ROBOT_RADIUS:
+      # We ran into a wall, so the wheels stop.
+      self.set_motor(0, 0, 0)
+      return
+
+    self.x = x
+    self.y = y
+    self.theta = (self.theta + dtheta) % (2 * math.pi)
+
+  # Returns a list of (distance, intensity, error) for each raw LDS angle. Raw
+  # angle 0 points forward and they go counter-clockwise.
+  def lds_ranges(self):
+    self.update()
+
+    angles = self.theta + np.radians(np.arange(0, 360))
+    distances = self.world.ray_cast(np.array((self.x, self.y)), angles)
+
+    distances = distances + \
+        np.random.normal(0, 1, 360) * self.noise * np.minimum(distances,
+        LDS_RANGE)
+    failed = (distances > LDS_RANGE) | (distances <= 0) | \
+        (np.random.random(360) < self.dropout)
+
+    distances = np.where(failed, 0, distances).astype(int)
+    intensities = np.where(failed, 0,
+        2000000000 / np.maximum(distances, 1) ** 2).astype(int)
+    intensities = np.minimum(intensities, 10000)
+    errors = np.where(failed, NO_READING, 0)
+
+    return zip(distances.tolist(), intensities.tolist(), errors.tolist())
+
+if __name__ == "__main__":
+  parser = emulator.make_parser("Simulate the neato in a floor plan.")
+  parser.add_argument("floor_plan", help = "JSON file with the floor plan.")
+  parser.add_argument("--start", type = float, nargs = 3,
+      default = [0, 0, 90], metavar = ("X", "Y", "THETA"),
+      help = "Starting pose. (mm, mm, degrees)")
+  parser.add_argument("--noise", type = float, default = 0.01,
+      help = "LDS range noise as a fraction of the range.")
+  parser.add_argument("--dropout", type = float, default = 0.0,
+      help = "Probability of each LDS reading failing.")
+  parser.add_argument("--truth",
+      help = "Log the ground truth pose to this file.")
+  args = parser.parse_args()
+
+  world = World.load(args.floor_plan)
+  robot = SimulatedRobot(world, x = args.start[0], y = args.start[1],
+      theta = math.radians(args.start[2]), noise = args.noise,
+      dropout = args.dropout, truth_path = args.truth)
+
+  emulator.run(robot, args)
@@ -2,21 +2,65 @@
 
 # Contains code for starting programs and coordinating them.
 
-from multiprocessing import Pipe, Process, Queue, Array
-from Queue import Full
+from multiprocessing import Lock, Pipe, Process, Queue
+from multiprocessing.sharedctypes import RawArray, RawValue
+from Queue import Empty, Full
 
+import argparse
 import atexit
+import ctypes
+import errno
+import fcntl
+import importlib
 import os
+import select
+import signal
 import sys
 import time
 
+import clock
+import manifest
+import resources
 import robot_status
+import scan_ring
+import scheduling
+import topic_bus
 
-if not robot_status.is_testing:
+if not robot_status.is_testing():
   from swig import pru
 
 # A class representing a single program to be run on the robot as one process.
 class Program:
+  # What the supervisor does when this program exits. "always" restarts it no
+  # matter what, "on_failure" only restarts it if it failed, and "never" leaves
+  # it stopped.
+  restart_policy = "on_failure"
+  # How long to wait before the first restart. This doubles after every failure
+  # up to max_restart_delay, and resets once the program has been up for
+  # stable_time. (seconds)
+  restart_delay = 0.5
+  max_restart_delay = 60
+  stable_time = 30
+  # If the program fails max_failures times within failure_window seconds, we
+  # stop restarting it for circuit_reset_time seconds, then give it one more
+  # try.
+  max_failures = 5
+  failure_window = 60
+  circuit_reset_time = 300
+
+  # How the process for this program gets scheduled. The nice level is from -20
+  # to 19, the CPU affinity is a list of CPUs it can run on, and a realtime
+  # priority from 1 to 99 puts it in the SCHED_FIFO class. None leaves it as it
+  # is. Anything other than a higher nice level needs root. Realtime programs
+  # must not spin waiting on other programs. (See scheduling.py.)
+  nice = None
+  cpu_affinity = None
+  realtime_priority = None
+
+  # The least important log messages that this program logs, or None for the
+  # default. (See log.py.)
+  log_level = None
+
   def __init__(self):
     # A list of all the pipes requested.
     self.pipe_names = []
@@ -28,6 +72,14 @@ class Program:
     self.feeds = []
     # A dictionary of all the feeds we can write to.
     self.write_feeds = {}
+    # The topics that we declared, as a dictionary of (slots, slot size).
+    self.topic_names = {}
+    # The topics we want to subscribe to, as a dictionary of (policy, size).
+    self.subscription_names = {}
+    # A dictionary of all the topics on the bus.
+    self.topics = {}
+    # A dictionary of our subscriptions, indexed by topic.
+    self.subscriptions = {}
 
     # Run setup routine.
     self.setup()
@@ -56,13 +108,23 @@ class Program:
     self.__check_name_collisions(name)
     self.feed_names.append(name)
 
+  # Declares a topic on the bus. Topics that only get subscribed to are created
+  # with the default size.
+  def add_topic(self, name, slots = None, slot_size = None):
+    self.topic_names[name] = (slots, slot_size)
+
+  # Subscribes to a topic on the bus, with a policy from topic_bus and a buffer
+  # size in messages.
+  def subscribe(self, name, policy = topic_bus.DROP_OLDEST, size = None):
+    self.subscription_names[name] = (policy, size)
+
   # Adds a pipe object to this program. (Used by program dispatcher.)
   def add_pipe_object(self, pipe, name):
-    exec("self." + name + " = pipe")
+    setattr(self, name, pipe)
     self.pipes.append(pipe)
 
   def add_feed_object(self, queue, name):
-    exec("self." + name + " = queue")
+    setattr(self, name, queue)
     self.feeds.append(queue)
 
   # Allows a subclass to write to a named feed.
@@ -80,6 +142,28 @@ class Program:
     except Full:
       raise RuntimeError("Write would block.")
 
+  # Publishes a message on a topic.
+  @staticmethod
+  def publish(name, message):
+    program = robot_status.program
+
+    try:
+      topic = program.topics[name]
+    except KeyError:
+      raise ValueError("No topic with name '%s' exists." % (name))
+
+    topic.publish(message)
+
+  # Gets the next message from a topic we subscribed to. Raises Queue.Empty if
+  # there is nothing there.
+  def receive(self, name, block = True, timeout = None):
+    try:
+      subscription = self.subscriptions[name]
+    except KeyError:
+      raise ValueError("Not subscribed to topic '%s'." % (name))
+
+    return subscription.receive(block, timeout)
+
   # Perform any necessary setup for this program.
   def setup(self):
     # User can override this, but it's okay not to do anything.
@@ -87,43 +171,390 @@ class Program:
 
   # Run needed initialization code.
   def start(self):
+    # We don't want the supervisor's signal handling. Ctrl-C and anything else
+    # sent to the whole process group are for the supervisor, which takes us
+    # down in order once the motors are stopped. It tells us to exit with
+    # Supervisor.exit_signal.
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+      signal.signal(signal_number, signal.SIG_IGN)
+    signal.signal(Supervisor.exit_signal, signal.SIG_DFL)
+
     # Set program reference.
     robot_status.program = self
 
+    # Do any scheduling changes and let everyone know how it went.
+    for level, message in scheduling.apply(self):
+      if robot_status.is_testing():
+        print "%s: %s" % (level, message)
+      else:
+        try:
+          self.write_to_feed("logging", (time.time(), level,
+              self.__class__.__name__, message))
+        except ValueError:
+          # The log program isn't running.
+          pass
+
     self.run()
 
   # Do whatever it is this program should do.
   def run(self):
     raise NotImplementedError("User must override this in all programs.")
 
+# Keeps track of how a single program has been doing.
+class ProgramStats:
+  def __init__(self, program):
+    self.program = program
+    self.name = program.__class__.__name__
+    self.process = None
+    # When the current process started.
+    self.start_time = None
+    # How long all the processes for this program have been up. (seconds)
+    self.total_uptime = 0
+    self.restarts = 0
+    # Times of recent failures, for the circuit breaker.
+    self.failures = []
+    # How long to wait before the next restart.
+    self.delay = program.restart_delay
+    # When to restart it, or None if it isn't waiting to be restarted.
+    self.restart_time = None
+    # Whether we stopped restarting it because it kept failing.
+    self.circuit_open = False
+    # Keeps track of what the current process is using.
+    self.sampler = None
+
+  # How long the current process has been up. (seconds)
+  def uptime(self):
+    if not self.start_time:
+      return 0
+    return time.time() - self.start_time
+
+# Starts every program in its own process, and restarts them when they exit
+# according to their restart policy.
+class Supervisor:
+  # How long to wait for the control program to confirm that the motors are
+  # stopped when we shut down. (seconds)
+  stop_time = 2
+  # What we send a program to make it exit. Programs ignore SIGTERM and SIGINT,
+  # since those also get sent to the whole process group.
+  exit_signal = signal.SIGUSR1
+  # How long to give each process to exit before we kill it. (seconds)
+  exit_time = 2
+  # How often to check what each program is using and publish it on the
+  # "resources" topic. (seconds)
+  resource_interval = 5
+  # How often to log what each program is using. (seconds)
+  resource_log_interval = 60
+
+  def __init__(self, programs, feeds, topics = None):
+    self.feeds = feeds
+    self.topics = topics or {}
+    self.stats = [ProgramStats(program) for program in programs]
+    self.shutting_down = False
+
+    self.next_sample = time.time()
+    self.next_resource_log = time.time() + Supervisor.resource_log_interval
+
+    # Signals wake us up by writing to this pipe.
+    self.wakeup_read, self.wakeup_write = os.pipe()
+    for fd in (self.wakeup_read, self.wakeup_write):
+      flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+      fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+  # Logs a message. We're not a program, so this goes right to the logging
+  # feed instead of through the log module.
+  def log(self, level, message):
+    if (robot_status.is_testing() or "logging" not in self.feeds):
+      print "%s: %s" % (level, message)
+    else:
+      self.feeds["logging"].put((time.time(), level, "starter", message))
+
+  # Starts a new process for a program.
+  def __start(self, stats):
+    stats.process = Process(target = stats.program.start)
+    stats.process.start()
+    stats.start_time = time.time()
+    stats.restart_time = None
+    stats.sampler = resources.ProcessSampler(stats.process.pid)
+
+  # Decides what to do about a program whose process exited.
+  def __handle_exit(self, stats):
+    stats.process.join()
+    exitcode = stats.process.exitcode
+    uptime = stats.uptime()
+    stats.total_uptime += uptime
+    stats.process = None
+    stats.start_time = None
+
+    policy = stats.program.restart_policy
+    if (policy == "never" or (policy == "on_failure" and not exitcode)):
+      self.log("INFO", "%s exited with code %s after %.1f s." % \
+          (stats.name, exitcode, uptime))
+      return
+
+    now = time.time()
+    if uptime >= stats.program.stable_time:
+      # It was fine for a while, so start over.
+      stats.delay = stats.program.restart_delay
+      stats.circuit_open = False
+
+    stats.failures.append(now)
+    stats.failures = [failure for failure in stats.failures \
+        if now - failure < stats.program.failure_window]
+
+    if (stats.circuit_open or \
+        len(stats.failures) >= stats.program.max_failures):
+      stats.circuit_open = True
+      stats.restart_time = now + stats.program.circuit_reset_time
+      self.log("ERROR", "%s failed %d times in %d s, not restarting it for " \
+          "%d s." % (stats.name, len(stats.failures),
+          stats.program.failure_window, stats.program.circuit_reset_time))
+      return
+
+    stats.restart_time = now + stats.delay
+    self.log("WARNING", "%s exited with code %s after %.1f s, restarting " \
+        "in %.1f s." % (stats.name, exitcode, uptime, stats.delay))
+    stats.delay = min(stats.delay * 2, stats.program.max_restart_delay)
+
+  # Restarts anything that is due.
+  def __restart_due(self):
+    now = time.time()
+    for stats in self.stats:
+      if (stats.restart_time == None or stats.restart_time > now):
+        continue
+
+      stats.restarts += 1
+      self.log("INFO", "Restarting %s. (Restart %d, %.1f s total uptime.)" % \
+          (stats.name, stats.restarts, stats.total_uptime))
+      self.__start(stats)
+
+  # Checks what every running program is using, if it's time.
+  def __sample_resources(self):
+    now = time.time()
+    if now < self.next_sample:
+      return
+    self.next_sample = now + Supervisor.resource_interval
+
+    usage = {}
+    for stats in self.stats:
+      if not stats.process:
+        continue
+
+      info = stats.sampler.sample()
+      if info:
+        info["pid"] = stats.process.pid
+        info["uptime"] = stats.uptime()
+        info["restarts"] = stats.restarts
+        usage[stats.name] = info
+
+    if "resources" in self.topics:
+      try:
+        self.topics["resources"].publish({"time": now, "programs": usage})
+      except ValueError as e:
+        self.log("WARNING", "Could not publish resource usage: %s" % (e))
+
+    if now >= self.next_resource_log:
+      self.next_resource_log = now + Supervisor.resource_log_interval
+
+      for name, info in sorted(usage.items()):
+        cpu = info["cpu_percent"]
+        self.log("INFO", "%s: %s CPU, %.1f MB RSS, %d threads, %d/%d " \
+            "voluntary/involuntary context switches." % (name,
+            "%.1f%%" % (cpu) if cpu != None else "unknown",
+            info["rss"] / 1048576.0, info["threads"],
+            info.get("voluntary_switches", 0),
+            info.get("involuntary_switches", 0)))
+
+  # How long until we next have something to do.
+  def __next_timeout(self):
+    times = [stats.restart_time for stats in self.stats \
+        if stats.restart_time != None]
+    times.append(self.next_sample)
+    return max(min(times) - time.time(), 0)
+
+  # Waits until a signal comes in or the timeout expires.
+  def __wait(self, timeout):
+    try:
+      select.select([self.wakeup_read], [], [], timeout)
+    except select.error as e:
+      if e.args[0] != errno.EINTR:
+        raise
+
+    # Clear out the pipe.
+    try:
+      while os.read(self.wakeup_read, 4096):
+        pass
+    except OSError:
+      pass
+
+  def __on_shutdown_signal(self, signal_number, frame):
+    self.shutting_down = True
+
+  # Stops the motors, then all the programs.
+  # Has the control program stop and disable the motors, and waits for it to
+  # confirm that it did.
+  def __stop_motors(self):
+    import serial_api
+
+    confirmations = None
+    if "stop_latency" in self.topics:
+      confirmations = topic_bus.Subscription(self.topics["stop_latency"])
+
+    # The control program writes these right away.
+    commands = (serial_api.STOP_COMMAND, serial_api.DISABLE_COMMAND)
+    for command in commands:
+      self.feeds["emergency"].put((command, "shutdown", clock.monotonic()))
+
+    if not confirmations:
+      time.sleep(Supervisor.stop_time)
+      return
+
+    waiting = set(commands)
+    end = time.time() + Supervisor.stop_time
+    while waiting:
+      remaining = end - time.time()
+      if remaining <= 0:
+        self.log("WARNING", "Control program did not confirm stopping the " \
+            "motors within %.1f s." % (Supervisor.stop_time))
+        return
+
+      try:
+        stop = confirmations.receive(timeout = remaining)
+      except Empty:
+        continue
+      if stop["trigger"] == "shutdown":
+        waiting.discard(stop["command"])
+
+  def shutdown(self):
+    self.log("INFO", "Shutting down.")
+
+    if "emergency" in self.feeds:
+      self.__stop_motors()
+
+    # Take the control and logging programs down last, so that they can
+    # finish up for everyone else.
+    last = ("control", "log")
+    order = [stats for stats in self.stats if stats.name not in last] + \
+        [stats for stats in self.stats if stats.name in last]
+
+    for stats in order:
+      if (stats.process and stats.process.is_alive()):
+        os.kill(stats.process.pid, Supervisor.exit_signal)
+        stats.process.join(Supervisor.exit_time)
+
+        if stats.process.is_alive():
+          os.kill(stats.process.pid, signal.SIGKILL)
+          stats.process.join()
+
+      # This counts processes that died before we got to them too.
+      stats.total_uptime += stats.uptime()
+      stats.start_time = None
+
+      self.log("INFO", "%s: %d restarts, %.1f s total uptime." % \
+          (stats.name, stats.restarts, stats.total_uptime))
+
+  # Starts everything and keeps it running until we get told to stop or
+  # everything exits.
+  def run(self):
+    for stats in self.stats:
+      self.__start(stats)
+
+    # Signals only need to wake us up, we'll figure out what happened.
+    signal.set_wakeup_fd(self.wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda signal_number, frame: None)
+    signal.signal(signal.SIGTERM, self.__on_shutdown_signal)
+    signal.signal(signal.SIGINT, self.__on_shutdown_signal)
+
+    while not self.shutting_down:
+      for stats in self.stats:
+        if (stats.process and not stats.process.is_alive()):
+          self.__handle_exit(stats)
+
+      self.__restart_due()
+      self.__sample_resources()
+
+      running = [stats for stats in self.stats \
+          if (stats.process or stats.restart_time != None)]
+      if not running:
+        break
+
+      self.__wait(self.__next_timeout())
+
+    self.shutdown()
+
 if __name__ == "__main__":
   # Cleanup pru when everything is done.
-  if not robot_status.is_testing:
+  if not robot_status.is_testing():
     atexit.register(pru.Cleanup)
 
-  # Check in the programs directory and import everything.
+  parser = argparse.ArgumentParser(description = "Start the robot programs.")
+  parser.add_argument("-p", "--profile", default = manifest.DEFAULT_PROFILE,
+      choices = sorted(manifest.PROFILES.keys()),
+      help = "Which set of programs to run.")
+  parser.add_argument("programs", nargs = "*",
+      help = "Run these programs instead of a profile.")
+  parser.add_argument("-x", "--exclude", action = "append", default = [],
+      help = "Don't run this program.")
+  parser.add_argument("-l", "--list", action = "store_true",
+      help = "List the programs and profiles and exit.")
+  args = parser.parse_args()
+
+  if args.list:
+    print "Programs: " + ", ".join(manifest.available_programs())
+    for name in sorted(manifest.PROFILES.keys()):
+      print "%s: %s" % (name, ", ".join(manifest.get_profile(name)))
+    sys.exit(0)
+
+  if args.programs:
+    names = args.programs
+  else:
+    names = manifest.get_profile(args.profile)
+  names = [name for name in names if name not in args.exclude]
+
+  # Import and instantiate each program. Anything another program has a pipe
+  # to gets pulled in as well.
   sys.path.append("programs")
-  raw_names = os.listdir("programs")
+  start_time = time.time()
+  programs = []
+  startup_times = {}
+  while names:
+    name = names.pop(0)
+    if name in startup_times:
+      continue
+
+    import_start = time.time()
+    module = importlib.import_module(name)
+    setup_start = time.time()
+    instance = getattr(module, name)()
+    startup_times[name] = (setup_start - import_start,
+        time.time() - setup_start)
+    programs.append(instance)
 
-  raw_names.remove("__init__.py")
+    for _, end in instance.pipe_names:
+      if (end not in startup_times and end not in names):
+        if end in args.exclude:
+          raise ValueError("'%s' needs '%s', which was excluded." % \
+              (name, end))
+        names.append(end)
 
-  # Remove anything we can't import.
-  names = []
-  for name in raw_names:
-    if name[-3:] == ".py":
-      names.append(name[:-3])
+  # Create the shared robot state.
+  state = RawValue(robot_status.RobotState)
+  state_lock = Lock()
+  for program in programs:
+    program.state = state
+    program.state_lock = state_lock
 
-  # Instantiate each program.
-  programs = []
-  for program in names:
-    exec("from %s import %s" % (program, program))
-    exec("instance = " + program + "()")
-    programs.append(instance)
+  # Give every program a slot for heartbeats. (See watchdog.py.)
+  heartbeats = RawArray(ctypes.c_uint32, len(programs))
+  for slot, program in enumerate(programs):
+    program.heartbeats = heartbeats
+    program.heartbeat_slot = slot
 
-  # Create underlying shared memory array for robot status.
-  status_array = Array('i', robot_status.ARRAY_SIZE)
+  # Create the shared ring buffer for LDS scans.
+  scans = scan_ring.ScanRing()
   for program in programs:
-    program.status_array = status_array
+    program.scan_ring = scans
 
   # Make all the requested pipes.
   for program in programs:
@@ -143,9 +574,11 @@ if __name__ == "__main__":
       other.add_pipe_object(end, name[0])
 
   # Set up the necessary feed systems.
+  feeds = {}
   for program in programs:
     for name in program.feed_names:
       queue = Queue()
+      feeds[name] = queue
 
       for other_program in programs:
         if (other_program != program and name not in other_program.write_feeds):
@@ -153,31 +586,38 @@ if __name__ == "__main__":
 
       program.add_feed_object(queue, name)
 
-  # Set up and start all the processes for the programs.
-  processes = {}
+  # Set up the topic bus. The biggest size anyone asks for wins.
+  topic_sizes = {}
+  for program in programs:
+    for name in program.subscription_names.keys():
+      topic_sizes.setdefault(name, (None, None))
+    for name, size in program.topic_names.items():
+      old_slots, old_slot_size = topic_sizes.get(name, (None, None))
+      topic_sizes[name] = (max(old_slots, size[0]),
+          max(old_slot_size, size[1]))
+
+  # The supervisor publishes what every program is using on one of these, and
+  # named loops publish their timing on the other.
+  for name, size in (("resources", (4, 8192)), ("loop_timing", (64, 2048))):
+    old_slots, old_slot_size = topic_sizes.get(name, (None, None))
+    topic_sizes[name] = (max(old_slots, size[0]), max(old_slot_size, size[1]))
+
+  topics = {}
+  for name, size in topic_sizes.items():
+    topics[name] = topic_bus.Topic(name, slots = size[0], slot_size = size[1])
+
   for program in programs:
-    process = Process(target = program.start)
-    process.start()
-    processes[process] = program.start
-
-  # Clean things up as they finish, or restart them if they fail.
-  while True:
-    if not len(processes.keys()):
-      break
-
-    to_delete = []
-    for process in processes.keys():
-      if not process.is_alive():
-        process.join()
-
-        if process.exitcode:
-          # Process failed.
-          new_process = Process(target = processes[process])
-          new_process.start()
-          processes[new_process] = processes[process]
-
-        to_delete.append(process)
-    for process in to_delete:
-      processes.pop(process, None)
-
-    time.sleep(1)
+    program.topics = topics
+    for name, options in program.subscription_names.items():
+      policy, size = options
+      program.subscriptions[name] = topic_bus.Subscription(topics[name],
+          policy = policy, size = size)
+
+  # Start everything and keep it running.
+  supervisor = Supervisor(programs, feeds, topics)
+  for name, times in startup_times.items():
+    supervisor.log("DEBUG", "Loaded %s in %.3f s. (Import %.3f s, setup " \
+        "%.3f s.)" % (name, sum(times), times[0], times[1]))
+  supervisor.log("INFO", "Loaded %d programs in %.3f s." % \
+      (len(programs), time.time() - start_time))
+  supervisor.run()
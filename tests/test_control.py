@@ -0,0 +1,154 @@
+# Tests for how the control program talks to the neato, played back from a
+# recording.
+
+from collections import deque
+
+import os
+import shutil
+import tempfile
+import threading
+import types
+import unittest
+
+from programs import control
+
+import robot_status
+import serial_api
+import serial_record
+
+# Responses to the commands we use, without the echo.
+RESPONSES = {
+  "GetMotors": "Parameter,Value\r\nLeftWheel_RPM,0\r\nRightWheel_RPM,0\r\n" \
+      "LeftWheel_PositionInMM,10\r\nRightWheel_PositionInMM,12\r\n" \
+      "Laser_mVolts,0\r\n",
+  "GetVersion": "Component,Major,Minor\r\nSoftware,3,4\r\n",
+}
+
+# A program's end of a pipe, which just keeps what it gets sent.
+class FakePipe:
+  def __init__(self):
+    self.received = []
+
+  def send(self, data):
+    self.received.append(data)
+
+# A replay port that remembers what got written to it.
+class LoggingPort(serial_record.ReplayPort):
+  def __init__(self, *args, **kwargs):
+    serial_record.ReplayPort.__init__(self, *args, **kwargs)
+    self.written = []
+
+  def write(self, data):
+    self.written.extend([command for command in data.split("\n") if command])
+    serial_record.ReplayPort.write(self, data)
+
+class ControlTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "serial.rec")
+    self.recorder = serial_record.Recorder(self.path)
+    self.time = 100
+
+    # Shared state for the telemetry.
+    program = types.InstanceType(serial_api.Program)
+    program.state = robot_status.RobotState()
+    program.state_lock = threading.Lock()
+    robot_status.program = program
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  # Records a command and the response to it, latency seconds later.
+  def record(self, command, latency):
+    self.recorder.file.write(serial_record.RECORD_HEADER.pack(self.time,
+        serial_record.WRITE, len(command) + 1))
+    self.recorder.file.write(command + "\n")
+
+    response = command + "\r\n" + RESPONSES.get(command.split(" ")[0], "") + \
+        serial_record.TERMINATOR
+    self.recorder.file.write(serial_record.RECORD_HEADER.pack(
+        self.time + latency, serial_record.READ, len(response)))
+    self.recorder.file.write(response)
+    self.time += 10
+
+  # Makes a control program that talks to the recording, without running it.
+  def make_control(self):
+    self.recorder.flush()
+
+    program = types.InstanceType(control.control)
+    program.serial = LoggingPort(self.path)
+    program.recorder = None
+    program.reader = control.FrameReader(program.serial, timeout = 0.2)
+    program.cache = control.Cache()
+    program.freezing_program = None
+    program.queues = [deque() for name in serial_api.PRIORITY_NAMES]
+    program.deferred = [deque() for name in serial_api.PRIORITY_NAMES]
+    program.metrics = [control.QueueMetrics() \
+        for name in serial_api.PRIORITY_NAMES]
+    program.lds_users = {}
+    program.in_flight = deque()
+    program.write_lock = threading.Lock()
+    program.worst_stop = 0
+    program.control = deque()
+    program.tester = FakePipe()
+    return program
+
+  # Makes a command from the tester program, as if it came in on the feed.
+  def command(self, program, text, output):
+    data = serial_api.Command(text, source = "tester")
+    data.Output = output
+    if output:
+      program.cache.start_fetch(text, "tester")
+    return data
+
+  def run_batch(self, program, batch):
+    # __preempt() drains the feed, which we don't have.
+    program._control__drain = lambda block, timeout = None: None
+    program._control__run_batch(batch)
+
+  def test_pipelined_batch(self):
+    self.record("GetVersion", 0.05)
+    self.record("GetMotors", 0.01)
+    program = self.make_control()
+
+    self.run_batch(program, [self.command(program, "GetVersion", True),
+        self.command(program, "GetMotors", True)])
+
+    self.assertEqual(program.serial.written, ["GetVersion", "GetMotors"])
+    version, motors = program.tester.received
+    self.assertEqual(version["Software"], [3, 4])
+    self.assertEqual(motors["LeftWheel_PositionInMM"], 10)
+    self.assertEqual(robot_status.read_telemetry("GetMotors")[
+        "RightWheel_PositionInMM"], 12)
+
+  def test_timeout_only_resends_repeatable_commands(self):
+    # The move gets answered after we time out, and the query after that
+    # since the neato answers in order. Both of those need to get thrown away.
+    self.record("SetMotor 100 100 50", 0.3)
+    self.record("GetMotors", 0.01)
+    program = self.make_control()
+
+    self.run_batch(program, [self.command(program, "SetMotor 100 100 50",
+        False), self.command(program, "GetMotors", True)])
+
+    # The move must not run twice.
+    self.assertEqual(program.serial.written,
+        ["SetMotor 100 100 50", "GetMotors", "GetMotors"])
+    self.assertEqual(len(program.tester.received), 1)
+    self.assertEqual(program.tester.received[0]["LeftWheel_RPM"], 0)
+    self.assertFalse(program.in_flight)
+
+  def test_repeatable(self):
+    query = serial_api.Command("GetMotors", source = "tester")
+    query.Output = True
+    move = serial_api.Command("SetMotor 100 100 50", source = "tester")
+    stop = serial_api.Command(serial_api.STOP_COMMAND, source = "tester")
+
+    self.assertTrue(control.repeatable(query.Command, query))
+    self.assertFalse(control.repeatable(move.Command, move))
+    self.assertTrue(control.repeatable(stop.Command, stop))
+    self.assertTrue(control.repeatable(serial_api.DISABLE_COMMAND,
+        control.EmergencyStop(serial_api.DISABLE_COMMAND, "test", 0)))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,81 @@
+# Tests for reading the drop sensors through the ring buffer, using the
+# stand-in for the PRU module.
+
+import unittest
+
+from simulation import fake_pru
+
+import sensors
+
+# Takes a sample right away with the current readings, instead of waiting for
+# the sampling thread.
+take_sample = getattr(fake_pru, "__take_sample")
+
+class DropSamplerTest(unittest.TestCase):
+  def setUp(self):
+    # Take samples by hand, so that we know exactly what's in the ring.
+    self.start = fake_pru.StartDropSampling
+    fake_pru.StartDropSampling = lambda period_us, threshold: True
+
+    fake_pru.readings = (fake_pru.DROP_READING, fake_pru.DROP_READING)
+    take_sample(0)
+
+    self.sampler = sensors.DropSampler(size = 16)
+
+  def tearDown(self):
+    fake_pru.StartDropSampling = self.start
+    fake_pru.readings = (fake_pru.DROP_READING, fake_pru.DROP_READING)
+
+  def test_read_in_order(self):
+    first = fake_pru.GetDropSampleHead() + 1
+    for i in range(40):
+      fake_pru.readings = (30000 + i, 31000 + i)
+      take_sample(i)
+
+    # More than fits in the buffer at once.
+    samples = self.sampler.read()
+    self.assertEqual(samples["sequence"].tolist(), range(first, first + 40))
+    self.assertEqual(samples["left"].tolist(), range(30000, 30040))
+    self.assertEqual(samples["right"].tolist(), range(31000, 31040))
+    self.assertEqual(self.sampler.lost, 0)
+
+    self.assertEqual(len(self.sampler.read()), 0)
+
+  def test_counts_lost_samples(self):
+    for i in range(fake_pru.RING_SIZE + 10):
+      take_sample(i)
+
+    samples = self.sampler.read()
+    self.assertEqual(len(samples), fake_pru.RING_SIZE)
+    self.assertEqual(self.sampler.lost, 10)
+    self.assertEqual(int(samples["sequence"][-1]),
+        fake_pru.GetDropSampleHead())
+
+  def test_wait_for_drop(self):
+    self.assertFalse(self.sampler.wait_for_drop(0.01))
+
+    fake_pru.readings = (20000, fake_pru.DROP_READING)
+    take_sample(1)
+    self.assertFalse(self.sampler.wait_for_drop(0.01))
+
+    # Both sensors have to be off the ground, and it only counts once.
+    fake_pru.readings = (20000, 20000)
+    take_sample(2)
+    take_sample(3)
+    self.assertTrue(self.sampler.wait_for_drop(0.01))
+    self.assertFalse(self.sampler.wait_for_drop(0.01))
+
+  def test_skip(self):
+    fake_pru.readings = (20000, 20000)
+    take_sample(1)
+    self.sampler.skip()
+
+    self.assertEqual(len(self.sampler.read()), 0)
+    self.assertFalse(self.sampler.wait_for_drop(0.01))
+
+    fake_pru.readings = (fake_pru.DROP_READING, fake_pru.DROP_READING)
+    take_sample(2)
+    self.assertEqual(len(self.sampler.read()), 1)
+
+if __name__ == "__main__":
+  unittest.main()
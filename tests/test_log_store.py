@@ -0,0 +1,115 @@
+# Tests for the binary log store.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import log_store
+
+class LogStoreTest(unittest.TestCase):
+  def setUp(self):
+    self.location = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.location)
+
+  # Makes a store with small segments and blocks, so that a few messages are
+  # enough to fill several of each.
+  def make_store(self):
+    store = log_store.LogStore(self.location)
+    store.block_size = 200
+    store.segment_size = 1000
+    return store
+
+  # Stores a message a second from time 1000, from two programs and at two
+  # levels, a batch at a time.
+  def fill(self, store, count, batch_size = 5):
+    messages = []
+    for i in range(count):
+      level = "WARNING" if i % 10 == 0 else "INFO"
+      program = "control" if i % 2 else "safety"
+      messages.append((1000.0 + i, level, program, "Message %d." % (i)))
+
+    for i in range(0, count, batch_size):
+      store.append(messages[i:(i + batch_size)])
+    return messages
+
+  def test_round_trip(self):
+    store = self.make_store()
+    messages = self.fill(store, 3)
+
+    results, cursor = log_store.query(self.location)
+    self.assertEqual(results, messages)
+    self.assertEqual(cursor, None)
+
+  def test_segments_and_index(self):
+    store = self.make_store()
+    self.fill(store, 100)
+    store.close()
+
+    segments = log_store.list_segments(self.location)
+    self.assertGreater(len(segments), 1)
+    index = log_store.read_index(os.path.join(self.location, segments[0]))
+    self.assertGreater(len(index), 1)
+
+  def test_time_range(self):
+    store = self.make_store()
+    self.fill(store, 100)
+
+    results, cursor = log_store.query(self.location, start = 1042,
+        end = 1057)
+    self.assertEqual([result[0] for result in results],
+        [1000.0 + i for i in range(42, 58)])
+
+  def test_filters(self):
+    store = self.make_store()
+    messages = self.fill(store, 100)
+
+    results, cursor = log_store.query(self.location, level = "WARNING",
+        programs = ["safety"])
+    self.assertEqual(results, [message for message in messages \
+        if message[1] == "WARNING" and message[2] == "safety"])
+
+  def test_cursor_pages_through_segments(self):
+    store = self.make_store()
+    messages = self.fill(store, 100)
+
+    results = []
+    cursor = None
+    pages = 0
+    while True:
+      page, cursor = log_store.query(self.location, limit = 7,
+          cursor = cursor)
+      results.extend(page)
+      pages += 1
+      if not cursor:
+        break
+
+    self.assertEqual(results, messages)
+    self.assertEqual(pages, 15)
+
+  # Messages are stamped when they get logged, so they can show up after newer
+  # ones.
+  def test_late_messages(self):
+    store = self.make_store()
+    store.append([(1000.0, "INFO", "a", "First."),
+        (1002.0, "INFO", "b", "Third.")])
+    store.append([(1001.0, "INFO", "a", "Second.")])
+
+    results, cursor = log_store.query(self.location, start = 1000.5,
+        end = 1001.5)
+    self.assertEqual([result[3] for result in results], ["Second."])
+
+  def test_removes_old_segments(self):
+    store = self.make_store()
+    store.max_size = 3000
+    self.fill(store, 200)
+    store.close()
+
+    size = sum(os.path.getsize(os.path.join(self.location, name)) \
+        for name in os.listdir(self.location))
+    self.assertLessEqual(size, 3000)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,47 @@
+# Tests for parsing responses from the neato.
+
+import unittest
+
+import parsers
+
+# What the neato sends back for GetMotors, starting with the echoed command.
+MOTORS_RESPONSE = "GetMotors\r\nParameter,Value\r\nLeftWheel_RPM,-12\r\n" \
+    "LeftWheel_PositionInMM,1034\r\nRightWheel_RPM,12\r\n" \
+    "RightWheel_PositionInMM,-20\r\nNewThing,1.5\r\n"
+
+class ParsersTest(unittest.TestCase):
+  def test_sampled_commands_have_parsers(self):
+    for command in ("GetMotors", "GetAnalogSensors", "GetDigitalSensors",
+        "GetLDSScan"):
+      self.assertIn(command, parsers.parsers)
+
+  def test_typed_fields(self):
+    motors = parsers.parse("GetMotors", MOTORS_RESPONSE)
+
+    self.assertEqual(motors["LeftWheel_RPM"], -12)
+    self.assertEqual(motors["RightWheel_PositionInMM"], -20)
+    self.assertIsInstance(motors["LeftWheel_PositionInMM"], int)
+
+  # Typed parsers should give the same thing as the generic one for fields they
+  # don't know about.
+  def test_typed_parser_falls_back(self):
+    motors = parsers.parse("GetMotors", MOTORS_RESPONSE)
+    record = parsers.parse_record(MOTORS_RESPONSE)
+
+    self.assertEqual(motors, record)
+    self.assertEqual(motors["NewThing"], 1.5)
+    self.assertEqual(motors["Parameter"], "Value")
+
+    # Values that don't convert are left for to_number().
+    odd = parsers.parse("GetMotors", "LeftWheel_RPM,fast\r\n")
+    self.assertEqual(odd["LeftWheel_RPM"], "fast")
+
+  def test_commands_without_parser_use_parse_record(self):
+    response = "GetVersion\r\nComponent,Major,Minor\r\nSoftware,3,4\r\n"
+    self.assertEqual(parsers.parse("GetVersion", response),
+        parsers.parse_record(response))
+    self.assertEqual(parsers.parse("GetVersion", response)["Software"],
+        [3, 4])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,52 @@
+# Tests for the shared robot state.
+
+import threading
+import time
+import types
+import unittest
+
+import robot_status
+import starter
+
+class RobotStateTest(unittest.TestCase):
+  def setUp(self):
+    program = types.InstanceType(starter.Program)
+    program.state = robot_status.RobotState()
+    program.state_lock = threading.Lock()
+    robot_status.program = program
+
+  def test_read_after_write(self):
+    robot_status.write_state(left_drop = 100, right_drop = 200)
+    snapshot = robot_status.read_state()
+
+    self.assertEqual(snapshot.left_drop, 100)
+    self.assertEqual(snapshot.right_drop, 200)
+    self.assertEqual(snapshot.sequence % 2, 0)
+
+  # A reader that finds a write in progress has to wait for the writer instead
+  # of spinning.
+  def test_read_waits_for_writer(self):
+    state = robot_status.program.state
+    results = []
+
+    robot_status.program.state_lock.acquire()
+    state.sequence += 1
+    state.left_drop = 1
+
+    reader = threading.Thread(
+        target = lambda: results.append(robot_status.read_state()))
+    reader.start()
+    time.sleep(0.1)
+    # It should be stuck on the lock, not returning a torn snapshot.
+    self.assertEqual(results, [])
+
+    state.right_drop = 2
+    state.sequence += 1
+    robot_status.program.state_lock.release()
+
+    reader.join(1)
+    self.assertEqual(len(results), 1)
+    self.assertEqual((results[0].left_drop, results[0].right_drop), (1, 2))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,234 @@
+# Tests for when the safety program disables and enables the motors.
+
+import os
+import sys
+import threading
+import time
+import types
+import unittest
+# motors imports slam_controller, which the programs get from their directory.
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "programs"))
+
+import numpy as np
+
+from programs import safety
+
+import robot_status
+import sensors
+import serial_api
+import starter
+
+# Drop sensor readings for being on the ground and for being over a drop.
+GROUND = (30000, 30000)
+DROP = (20000, 20000)
+
+# Gets raised by the fake sampler to stop the program once it runs out of steps.
+class Finished(Exception):
+  pass
+
+# Stands in for sensors.DropSampler. Each step is what happens between two
+# calls to wait_for_drop(), as a dict that can have:
+# time: What the monotonic clock says.
+# samples: A list of (left, right) drop readings to give.
+# digital: New (left, right) wheel extension readings, published with the time
+# that digital_time gives, which is relative to when the step runs.
+class FakeSampler:
+  def __init__(self, test, steps):
+    self.test = test
+    self.steps = list(steps)
+    self.samples = []
+
+  def wait_for_drop(self, timeout):
+    if not self.steps:
+      raise Finished()
+    step = self.steps.pop(0)
+
+    self.test.now = step.get("time", self.test.now + 0.01)
+    self.samples = step.get("samples", [])
+    if "digital" in step:
+      left, right = step["digital"]
+      robot_status.write_state(left_wheel_extended = left,
+          right_wheel_extended = right,
+          digital_time = time.time() + step.get("digital_time", 0))
+
+    return False
+
+  def read(self):
+    samples = np.zeros(len(self.samples), dtype = sensors.DROP_SAMPLE_DTYPE)
+    for i, (left, right) in enumerate(self.samples):
+      samples[i] = (self.test.now, i, left, right, 0)
+    return samples
+
+  def skip(self):
+    self.test.events.append("skip")
+
+class FakeMotion:
+  def __init__(self, events):
+    self.events = events
+
+  def cancel(self):
+    self.events.append("cancel")
+
+  def drive(self, distance, speed):
+    self.events.append("drive")
+    return self
+
+  def turn(self, degrees):
+    self.events.append("turn")
+    return self
+
+  def wait(self):
+    pass
+
+class FakeWheels:
+  def __init__(self, events):
+    self.events = events
+    self.motion = FakeMotion(events)
+
+  def enable(self):
+    self.events.append("enable")
+
+  def disable(self):
+    self.events.append("disable")
+
+class SafetyTest(unittest.TestCase):
+  def setUp(self):
+    program = types.InstanceType(starter.Program)
+    program.state = robot_status.RobotState()
+    program.state_lock = threading.Lock()
+    robot_status.program = program
+    robot_status.is_driving()
+
+    self.events = []
+    self.now = 0
+    # What the wheels say when the program asks directly.
+    self.extended = (False, False)
+
+    self.patches = []
+    self.patch(serial_api, "emergency_stop", lambda command, trigger, when:
+        self.events.append(("emergency_stop", command, trigger)))
+    self.patch(serial_api, "freeze", lambda: self.events.append("freeze"))
+    self.patch(serial_api, "unfreeze", lambda: self.events.append("unfreeze"))
+    self.patch(safety, "monotonic", lambda: self.now)
+    self.patch(safety.motors, "Wheels", lambda: FakeWheels(self.events))
+    self.patch(safety.sensors.Digital, "wheels_extended",
+        lambda digital, **kwargs: self.extended)
+
+  def tearDown(self):
+    for module, name, value in reversed(self.patches):
+      setattr(module, name, value)
+
+  def patch(self, module, name, value):
+    self.patches.append((module, name, getattr(module, name)))
+    setattr(module, name, value)
+
+  # Runs the program through some steps, from time 100, and returns it.
+  def run_steps(self, steps):
+    self.now = 100.0
+    self.patch(safety.sensors, "DropSampler",
+        lambda **kwargs: FakeSampler(self, steps))
+
+    program = types.InstanceType(safety.safety)
+    self.assertRaises(Finished, program.run)
+    return program
+
+  def test_drop_runs_handler(self):
+    program = self.run_steps([
+      {"samples": [GROUND, DROP]},
+      # Still at the edge when the handler finishes.
+      {"samples": [GROUND]},
+    ])
+
+    self.assertEqual(self.events, [
+      ("emergency_stop", serial_api.STOP_COMMAND, "drop"),
+      "freeze", "cancel", "drive", "turn", "unfreeze", "skip",
+    ])
+    self.assertTrue(program.enabled)
+
+  def test_picked_up(self):
+    self.extended = (True, False)
+    program = self.run_steps([
+      {"samples": [DROP]},
+      # Back down, but we haven't heard from the wheels since.
+      {"samples": [GROUND]},
+      # A reading that was taken before we got disabled.
+      {"samples": [GROUND], "digital": (0, 0), "digital_time": -1},
+      {"samples": [GROUND]},
+    ])
+
+    self.assertEqual(self.events, [
+      ("emergency_stop", serial_api.STOP_COMMAND, "drop"),
+      ("emergency_stop", serial_api.DISABLE_COMMAND, "picked up"),
+      "freeze", "disable",
+    ])
+    self.assertFalse(program.enabled)
+    self.assertEqual(program.disabled_by, "picked up")
+
+    # Now the wheels say we're down.
+    self.events = []
+    program = self.run_steps([
+      {"samples": [DROP]},
+      {"samples": [GROUND], "digital": (0, 0), "digital_time": 1},
+    ])
+    self.assertIn("enable", self.events)
+
+  def test_wheels_extended_waits_for_fresh_reading(self):
+    program = self.run_steps([
+      {"samples": [GROUND], "digital": (1, 0)},
+      # The wheels are still out.
+      {"samples": [GROUND], "digital": (1, 0), "digital_time": 1},
+      # Retracted, but over a drop.
+      {"samples": [DROP], "digital": (0, 0), "digital_time": 2},
+    ])
+
+    self.assertEqual(self.events, [
+      ("emergency_stop", serial_api.DISABLE_COMMAND, "wheels extended"),
+      "freeze", "disable",
+    ])
+    self.assertEqual(program.disabled_by, "wheels extended")
+
+    # Back on the ground with the wheels in.
+    self.events = []
+    self.run_steps([
+      {"samples": [GROUND], "digital": (1, 0)},
+      {"samples": [GROUND], "digital": (0, 0), "digital_time": 1},
+    ])
+    self.assertEqual(self.events[-2:], ["enable", "unfreeze"])
+
+  def test_stale_samples(self):
+    program = self.run_steps([
+      {"samples": [GROUND]},
+      {"time": 100.6},
+      {"time": 100.7},
+    ])
+
+    self.assertEqual(self.events, [
+      ("emergency_stop", serial_api.DISABLE_COMMAND, "stale drop sensors"),
+      "freeze", "disable",
+    ])
+    self.assertEqual(program.disabled_by, "stale drop sensors")
+
+    self.events = []
+    program = self.run_steps([
+      {"samples": [GROUND]},
+      {"time": 100.6},
+      {"samples": [GROUND]},
+    ])
+    self.assertEqual(self.events[-2:], ["enable", "unfreeze"])
+    self.assertTrue(program.enabled)
+    self.assertEqual(program.disabled_by, None)
+
+  # Getting samples again doesn't mean that we're not being held up anymore.
+  def test_samples_dont_enable_after_pick_up(self):
+    self.extended = (True, True)
+    program = self.run_steps([
+      {"samples": [DROP]},
+      {"time": 100.6},
+      {"samples": [GROUND]},
+    ])
+
+    self.assertNotIn("enable", self.events)
+    self.assertEqual(program.disabled_by, "picked up")
+
+if __name__ == "__main__":
+  unittest.main()
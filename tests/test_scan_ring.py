@@ -0,0 +1,75 @@
+# Tests for the shared ring buffer of LDS scans.
+
+import threading
+import time
+import unittest
+
+import numpy as np
+
+import parsers
+import scan_ring
+
+# Makes a scan with count readings, all at distance.
+def make_scan(distance, count = scan_ring.SCAN_SIZE):
+  readings = np.zeros(count, dtype = parsers.LDS_SCAN_DTYPE)
+  readings["angle"] = np.arange(count)
+  readings["distance"] = distance
+  return readings
+
+class ScanRingTest(unittest.TestCase):
+  def setUp(self):
+    self.ring = scan_ring.ScanRing(slots = 4)
+
+  def test_empty(self):
+    self.assertEqual(self.ring.latest_sequence(), 0)
+    self.assertEqual(self.ring.get(0), None)
+    self.assertEqual(self.ring.wait(0, timeout = 0.01), None)
+
+  def test_write_and_get(self):
+    self.ring.write(make_scan(1000, count = 300), 5.0, 42.0)
+
+    sequence = self.ring.latest_sequence()
+    self.assertEqual(sequence, 1)
+    timestamp, rotation_speed, readings = self.ring.get(sequence)
+    self.assertEqual(timestamp, 42.0)
+    self.assertEqual(rotation_speed, 5.0)
+    self.assertEqual(len(readings), 300)
+    self.assertTrue((readings["distance"] == 1000).all())
+
+  def test_old_scans_get_overwritten(self):
+    for i in range(6):
+      self.ring.write(make_scan(i), 5.0, i)
+
+    self.assertEqual(self.ring.latest_sequence(), 6)
+    self.assertFalse(self.ring.is_valid(2))
+    self.assertEqual(self.ring.get(2), None)
+    for sequence in range(3, 7):
+      readings = self.ring.get(sequence)[2]
+      self.assertTrue((readings["distance"] == sequence - 1).all())
+
+  # A view is only good until the writer gets back around to its slot.
+  def test_view_goes_stale(self):
+    self.ring.write(make_scan(1), 5.0, 0)
+    readings = self.ring.get(1, copy = False)[2]
+    self.assertTrue(self.ring.is_valid(1))
+
+    for i in range(4):
+      self.ring.write(make_scan(2), 5.0, 0)
+    self.assertFalse(self.ring.is_valid(1))
+    self.assertTrue((readings["distance"] == 2).all())
+
+  def test_wait(self):
+    writer = threading.Timer(0.05,
+        lambda: self.ring.write(make_scan(1), 5.0, 0))
+    writer.start()
+
+    start = time.time()
+    self.assertEqual(self.ring.wait(0, timeout = 5), 1)
+    self.assertLess(time.time() - start, 5)
+    writer.join()
+
+    # It doesn't wait if there's already something newer.
+    self.assertEqual(self.ring.wait(0, timeout = 0), 1)
+
+if __name__ == "__main__":
+  unittest.main()
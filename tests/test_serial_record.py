@@ -0,0 +1,54 @@
+# Tests for recording and playing back serial traffic.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import serial_record
+
+class ReplayPortTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "serial.rec")
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  # Records a command being written, and then its response being read latency
+  # seconds later.
+  def record(self, recorder, command, latency, start):
+    recorder.file.write(serial_record.RECORD_HEADER.pack(start,
+        serial_record.WRITE, len(command) + 1))
+    recorder.file.write(command + "\n")
+
+    response = command + "\r\nok\r\n" + serial_record.TERMINATOR
+    recorder.file.write(serial_record.RECORD_HEADER.pack(start + latency,
+        serial_record.READ, len(response)))
+    recorder.file.write(response)
+
+  # Reads responses from the port until we have count of them.
+  def read_responses(self, port, count):
+    data = ""
+    end = time.time() + 5
+    while (data.count(serial_record.TERMINATOR) < count and time.time() < end):
+      data += os.read(port.fileno(), 4096)
+
+    return [response.lstrip().split("\r\n")[0] \
+        for response in data.split(serial_record.TERMINATOR) if response]
+
+  def test_batch_with_decreasing_latencies_stays_in_order(self):
+    recorder = serial_record.Recorder(self.path)
+    commands = ["GetMotors", "GetAnalogSensors", "GetDigitalSensors"]
+    for i, (command, latency) in enumerate(zip(commands, [0.3, 0.2, 0.01])):
+      self.record(recorder, command, latency, 100 + i)
+    recorder.flush()
+
+    port = serial_record.ReplayPort(self.path)
+    port.write("\n".join(commands) + "\n")
+
+    self.assertEqual(self.read_responses(port, len(commands)), commands)
+
+if __name__ == "__main__":
+  unittest.main()
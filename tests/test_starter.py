@@ -0,0 +1,80 @@
+# Tests for the supervisor that runs all the programs.
+
+import os
+import signal
+import sys
+import threading
+import time
+import unittest
+
+import starter
+
+class crashing(starter.Program):
+  restart_delay = 0.05
+  max_failures = 3
+  failure_window = 10
+
+  def run(self):
+    sys.exit(1)
+
+class idle(starter.Program):
+  def run(self):
+    time.sleep(100)
+
+class SupervisorTest(unittest.TestCase):
+  # Runs a supervisor until it gets told to shut down after run_time seconds.
+  def run_supervisor(self, supervisor, run_time):
+    timer = threading.Timer(run_time,
+        lambda: os.kill(os.getpid(), signal.SIGTERM))
+    timer.start()
+    try:
+      supervisor.run()
+    finally:
+      timer.cancel()
+      signal.signal(signal.SIGTERM, signal.SIG_DFL)
+      signal.signal(signal.SIGINT, signal.default_int_handler)
+      signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+      signal.set_wakeup_fd(-1)
+
+  def test_circuit_breaker(self):
+    supervisor = starter.Supervisor([crashing()], {})
+    self.run_supervisor(supervisor, 1)
+
+    stats = supervisor.stats[0]
+    self.assertTrue(stats.circuit_open)
+    # The third failure opens the circuit.
+    self.assertEqual(stats.restarts, 2)
+    self.assertGreater(stats.restart_time, time.time() + 60)
+
+  def test_programs_ignore_group_signals(self):
+    supervisor = starter.Supervisor([idle()], {})
+    stats = supervisor.stats[0]
+    supervisor._Supervisor__start(stats)
+    time.sleep(0.2)
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+      os.kill(stats.process.pid, signal_number)
+    time.sleep(0.2)
+    self.assertTrue(stats.process.is_alive())
+
+    start = time.time()
+    supervisor.shutdown()
+    self.assertFalse(stats.process.is_alive())
+    # It went down when we asked it to, not when we got tired of waiting.
+    self.assertLess(time.time() - start, starter.Supervisor.exit_time)
+
+  def test_uptime_counts_dead_processes(self):
+    supervisor = starter.Supervisor([idle()], {})
+    stats = supervisor.stats[0]
+    supervisor._Supervisor__start(stats)
+    time.sleep(0.3)
+
+    # It dies before the supervisor notices.
+    os.kill(stats.process.pid, signal.SIGKILL)
+    stats.process.join()
+    supervisor.shutdown()
+
+    self.assertGreaterEqual(stats.total_uptime, 0.3)
+
+if __name__ == "__main__":
+  unittest.main()
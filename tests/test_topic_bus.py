@@ -0,0 +1,70 @@
+# Tests for the publish/subscribe topic bus.
+
+from multiprocessing import Process
+from Queue import Empty
+
+import unittest
+
+import topic_bus
+
+class TopicBusTest(unittest.TestCase):
+  def test_subscriber_gets_messages_in_order(self):
+    topic = topic_bus.Topic("test", slots = 8, slot_size = 256)
+    subscription = topic_bus.Subscription(topic)
+
+    for i in range(3):
+      topic.publish({"count": i})
+
+    self.assertEqual([subscription.receive(False)["count"] for i in range(3)],
+        [0, 1, 2])
+    self.assertRaises(Empty, subscription.receive, False)
+
+  def test_only_gets_messages_after_subscribing(self):
+    topic = topic_bus.Topic("test", slots = 8, slot_size = 256)
+    topic.publish("old")
+    subscription = topic_bus.Subscription(topic)
+    topic.publish("new")
+
+    self.assertEqual(subscription.receive_all(), ["new"])
+
+  def test_drop_oldest(self):
+    topic = topic_bus.Topic("test", slots = 8, slot_size = 256)
+    subscription = topic_bus.Subscription(topic, size = 4)
+
+    for i in range(10):
+      topic.publish(i)
+
+    self.assertEqual(subscription.receive_all(), [6, 7, 8, 9])
+    self.assertEqual(subscription.dropped, 6)
+
+  def test_latest_only(self):
+    topic = topic_bus.Topic("test", slots = 8, slot_size = 256)
+    subscription = topic_bus.Subscription(topic,
+        policy = topic_bus.LATEST_ONLY)
+
+    for i in range(5):
+      topic.publish(i)
+
+    self.assertEqual(subscription.receive_all(), [4])
+
+  def test_message_too_big(self):
+    topic = topic_bus.Topic("test", slots = 2, slot_size = 64)
+    self.assertRaises(ValueError, topic.publish, "x" * 100)
+
+  def test_receive_times_out(self):
+    topic = topic_bus.Topic("test", slots = 2, slot_size = 64)
+    subscription = topic_bus.Subscription(topic)
+    self.assertRaises(Empty, subscription.receive, True, 0.05)
+
+  def test_across_processes(self):
+    topic = topic_bus.Topic("test", slots = 8, slot_size = 256)
+    subscription = topic_bus.Subscription(topic)
+
+    publisher = Process(target = topic.publish, args = ("hello",))
+    publisher.start()
+    publisher.join()
+
+    self.assertEqual(subscription.receive(timeout = 1), "hello")
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,162 @@
+# A publish/subscribe bus for sending messages from one program to many. Each
+# topic is a ring of fixed-size slots in shared memory. Messages get pickled
+# once when they're published, and every subscriber reads them straight out of
+# shared memory with its own cursor.
+
+from multiprocessing import Condition
+from multiprocessing.sharedctypes import RawArray
+from Queue import Empty
+
+import cPickle
+import time
+
+import numpy as np
+
+# Subscription policies. With DROP_OLDEST, a subscriber gets every message
+# unless it falls more than its buffer size behind, in which case the oldest
+# ones get dropped. With LATEST_ONLY, it only ever gets the newest message.
+DROP_OLDEST = "drop_oldest"
+LATEST_ONLY = "latest_only"
+
+# Bookkeeping for each slot in a topic.
+SLOT_DTYPE = np.dtype([
+  # Sequence number of the message in the slot, or -1 while it's being written.
+  ("sequence", np.int64),
+  ("length", np.int32),
+])
+
+# A single topic, shared between all processes.
+class Topic:
+  # Defaults for topics that don't ask for anything else.
+  default_slots = 16
+  default_slot_size = 4096
+
+  def __init__(self, name, slots = None, slot_size = None):
+    self.name = name
+    self.slots = slots or Topic.default_slots
+    # Largest pickled message that fits. (bytes)
+    self.slot_size = slot_size or Topic.default_slot_size
+
+    # Eight bytes for the newest sequence number, then the bookkeeping for
+    # every slot, then the messages.
+    meta_size = SLOT_DTYPE.itemsize * self.slots
+    self.raw = RawArray("b", 8 + meta_size + self.slot_size * self.slots)
+    self.head = np.frombuffer(self.raw, dtype = np.int64, count = 1)
+    self.meta = np.frombuffer(self.raw, dtype = SLOT_DTYPE, count = self.slots,
+        offset = 8)
+    self.data = np.frombuffer(self.raw, dtype = np.uint8,
+        offset = 8 + meta_size)
+
+    # Publishers take turns with this, and subscribers wait on it.
+    self.condition = Condition()
+
+  # Sequence number of the newest message, or 0 if there aren't any.
+  def latest_sequence(self):
+    return int(self.head[0])
+
+  # Publishes a message. Raises ValueError if it is too big.
+  def publish(self, message):
+    data = cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+    if len(data) > self.slot_size:
+      raise ValueError("Message of %d bytes is too big for topic '%s'." % \
+          (len(data), self.name))
+
+    with self.condition:
+      sequence = self.latest_sequence() + 1
+      index = sequence % self.slots
+      start = index * self.slot_size
+
+      self.meta["sequence"][index] = -1
+      self.data[start:(start + len(data))] = np.frombuffer(data,
+          dtype = np.uint8)
+      self.meta["length"][index] = len(data)
+      self.meta["sequence"][index] = sequence
+      self.head[0] = sequence
+
+      self.condition.notify_all()
+
+  # Gets the pickled data for a message, or None if it's not in the ring
+  # anymore.
+  def read(self, sequence):
+    index = sequence % self.slots
+    if self.meta["sequence"][index] != sequence:
+      return None
+
+    start = index * self.slot_size
+    data = self.data[start:(start + self.meta["length"][index])].tostring()
+
+    # Make sure it didn't get overwritten while we were reading it.
+    if self.meta["sequence"][index] != sequence:
+      return None
+    return data
+
+  # Waits until there is a message newer than after. Returns False if we timed
+  # out.
+  def wait(self, after, timeout = None):
+    if timeout != None:
+      end = time.time() + timeout
+
+    with self.condition:
+      while self.latest_sequence() <= after:
+        if timeout == None:
+          self.condition.wait()
+        else:
+          remaining = end - time.time()
+          if remaining <= 0:
+            return False
+          self.condition.wait(remaining)
+
+    return True
+
+# One program's subscription to a topic.
+class Subscription:
+  def __init__(self, topic, policy = DROP_OLDEST, size = None):
+    if policy not in (DROP_OLDEST, LATEST_ONLY):
+      raise ValueError("Unknown subscription policy '%s'." % (policy))
+
+    self.topic = topic
+    self.policy = policy
+    # How many messages we buffer before dropping the oldest ones. This can't
+    # be more than the topic holds.
+    self.size = min(size or topic.slots, topic.slots)
+    # Sequence number of the last message we got. We only get messages
+    # published after we subscribed.
+    self.cursor = topic.latest_sequence()
+    # How many messages we missed because we fell behind.
+    self.dropped = 0
+
+  # Gets the next message. Raises Queue.Empty if there isn't one and we're not
+  # blocking, or if we time out.
+  def receive(self, block = True, timeout = None):
+    while True:
+      head = self.topic.latest_sequence()
+      if head <= self.cursor:
+        if not block:
+          raise Empty
+        if not self.topic.wait(self.cursor, timeout):
+          raise Empty
+        continue
+
+      if self.policy == LATEST_ONLY:
+        sequence = head
+      else:
+        sequence = max(self.cursor + 1, head - self.size + 1)
+        self.dropped += sequence - self.cursor - 1
+
+      data = self.topic.read(sequence)
+      self.cursor = sequence
+      if data == None:
+        # It got overwritten, so try again with something newer.
+        self.dropped += 1
+        continue
+
+      return cPickle.loads(data)
+
+  # Gets every message that is waiting, without blocking.
+  def receive_all(self):
+    messages = []
+    while True:
+      try:
+        messages.append(self.receive(False))
+      except Empty:
+        return messages